@@ -0,0 +1,152 @@
+"""
+quiz and class score statistics computed by the database
+
+the score distribution of a quiz comes from one windowed query returning a row per distinct
+total score (scores are integers up to the quiz credit, so this stays small for any number of
+takers), percentiles and histograms are derived from it. with numpy installed and
+ANALYTICS_NUMPY on, percentiles and histograms are computed by numpy instead.
+
+quiz statistics are cached per quiz, score changes (core.signals, core.grading) invalidate them,
+new submissions show up within ANALYTICS_CACHE_TIMEOUT seconds.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Max, Min, Q, StdDev, Window
+from django.db.models.functions import CumeDist
+
+from core.models import Answer, QuizAnswer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def use_numpy():
+    return numpy is not None and settings.ANALYTICS_NUMPY
+
+
+def score_distribution(quiz_id):
+    """
+    [{'score', 'count', 'percentile_rank'}] of the session total scores of a quiz, by score
+    """
+    rows = QuizAnswer.objects.filter(quiz_id=quiz_id) \
+        .annotate(count=Window(Count('id'), partition_by=[F('total_score')]),
+                  percentile_rank=Window(CumeDist(), order_by=F('total_score').asc())) \
+        .values('total_score', 'count', 'percentile_rank').distinct().order_by('total_score')
+
+    return [{'score': row['total_score'], 'count': row['count'],
+             'percentile_rank': round(row['percentile_rank'] * 100, 2)} for row in rows]
+
+
+def _percentile(distribution, total, percentile):
+    # linear interpolation between the closest ranks, as numpy.percentile does
+    position = (total - 1) * percentile / 100
+    lower, upper = math.floor(position), math.ceil(position)
+
+    values, seen = {}, 0
+    for row in distribution:
+        for rank in (lower, upper):
+            if seen <= rank < seen + row['count']:
+                values[rank] = row['score']
+        seen += row['count']
+
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def percentiles(distribution):
+    total = sum(row['count'] for row in distribution)
+    if not total:
+        return {}
+
+    if use_numpy():
+        scores = numpy.repeat([row['score'] for row in distribution], [row['count'] for row in distribution])
+        values = numpy.percentile(scores, PERCENTILES)
+        return {'p%s' % p: float(value) for p, value in zip(PERCENTILES, values)}
+
+    return {'p%s' % p: float(_percentile(distribution, total, p)) for p in PERCENTILES}
+
+
+def histogram(distribution, bins, credit):
+    """
+    [{'from', 'to', 'count'}] of bins equal width bins over 0..credit, the last bin includes credit
+    """
+    high = max([credit] + [row['score'] for row in distribution])
+    width = (high or 1) / bins
+
+    if use_numpy():
+        counts, edges = numpy.histogram([row['score'] for row in distribution], bins=bins, range=(0, high or 1),
+                                        weights=[row['count'] for row in distribution])
+        counts = [int(count) for count in counts]
+    else:
+        counts = [0] * bins
+        for row in distribution:
+            index = min(bins - 1, max(0, int(row['score'] // width)))
+            counts[index] += row['count']
+
+    return [{'from': round(index * width, 2), 'to': round((index + 1) * width, 2), 'count': count}
+            for index, count in enumerate(counts)]
+
+
+def question_difficulty(quiz_id):
+    """
+    per question answer counts and mean score, difficulty is the mean share of the credit earned
+    """
+    rows = Answer.objects.filter(question__quiz_id=quiz_id) \
+        .values('question_id', 'question__text', 'question__credit') \
+        .annotate(answered=Count('id'), graded=Count('id', filter=Q(is_graded=True)),
+                  full_credit=Count('id', filter=Q(score__gte=F('question__credit'))), mean_score=Avg('score')) \
+        .order_by('question_id')
+
+    return [{'question': row['question_id'], 'text': row['question__text'], 'credit': row['question__credit'],
+             'answered': row['answered'], 'graded': row['graded'], 'full_credit': row['full_credit'],
+             'mean_score': row['mean_score'],
+             'difficulty': row['mean_score'] / row['question__credit'] if row['question__credit'] else None}
+            for row in rows]
+
+
+def quiz_analytics_key(quiz_id):
+    return 'core:quiz-analytics:%s' % quiz_id
+
+
+def invalidate_quiz_analytics(*quiz_ids):
+    cache.delete_many([quiz_analytics_key(quiz_id) for quiz_id in quiz_ids])
+
+
+def quiz_analytics(quiz):
+    """
+    statistics of a quiz, cached until its scores or questions change
+    """
+    analytics = cache.get(quiz_analytics_key(quiz.id))
+    if analytics is not None and analytics['questions_version'] == quiz.questions_version:
+        return analytics
+
+    summary = QuizAnswer.objects.filter(quiz_id=quiz.id).aggregate(
+        takers=Count('id'), mean=Avg('total_score'), stddev=StdDev('total_score'),
+        min=Min('total_score'), max=Max('total_score'))
+    distribution = score_distribution(quiz.id)
+
+    analytics = dict(summary, quiz=quiz.id, credit=quiz.credit, questions_version=quiz.questions_version,
+                     percentiles=percentiles(distribution), distribution=distribution,
+                     questions=question_difficulty(quiz.id))
+    analytics['median'] = analytics['percentiles'].get('p50')
+
+    cache.set(quiz_analytics_key(quiz.id), analytics, settings.ANALYTICS_CACHE_TIMEOUT)
+    return analytics
+
+
+def class_analytics(class_id):
+    """
+    per quiz summary of the quizzes of a class, in one grouped query
+    """
+    rows = QuizAnswer.objects.filter(quiz__class_room_id=class_id) \
+        .values('quiz_id', 'quiz__quiz_name', 'quiz__total_credit') \
+        .annotate(takers=Count('id'), mean=Avg('total_score'), min=Min('total_score'), max=Max('total_score')) \
+        .order_by('quiz_id')
+
+    return [{'quiz': row['quiz_id'], 'quiz_name': row['quiz__quiz_name'], 'credit': row['quiz__total_credit'],
+             'takers': row['takers'], 'mean': row['mean'], 'min': row['min'], 'max': row['max']} for row in rows]
@@ -0,0 +1,227 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from core.answers import upsert_answers
+from core.db import write_atomic
+from core.models import Question, QuizAnswer
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerBuffer:
+    """
+    write-behind buffer for submitted answers
+
+    answers are appended to a local journal file before they are acknowledged, kept in memory
+    keyed by (quiz_answer, question) so the last write wins, and written to the database in
+    one batch every flush interval, or at the quiz end if that comes first. journals of a
+    process that died before flushing are replayed by the next buffer started on the same
+    journal directory.
+    """
+
+    def __init__(self, journal_dir, interval, fsync=True):
+        self.journal_dir = journal_dir
+        self.interval = interval
+        self.fsync = fsync
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.timer = None
+        self.timer_due = None
+
+        self.sequence = 0
+        self.journal = None
+        # journals rotated out for a flush, kept open (and locked) until their answers are written
+        self.flushing = []
+
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def add(self, quiz_answer_id, question_id, text, deadline=None):
+        """
+        journal and buffer an answer, deadline is the quiz end as a timestamp
+        """
+        with self.lock:
+            if self.journal is None:
+                self.journal = self._open_journal()
+
+            self.journal.write(json.dumps([quiz_answer_id, question_id, text]) + '\n')
+            self.journal.flush()
+            if self.fsync:
+                os.fsync(self.journal.fileno())
+
+            self.pending[(quiz_answer_id, question_id)] = text
+
+            self._schedule(deadline)
+
+    def flush(self):
+        """
+        write every pending answer, returns the number of answers written
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                if self.journal is not None:
+                    self.flushing.append(self.journal)
+                    self.journal = None
+
+            if pending:
+                try:
+                    write_answers(pending)
+                except Exception:
+                    with self.lock:
+                        # keep newer answers, journals stay on disk until a flush succeeds
+                        self.pending = {**pending, **self.pending}
+                    raise
+
+            for journal in self.flushing:
+                os.remove(journal.name)
+                journal.close()
+            self.flushing = []
+
+            return len(pending)
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = self.timer_due = None
+        self.flush()
+
+    def _schedule(self, deadline=None):
+        # called with self.lock held
+        due = time.time() + self.interval
+        if deadline is not None:
+            due = max(min(due, deadline), time.time())
+
+        if self.timer is not None:
+            if self.timer_due <= due:
+                return
+            self.timer.cancel()
+
+        self.timer = threading.Timer(due - time.time(), self._flush_from_timer)
+        self.timer.daemon = True
+        self.timer_due = due
+        self.timer.start()
+
+    def _flush_from_timer(self):
+        with self.lock:
+            self.timer = self.timer_due = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing buffered answers failed, retrying after the flush interval")
+            with self.lock:
+                self._schedule()
+        finally:
+            connection.close()
+
+    def _open_journal(self):
+        self.sequence += 1
+        journal = open(os.path.join(self.journal_dir, 'answers-%s-%s.jsonl' % (os.getpid(), self.sequence)), 'a')
+        fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return journal
+
+
+def write_answers(pending):
+    """
+    write {(quiz_answer_id, question_id): text} in one transaction,
+    answers whose question or session was deleted meanwhile are dropped
+    """
+    question_ids = set(Question.objects.filter(pk__in={question_id for _, question_id in pending})
+                       .values_list('pk', flat=True))
+    quiz_answer_ids = set(QuizAnswer.objects.filter(pk__in={quiz_answer_id for quiz_answer_id, _ in pending})
+                          .values_list('pk', flat=True))
+
+    by_session = defaultdict(dict)
+    for (quiz_answer_id, question_id), text in pending.items():
+        if quiz_answer_id in quiz_answer_ids and question_id in question_ids:
+            by_session[quiz_answer_id][question_id] = text
+
+    with write_atomic():
+        for quiz_answer_id, texts in by_session.items():
+            upsert_answers(quiz_answer_id, texts)
+
+
+def _modified_time(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+
+def recover_journals(journal_dir):
+    """
+    replay journals left by processes that died before flushing, returns the number of answers written
+
+    journals are locked by their owning process, so journals of running buffers are skipped
+    """
+    journals = []
+    for path in sorted(glob.glob(os.path.join(journal_dir, 'answers-*.jsonl')), key=_modified_time):
+        # another process may replay and remove a journal at any point
+        try:
+            journal = open(path)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # removed while waiting for the lock, its answers are already written
+            if os.fstat(journal.fileno()).st_ino != os.stat(path).st_ino:
+                raise FileNotFoundError(path)
+        except (BlockingIOError, FileNotFoundError):
+            journal.close()
+            continue
+        journals.append(journal)
+
+    pending = {}
+    try:
+        for journal in journals:
+            for line in journal:
+                try:
+                    quiz_answer_id, question_id, text = json.loads(line)
+                except ValueError:
+                    # a line cut by a crash was never acknowledged
+                    continue
+                pending[(quiz_answer_id, question_id)] = text
+
+        if pending:
+            write_answers(pending)
+
+        for journal in journals:
+            os.remove(journal.name)
+    finally:
+        for journal in journals:
+            journal.close()
+
+    return len(pending)
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_answer_buffer():
+    """
+    the answer buffer of this process for the configured journal directory
+    """
+    journal_dir = settings.ANSWER_JOURNAL_DIR
+
+    with _buffers_lock:
+        if journal_dir not in _buffers:
+            if os.path.isdir(journal_dir):
+                recover_journals(journal_dir)
+            buffer = AnswerBuffer(journal_dir, settings.ANSWER_FLUSH_INTERVAL, settings.ANSWER_JOURNAL_FSYNC)
+            atexit.register(buffer.close)
+            _buffers[journal_dir] = buffer
+
+        return _buffers[journal_dir]
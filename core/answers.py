@@ -0,0 +1,59 @@
+"""
+answer writes of the bulk submit and the write-behind buffer
+
+bulk_create and bulk_update skip the answer signals, so what they keep up to date is done
+here: session totals, the gradebook submission time and the quiz analytics cache. answer
+texts don't change scores, so there are no answer.scored events to publish.
+"""
+from django.db import IntegrityError, transaction
+
+from core.analytics import invalidate_quiz_analytics
+from core.db import write_atomic
+from core.gradebook import mark_gradebook_submitted
+from core.models import Answer, QuizAnswer
+from core.totals import add_to_quiz_answer_totals
+
+
+def _invalidate_session_analytics(quiz_answer_id):
+    quiz_id = QuizAnswer.objects.filter(pk=quiz_answer_id).values_list('quiz_id', flat=True).first()
+    if quiz_id is not None:
+        invalidate_quiz_analytics(quiz_id)
+
+
+def _write_answers(quiz_answer_id, texts):
+    with write_atomic():
+        existing = {answer.question_id: answer for answer in
+                    Answer.objects.select_for_update().filter(quiz_answer_id=quiz_answer_id,
+                                                              question_id__in=texts.keys())}
+        to_create, to_update = [], []
+
+        for question_id, text in texts.items():
+            if question_id in existing:
+                existing[question_id].answer = text
+                existing[question_id].is_graded = False
+                to_update.append(existing[question_id])
+            else:
+                to_create.append(Answer(question_id=question_id, quiz_answer_id=quiz_answer_id, answer=text))
+
+        Answer.objects.bulk_create(to_create)
+        Answer.objects.bulk_update(to_update, ['answer', 'is_graded'])
+        add_to_quiz_answer_totals(quiz_answer_id, answered=len(to_create))
+        mark_gradebook_submitted(quiz_answer_id)
+        # answered and graded counts changed
+        transaction.on_commit(lambda: _invalidate_session_analytics(quiz_answer_id))
+
+    return existing
+
+
+def upsert_answers(quiz_answer_id, texts):
+    """
+    create or update the answers of a quiz answer session in one transaction
+
+    texts maps question ids (already checked to belong to the session quiz) to answer texts,
+    returns the answers that already existed, keyed by question id
+    """
+    try:
+        return _write_answers(quiz_answer_id, texts)
+    except IntegrityError:
+        # a concurrent submit created some of the answers, they are updated on retry
+        return _write_answers(quiz_answer_id, texts)
@@ -3,7 +3,9 @@ from django.urls import path
 from .views import UserProfileCreateView, ClassRoomCreateView, ClassRoomRetrieveView, QuizCreateView, RegisterQuitClass, \
     AddRemoveStudentClass, ClassRoomUpdateView, QuizQuestionsList, AddQuizQuestion, RUDQuestion, StartQuiz, \
     CreateAnswer, QuizAnswerDetailedView, SetScoreView, ClassList, AuthenticateView, QuizUpdateView, QuizTakersList, \
-    QuizPublishView
+    QuizPublishView, SubmitAnswers, ClassStudentsList, SetScores, GradeQuiz, \
+    ExportResults, QuizAnalytics, ClassAnalytics, MyGrades, EnrollRoster, ProfileList, ProfileDetail, \
+    EventStream, EventTicket
 
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
@@ -29,11 +31,13 @@ urlpatterns = [
     path('class/create/', ClassRoomCreateView.as_view()),
     path('class/<int:class_id>/', ClassRoomRetrieveView.as_view()),
     path('class/list/', ClassList.as_view()),
+    path('class/<int:class_id>/students/', ClassStudentsList.as_view()),
     path('class/<int:class_id>/update/', ClassRoomUpdateView.as_view()),
 
     # class enrollments
     path('class/<int:class_id>/register/', RegisterQuitClass.as_view()),
     path('class/<int:class_id>/register/<user_username>/', AddRemoveStudentClass.as_view()),
+    path('class/<int:class_id>/roster/', EnrollRoster.as_view()),
 
     # quiz create/update
     path('class/<int:class_id>/quiz/create/', QuizCreateView.as_view()),
@@ -45,16 +49,33 @@ urlpatterns = [
     path('question/<int:question_id>/', RUDQuestion.as_view()),
 
     # take exam APIs
-    path('quiz/<int:quiz_id>/questions/', QuizQuestionsList.as_view()),
-    path('quiz/<int:quiz_id>/start/', StartQuiz.as_view()),
-    path('submit-answer/', CreateAnswer.as_view()),
+    path('quiz/<int:quiz_id>/questions/', QuizQuestionsList.as_view(), name='quiz-questions'),
+    path('quiz/<int:quiz_id>/start/', StartQuiz.as_view(), name='quiz-start'),
+    path('submit-answer/', CreateAnswer.as_view(), name='submit-answer'),
+    path('quiz-answer/<int:quiz_answer_id>/submit-answers/', SubmitAnswers.as_view()),
     path('quiz-answer/<int:quiz_answer_id>/', QuizAnswerDetailedView.as_view()),
     path('answer/<int:answer_id>/set-score/', SetScoreView.as_view()),
+    path('quiz/<int:quiz_id>/set-scores/', SetScores.as_view()),
+    path('quiz/<int:quiz_id>/grade/', GradeQuiz.as_view()),
 
     path('quiz/<int:quiz_id>/takers/list/', QuizTakersList.as_view()),
+    path('quiz/<int:quiz_id>/export/', ExportResults.as_view()),
+    path('class/<int:class_id>/export/', ExportResults.as_view()),
+    path('quiz/<int:quiz_id>/analytics/', QuizAnalytics.as_view()),
+    path('class/<int:class_id>/analytics/', ClassAnalytics.as_view()),
+
+    path('my/grades/', MyGrades.as_view()),
+
+    # event streams, served by core.async_exam
+    path('events/ticket/', EventTicket.as_view()),
+    path('quiz/<int:quiz_id>/events/', EventStream.as_view(), name='quiz-events'),
+    path('class/<int:class_id>/events/', EventStream.as_view(), name='class-events'),
 
     path('api-token-auth/', AuthenticateView.as_view()),
 
+    path('profiles/', ProfileList.as_view()),
+    path('profiles/<name>/', ProfileDetail.as_view()),
+
     url(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     url(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     url(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from core import signals, db  # noqa: F401
+        from core.metrics import install_serializer_timing
+
+        if settings.METRICS_ENABLED:
+            install_serializer_timing()
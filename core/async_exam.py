@@ -0,0 +1,499 @@
+"""
+native async handlers for the exam taking endpoints and the quiz / class event streams,
+served by the ASGI application
+
+django 3.0 runs every view in a thread under ASGI, so with ASYNC_EXAM_ENDPOINTS on the question
+list, quiz start and answer submit are routed here before django, by the url names of core.apis.
+parsing, token checks against the token cache and responses run on the event loop; database work
+runs on a dedicated pool of threads that keep their connections between requests. the response
+headers of the security, cors and clickjacking middleware are added to the native responses.
+requests without a token (session or basic auth), cors preflights and every other path are
+handled by django as usual.
+
+django 3.0 also iterates streaming responses on the event loop, where the ORM refuses to run,
+ASGIHandler reads them on a thread of their own instead.
+"""
+import asyncio
+import functools
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler as DjangoASGIHandler, ASGIRequest
+from django.db import close_old_connections, connections
+from django.http import HttpResponse, QueryDict
+from django.urls import Resolver404, resolve
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext as _
+from rest_framework import exceptions
+
+from core.answer_buffer import get_answer_buffer
+from core.authentication import token_cache, CachedTokenAuthentication
+from core.caching import quiz_questions_etag, quiz_questions_payload
+from core.context import request_objects
+from core.events import get_broker, quiz_channel, quiz_user_channel, class_channel, redeem_ticket
+from core.metrics import RequestMetrics, observe_queries, record_request
+from core.profiling import profiled, should_profile
+from core.renderers import JSONRenderer, loads
+from core.permissions import CanSeeQuizQuestions, IsEnrolledInClass, IsQuizActive, IsTeacherOrSuperuser
+from core.serializers import QuizAnswerSerializer, AnswerSerializer, QuizSerializer
+
+logger = logging.getLogger('django.request')
+
+_executor = None
+
+
+def db_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix='async-db')
+    return _executor
+
+
+def _with_connection(function, *args):
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_db(function, *args):
+    """
+    run a database touching function on the database executor
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(db_executor(), functools.partial(_with_connection, function, *args))
+
+
+def _observed(metrics, function, *args):
+    with observe_queries(metrics):
+        return function(*args)
+
+
+def _profiled(route, function, *args):
+    with profiled(route):
+        return function(*args)
+
+
+class ExamRequest(SimpleNamespace):
+    """
+    the parts of a request the exam handlers, permissions and serializers use, query_params
+    is the QueryDict of the query string as on a rest_framework request
+    """
+
+
+def _check(permission, request, view):
+    if not permission.has_permission(request, view):
+        raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+
+
+def quiz_questions(request, quiz_id):
+    view = SimpleNamespace(kwargs={'quiz_id': quiz_id})
+    _check(CanSeeQuizQuestions(), request, view)
+
+    quiz = request_objects(request).quiz(quiz_id)
+    etag = quiz_questions_etag(quiz)
+
+    if etag in parse_etags(request.headers.get('if-none-match', '')):
+        return 304, None, {'ETag': etag}
+
+    return 200, quiz_questions_payload(quiz), {'ETag': etag}
+
+
+def start_quiz(request, quiz_id):
+    view = SimpleNamespace(kwargs={'quiz_id': quiz_id})
+    quiz = request_objects(request).quiz(quiz_id)
+
+    if not IsEnrolledInClass.is_enrolled_in_class(quiz.class_room_id, request):
+        raise exceptions.PermissionDenied(IsEnrolledInClass.message)
+    _check(IsQuizActive(), request, view)
+
+    serializer = QuizAnswerSerializer(data=request.data, context={'request': request})
+    serializer.is_valid(raise_exception=True)
+    serializer.save(quiz=quiz)
+
+    return 201, serializer.data, {}
+
+
+def submit_answer(request):
+    serializer = AnswerSerializer(data=request.data, context={'request': request})
+    serializer.is_valid(raise_exception=True)
+
+    if not settings.ANSWER_WRITE_BEHIND:
+        serializer.save()
+        return 201, serializer.data, {}
+
+    quiz_answer = serializer.validated_data.get('quiz_answer')
+    question = serializer.validated_data.get('question')
+    answer = serializer.validated_data.get('answer')
+    quiz = request_objects(request).quiz(quiz_answer.quiz_id)
+
+    get_answer_buffer().add(quiz_answer.id, question.id, answer, deadline=quiz.end_datetime.timestamp())
+
+    return 202, {'question': question.id, 'quiz_answer': quiz_answer.id, 'answer': answer}, {}
+
+
+# (method, handler) of the natively served exam endpoints, by url name
+ROUTES = {
+    'quiz-questions': ('GET', quiz_questions),
+    'quiz-start': ('POST', start_quiz),
+    'submit-answer': ('POST', submit_answer),
+}
+
+
+def _check_class_member(class_id, request):
+    if not IsTeacherOrSuperuser.is_teacher_or_superuser(class_id, request) and \
+            not IsEnrolledInClass.is_enrolled_in_class(class_id, request):
+        raise exceptions.PermissionDenied(IsEnrolledInClass.message)
+
+
+def quiz_events(request, quiz_id):
+    """
+    channels and first event of a quiz event stream, class teachers and students only
+    """
+    quiz = request_objects(request).quiz(quiz_id)
+    _check_class_member(quiz.class_room_id, request)
+
+    channels = [quiz_channel(quiz.id), quiz_user_channel(quiz.id, request.user.user_profile.id)]
+    return channels, {'type': 'quiz.state', 'quiz': QuizSerializer(instance=quiz).data}
+
+
+def class_events(request, class_id):
+    """
+    channels and first event of a class event stream, class teachers and students only
+    """
+    the_class = request_objects(request).class_room(class_id)
+    _check_class_member(the_class.id, request)
+
+    return [class_channel(the_class.id)], {'type': 'class.state', 'class_id': the_class.id}
+
+
+# event stream handlers by url name, the streams are only served here
+STREAM_ROUTES = {
+    'quiz-events': quiz_events,
+    'class-events': class_events,
+}
+
+# middleware of settings.MIDDLEWARE whose response headers are added to the native responses
+RESPONSE_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+
+class ExamEndpointsRouter:
+    """
+    ASGI application serving the event streams, the exam endpoints when ASYNC_EXAM_ENDPOINTS
+    is on, and everything else through django
+    """
+
+    def __init__(self, django_application):
+        self.django_application = django_application
+        self.renderer = JSONRenderer()
+        # django applies response middleware from the innermost one out
+        self.response_middleware = [import_string(path)() for path in reversed(settings.MIDDLEWARE)
+                                    if path in RESPONSE_MIDDLEWARE]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            try:
+                match = resolve(scope['path'])
+            except Resolver404:
+                match = None
+
+            if match is not None and match.url_name in STREAM_ROUTES and scope['method'] == 'GET':
+                headers = self.request_headers(scope)
+                await self.stream(scope, receive, send, headers, STREAM_ROUTES[match.url_name], match.kwargs)
+                return
+
+            if match is not None and match.url_name in ROUTES and settings.ASYNC_EXAM_ENDPOINTS:
+                method, handler = ROUTES[match.url_name]
+                headers = self.request_headers(scope)
+                authorization = headers.get('authorization', '').split()
+                key = authorization[1] if len(authorization) == 2 and authorization[0].lower() == 'token' else None
+                json_body = method == 'GET' or headers.get('content-type', '').startswith('application/json')
+
+                if key and json_body and scope['method'] == method:
+                    await self.handle(scope, receive, send, headers, key, match.route, handler, match.kwargs)
+                    return
+
+        await self.django_application(scope, receive, send)
+
+    @staticmethod
+    def request_headers(scope):
+        return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+
+    def response_headers(self, scope, status, headers):
+        """
+        raw headers of a native response, with the headers added by the response middleware
+        """
+        response = HttpResponse(status=status)
+        for name, value in headers.items():
+            response[name] = value
+
+        request = ASGIRequest(scope, io.BytesIO())
+        for middleware in self.response_middleware:
+            response = middleware.process_response(request, response)
+        return [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.items()]
+
+    async def send_response(self, scope, send, status, content, headers):
+        headers = dict(headers, **{'Content-Type': 'application/json', 'Content-Length': str(len(content))})
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': self.response_headers(scope, status, headers)})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def stream(self, scope, receive, send, headers, handler, kwargs):
+        """
+        server-sent events of the channels returned by handler, until the client disconnects
+        """
+        authorization = headers.get('authorization', '').split()
+        key = authorization[1] if len(authorization) == 2 and authorization[0].lower() == 'token' else None
+        # browsers' EventSource can not set headers, they get a stream ticket instead (see core.events)
+        ticket = parse_qs(scope.get('query_string', b'').decode('latin1')).get('ticket', [None])[0]
+
+        try:
+            if key is not None:
+                user = await self.authenticate(key)
+            elif ticket is not None:
+                user = await run_db(redeem_ticket, ticket)
+            else:
+                raise exceptions.NotAuthenticated()
+            request = ExamRequest(user=user, data={}, headers={}, query_params=QueryDict())
+            channels, first_event = await run_db(handler, request, *kwargs.values())
+        except Exception as error:
+            await self.send_error(scope, send, self.api_exception(scope, error))
+            return
+
+        subscription = get_broker().subscribe(channels)
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        # quiz of a quiz stream, class streams follow every quiz of the class
+        stream_quiz = first_event.get('quiz')
+        lifecycle = self.lifecycle_times(stream_quiz) if stream_quiz else {}
+
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': self.response_headers(scope, 200, {
+                'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})})
+            await self.send_event(send, first_event)
+
+            while not disconnected.done():
+                now = time.time()
+                timeout = settings.EVENT_HEARTBEAT_INTERVAL
+                if lifecycle:
+                    timeout = max(0, min(timeout, min(lifecycle.values()) - now))
+
+                next_event = asyncio.ensure_future(subscription.get())
+                done, pending = await asyncio.wait({next_event, disconnected}, timeout=timeout,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+
+                if next_event in done:
+                    event = next_event.result()
+                    await self.send_event(send, event)
+                    if event['type'] in ('quiz.created', 'quiz.updated', 'quiz.deleted'):
+                        quiz_id = event['quiz']['id']
+                        lifecycle = {key: at for key, at in lifecycle.items() if key[0] != quiz_id}
+                        if event['type'] != 'quiz.deleted':
+                            lifecycle.update(self.lifecycle_times(event['quiz']))
+                        elif stream_quiz and quiz_id == stream_quiz['id']:
+                            break
+                    continue
+
+                next_event.cancel()
+                if disconnected.done():
+                    break
+
+                due = sorted((at, key) for key, at in lifecycle.items() if at <= time.time())
+                for at, (quiz_id, name) in due:
+                    del lifecycle[quiz_id, name]
+                    await self.send_event(send, {'type': name, 'quiz_id': quiz_id})
+                if not due:
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+    @staticmethod
+    def lifecycle_times(quiz):
+        """
+        upcoming quiz.started / quiz.ended times of a serialized quiz, as timestamps
+        by (quiz id, event type)
+        """
+        now, times = time.time(), {}
+        for name, field in (('quiz.started', 'start_datetime'), ('quiz.ended', 'end_datetime')):
+            at = parse_datetime(quiz[field]).timestamp()
+            if at > now:
+                times[quiz['id'], name] = at
+        return times
+
+    async def send_event(self, send, event):
+        message = b'event: ' + event['type'].encode() + b'\ndata: ' + self.renderer.render(event) + b'\n\n'
+        await send({'type': 'http.response.body', 'body': message, 'more_body': True})
+
+    async def send_error(self, scope, send, error):
+        status, payload, headers = self.error_response(error)
+        await self.send_response(scope, send, status, self.renderer.render(payload), headers)
+
+    def error_response(self, error):
+        headers = {}
+        if isinstance(error, (exceptions.AuthenticationFailed, exceptions.NotAuthenticated)):
+            headers['WWW-Authenticate'] = CachedTokenAuthentication.keyword
+        return error.status_code, self.error_payload(error), headers
+
+    @staticmethod
+    def api_exception(scope, error):
+        """
+        the error as an APIException, unexpected errors are logged and become a 500
+        """
+        if isinstance(error, exceptions.APIException):
+            return error
+        logger.error('Internal Server Error: %s', scope['path'], exc_info=error)
+        return exceptions.APIException()
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    async def handle(self, scope, receive, send, headers, key, route, handler, kwargs):
+        started = time.perf_counter()
+        metrics = RequestMetrics(capture_sql=bool(settings.SLOW_REQUEST_THRESHOLD))
+        if should_profile(headers.get('x-profile')):
+            handler = functools.partial(_profiled, route, handler)
+        body = await self.read_body(receive)
+
+        try:
+            user = await self.authenticate(key)
+            data = self.parse(body)
+
+            # ?fields= and ?expand= reach SparseFieldsMixin as with a rest_framework request
+            query_params = QueryDict(scope.get('query_string', b''))
+            request = ExamRequest(user=user, data=data, headers=headers, query_params=query_params)
+            status, payload, response_headers = await run_db(_observed, metrics, handler, request, *kwargs.values())
+        except Exception as error:
+            status, payload, response_headers = self.error_response(self.api_exception(scope, error))
+
+        content = b''
+        try:
+            content = self.renderer.render(payload) if payload is not None else b''
+            await self.send_response(scope, send, status, content, response_headers)
+        finally:
+            # recorded too when rendering fails or the client is gone
+            if settings.METRICS_ENABLED:
+                record_request(route, scope['method'], status, time.perf_counter() - started, metrics, len(content))
+
+    @staticmethod
+    async def authenticate(key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = await run_db(CachedTokenAuthentication().authenticate_credentials, key)
+        elif not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user
+
+    @staticmethod
+    def parse(body):
+        data = loads(body) if body else {}
+        if not isinstance(data, dict):
+            raise exceptions.ParseError()
+        return data
+
+    @staticmethod
+    def error_payload(error):
+        if isinstance(error.detail, (list, dict)):
+            return error.detail
+        return {'detail': error.detail}
+
+    @staticmethod
+    async def read_body(receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+        return body
+
+
+class ASGIHandler(DjangoASGIHandler):
+    """
+    django's ASGI handler reading streaming responses (e.g. exports) on a thread of their own
+
+    the thread keeps the database connection of the running query for the whole response,
+    parts are handed to the event loop through a bounded queue so memory stays constant
+    """
+    max_pending_parts = 16
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+
+        headers = [(header.encode('ascii') if isinstance(header, str) else header,
+                    value.encode('latin1') if isinstance(value, str) else value)
+                   for header, value in response.items()]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                    for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        loop = asyncio.get_event_loop()
+        parts = asyncio.Queue(maxsize=self.max_pending_parts)
+        stopped = threading.Event()
+        done = object()
+
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(parts.put(item), loop)
+            while True:
+                try:
+                    return future.result(timeout=1)
+                except TimeoutError:
+                    if stopped.is_set():
+                        future.cancel()
+                        raise
+
+        def read():
+            try:
+                try:
+                    for part in response:
+                        put(part)
+                except TimeoutError:
+                    raise
+                except Exception as error:
+                    # raised on the event loop, the client sees a broken response rather than a short one
+                    put(error)
+                else:
+                    put(done)
+            except TimeoutError:
+                # the client went away
+                pass
+            finally:
+                response.close()
+                connections.close_all()
+
+        threading.Thread(target=read, name='streaming-response', daemon=True).start()
+
+        try:
+            while True:
+                part = await parts.get()
+                if part is done:
+                    break
+                if isinstance(part, Exception):
+                    raise part
+                for chunk, last in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            stopped.set()
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    """
+    bounded in-process cache of token key -> token (with user and user profile loaded),
+    least recently used entries are dropped first and entries expire after the timeout
+
+    invalidation (core.signals) only reaches the cache of the current process,
+    other workers see token or user changes once their entries expire
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            token, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return token
+
+    def set(self, key, token):
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (token, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_user(self, user_id):
+        with self.lock:
+            for key in [key for key, (token, expires) in self.entries.items() if token.user_id == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(getattr(settings, 'TOKEN_CACHE_SIZE', 10000), getattr(settings, 'TOKEN_CACHE_TIMEOUT', 60))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    token authentication resolving token -> user -> user profile in one query,
+    the result is kept in the process token cache
+
+    cached users are shared between the requests of the process, treat request.user as read only
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user__user_profile').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+            token_cache.set(key, token)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
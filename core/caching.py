@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import quote_etag
+
+from core.serializers import PublicQuestionSerializer
+
+
+def quiz_questions_etag(quiz):
+    return quote_etag('quiz-%s-questions-%s' % (quiz.id, quiz.questions_version))
+
+
+def quiz_questions_payload(quiz):
+    """
+    serialized question list of the quiz, cached per questions version so it is
+    built once per quiz change instead of once per student
+    """
+    key = 'core:quiz-questions:%s:%s' % (quiz.id, quiz.questions_version)
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = PublicQuestionSerializer(instance=quiz.questions.all().order_by('id'), many=True).data
+        payload = [dict(question) for question in payload]
+        cache.set(key, payload, getattr(settings, 'QUESTIONS_CACHE_TIMEOUT', 60 * 60))
+
+    return payload
@@ -0,0 +1,66 @@
+from core.models import ClassRoom, Quiz, Question, QuizAnswer
+from core.utils import get_object
+
+
+class RequestObjects:
+    """
+    quiz / class room / teacher chain resolved once per request
+
+    permissions, views and serializers of the same request share the fetched
+    objects instead of hitting the database for each check
+    """
+
+    def __init__(self):
+        self.class_rooms = {}
+        self.quizzes = {}
+        self.questions = {}
+        self.quiz_answers = {}
+
+    def class_room(self, class_id):
+        class_id = int(class_id)
+        if class_id not in self.class_rooms:
+            self.class_rooms[class_id] = get_object(ClassRoom.objects.select_related('teacher'), pk=class_id)
+        return self.class_rooms[class_id]
+
+    def quiz(self, quiz_id):
+        quiz_id = int(quiz_id)
+        if quiz_id not in self.quizzes:
+            quiz = get_object(Quiz.objects.select_related('class_room__teacher'), pk=quiz_id)
+            self._remember_quiz(quiz)
+        return self.quizzes[quiz_id]
+
+    def question(self, question_id):
+        question_id = int(question_id)
+        if question_id not in self.questions:
+            question = get_object(Question.objects.select_related('quiz__class_room__teacher'), pk=question_id)
+            self.questions[question_id] = question
+            self._remember_quiz(question.quiz)
+        return self.questions[question_id]
+
+    def quiz_answer(self, quiz_answer_id):
+        quiz_answer_id = int(quiz_answer_id)
+        if quiz_answer_id not in self.quiz_answers:
+            quiz_answer = get_object(QuizAnswer.objects.select_related('quiz__class_room__teacher'),
+                                     pk=quiz_answer_id)
+            self.quiz_answers[quiz_answer_id] = quiz_answer
+            self._remember_quiz(quiz_answer.quiz)
+        return self.quiz_answers[quiz_answer_id]
+
+    def _remember_quiz(self, quiz):
+        # keep already loaded objects so the whole chain is shared
+        quiz = self.quizzes.setdefault(quiz.id, quiz)
+        self.class_rooms.setdefault(quiz.class_room_id, quiz.class_room)
+
+
+def request_objects(request):
+    """
+    return the objects memoized on the given (django or rest framework) request
+    """
+    request = getattr(request, '_request', request)
+
+    objects = getattr(request, '_request_objects', None)
+    if objects is None:
+        objects = RequestObjects()
+        request._request_objects = objects
+
+    return objects
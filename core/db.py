@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA %s = %s' % (pragma, value))
+
+
+class WriteAtomic(transaction.Atomic):
+    """
+    atomic block flagging the transaction it starts as a write transaction to the backend
+    """
+
+    def __enter__(self):
+        connection = transaction.get_connection(self.using)
+        connection.write_transaction = True
+        try:
+            super().__enter__()
+        finally:
+            connection.write_transaction = False
+
+
+def write_atomic(using=None, savepoint=True):
+    """
+    transaction.atomic for blocks that write, the sqlite backend takes the write lock when
+    the outermost one starts instead of upgrading to it after the first reads
+    """
+    return WriteAtomic(using, savepoint)
+
+
+@receiver(request_started)
+def close_unusable_connections(sender, **kwargs):
+    """
+    persistent connections can be dropped by the server between requests,
+    check them before the request uses them instead of failing mid request
+    """
+    if not getattr(settings, 'DATABASE_HEALTH_CHECKS', False):
+        return
+
+    for connection in connections.all():
+        if connection.connection is not None and connection.settings_dict['CONN_MAX_AGE'] != 0 and \
+                not connection.is_usable():
+            connection.close()
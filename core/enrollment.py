@@ -0,0 +1,105 @@
+import csv
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.db import write_atomic
+from core.models import ClassRoom, UserProfile
+
+Enrollment = ClassRoom.students.through
+
+ROSTER_BATCH_SIZE = 1000
+
+
+def _cache_key(user_profile_id):
+    return 'core:enrollment:%s' % user_profile_id
+
+
+def _cache_timeout():
+    return getattr(settings, 'ENROLLMENT_CACHE_TIMEOUT', 0)
+
+
+def enrolled_class_ids(user_profile_id):
+    """
+    ids of the classes the given user profile is enrolled in,
+    cached when ENROLLMENT_CACHE_TIMEOUT is set
+    """
+    class_ids = cache.get(_cache_key(user_profile_id)) if _cache_timeout() else None
+
+    if class_ids is None:
+        class_ids = frozenset(Enrollment.objects.filter(userprofile_id=user_profile_id)
+                              .values_list('classroom_id', flat=True))
+        if _cache_timeout():
+            cache.set(_cache_key(user_profile_id), class_ids, _cache_timeout())
+
+    return class_ids
+
+
+def is_enrolled(class_id, user_profile_id):
+    if _cache_timeout():
+        return int(class_id) in enrolled_class_ids(user_profile_id)
+
+    # uses the unique (classroom, userprofile) index of the through table
+    return Enrollment.objects.filter(classroom_id=class_id, userprofile_id=user_profile_id).exists()
+
+
+def invalidate_enrollment(*user_profile_ids):
+    if _cache_timeout():
+        cache.delete_many([_cache_key(user_profile_id) for user_profile_id in user_profile_ids])
+
+
+def _without_bom(lines):
+    # csv files saved by excel start with a byte order mark
+    lines = iter(lines)
+    for first in lines:
+        yield first.lstrip('\ufeff')
+        break
+    yield from lines
+
+
+def read_roster(lines):
+    """
+    usernames of the first column of csv lines, a "username" header row is skipped
+    """
+    for index, row in enumerate(csv.reader(_without_bom(lines))):
+        if not row or not row[0].strip():
+            continue
+        if index == 0 and row[0].strip().lower() == 'username':
+            continue
+        yield row[0].strip()
+
+
+def enroll_usernames(class_id, usernames, batch_size=ROSTER_BATCH_SIZE):
+    """
+    enroll the students with the given usernames in a class
+
+    usernames are resolved with an IN query and the enrollments inserted with
+    bulk_create, batch_size usernames at a time. returns a report with the number
+    of new and existing enrollments and the unknown usernames
+    """
+    usernames = list(dict.fromkeys(usernames))
+    report = {'enrolled': 0, 'already_enrolled': 0, 'unknown': []}
+    profile_ids = []
+
+    with write_atomic():
+        for start in range(0, len(usernames), batch_size):
+            batch = usernames[start:start + batch_size]
+            found = dict(UserProfile.objects.filter(user__username__in=batch).values_list('user__username', 'pk'))
+            report['unknown'] += [username for username in batch if username not in found]
+
+            ids = list(found.values())
+            existing = set(Enrollment.objects.filter(classroom_id=class_id, userprofile_id__in=ids)
+                           .values_list('userprofile_id', flat=True))
+            # ignore_conflicts covers enrollments added since the existing ones were read
+            Enrollment.objects.bulk_create([Enrollment(classroom_id=class_id, userprofile_id=profile_id)
+                                            for profile_id in ids if profile_id not in existing],
+                                           ignore_conflicts=True)
+
+            report['enrolled'] += len(ids) - len(existing)
+            report['already_enrolled'] += len(existing)
+            profile_ids += ids
+
+    # bulk_create skips m2m_changed
+    invalidate_enrollment(*profile_ids)
+
+    return report
@@ -0,0 +1,140 @@
+"""
+quiz and class events pushed to clients over server-sent events
+
+model signals (core.signals) publish events to channels of the configured EVENT_BROKER
+once the transaction commits, the ASGI application streams them to subscribed clients:
+
+    quiz:<id>                       lifecycle of a quiz (updated, published, questions changed)
+    quiz:<id>:user:<user_profile>   events of one student in a quiz (answer scored)
+    class:<id>                      quizzes created, updated or deleted in a class
+
+the in-memory broker only reaches clients connected to the same process, a broker with the
+same publish / subscribe interface on top of redis pub/sub serves several workers.
+
+browsers' EventSource can not set headers, so instead of the api token in the url they open a
+stream with a ticket: signed, valid for EVENT_TICKET_MAX_AGE seconds and usable once.
+"""
+import asyncio
+import secrets
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext as _
+from rest_framework import exceptions
+
+TICKET_SALT = 'core.events.stream-ticket'
+
+
+class Subscription:
+    """
+    events of some channels, delivered to the event loop of the subscriber
+    """
+
+    def __init__(self, broker, channels, max_pending=100):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+    def deliver(self, event):
+        # called from any thread
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            # a slow client loses the oldest events rather than growing the queue
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker:
+    """
+    process local publish / subscribe
+    """
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self.lock:
+            for channel in channels:
+                self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions[channel].discard(subscription)
+                if not self.subscriptions[channel]:
+                    del self.subscriptions[channel]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENT_BROKER)()
+        return _broker
+
+
+def quiz_channel(quiz_id):
+    return 'quiz:%s' % quiz_id
+
+
+def quiz_user_channel(quiz_id, user_profile_id):
+    return 'quiz:%s:user:%s' % (quiz_id, user_profile_id)
+
+
+def class_channel(class_id):
+    return 'class:%s' % class_id
+
+
+def publish(channel, event_type, **data):
+    get_broker().publish(channel, dict(data, type=event_type))
+
+
+def issue_ticket(user):
+    return signing.dumps({'user': user.id, 'nonce': secrets.token_urlsafe(12)}, salt=TICKET_SALT)
+
+
+def redeem_ticket(ticket):
+    """
+    the active user of a stream ticket, a ticket is accepted once
+    """
+    try:
+        payload = signing.loads(ticket, salt=TICKET_SALT, max_age=settings.EVENT_TICKET_MAX_AGE)
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed(_('Invalid or expired stream ticket.'))
+
+    # the cache entry outlives the ticket, add fails for a ticket used before
+    if not cache.add('core:stream-ticket:%s' % payload['nonce'], True, settings.EVENT_TICKET_MAX_AGE + 1):
+        raise exceptions.AuthenticationFailed(_('Stream ticket already used.'))
+
+    try:
+        return User.objects.select_related('user_profile').get(pk=payload['user'], is_active=True)
+    except User.DoesNotExist:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
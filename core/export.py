@@ -0,0 +1,111 @@
+"""
+streaming quiz results export, one row per answer
+
+rows come from a single joined query read with .iterator(chunk_size), and are encoded
+as the response is sent, so exports of any size run in constant memory. csv text cells
+that a spreadsheet would evaluate as a formula are written with a leading '.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+from core.models import Answer
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = {
+    'quiz_id': 'quiz_answer__quiz_id',
+    'quiz_name': 'quiz_answer__quiz__quiz_name',
+    'quiz_answer_id': 'quiz_answer_id',
+    'user_profile_id': 'quiz_answer__user_profile_id',
+    'username': 'quiz_answer__user_profile__user__username',
+    'first_name': 'quiz_answer__user_profile__user__first_name',
+    'last_name': 'quiz_answer__user_profile__user__last_name',
+    'total_score': 'quiz_answer__total_score',
+    'question_id': 'question_id',
+    'question': 'question__text',
+    'credit': 'question__credit',
+    'answer_id': 'id',
+    'answer': 'answer',
+    'score': 'score',
+    'is_graded': 'is_graded',
+}
+
+
+def export_rows(answers):
+    """
+    export rows (dicts keyed by EXPORT_FIELDS) of an Answer queryset, grouped by session
+    """
+    queryset = answers.order_by('quiz_answer__quiz_id', 'quiz_answer_id', 'question_id') \
+        .values_list(*EXPORT_FIELDS.values())
+
+    for values in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield dict(zip(EXPORT_FIELDS, values))
+
+
+def quiz_answers(quiz_id):
+    return Answer.objects.filter(quiz_answer__quiz_id=quiz_id)
+
+
+def class_answers(class_id):
+    return Answer.objects.filter(quiz_answer__quiz__class_room_id=class_id)
+
+
+class _Line:
+    """
+    file-like target of csv.writer returning the written line
+    """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+# first characters spreadsheets read as the start of a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_cell(value):
+    """
+    text cells starting like a formula are prefixed with ' so spreadsheets show them as text
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([csv_cell(value) for value in row.values()])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    selects the export format, rows are streamed by the view
+    only error details pass through render
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode(self.charset)
+
+
+class CSVExportRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    lines = staticmethod(csv_lines)
+
+
+class NDJSONExportRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    lines = staticmethod(ndjson_lines)
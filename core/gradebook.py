@@ -0,0 +1,66 @@
+"""
+materialized per student gradebook (GradebookEntry)
+
+entries are created with their quiz answer session (core.signals), score and credit follow
+the stored session and quiz totals: every change of them goes through core.totals, which
+shifts the entries by the same deltas in the same transaction. submitted_at only moves when
+the student writes answers (mark_gradebook_submitted), grading leaves it alone.
+sessions created with bulk_create have no entry until `manage.py rebuild_gradebook`.
+"""
+from django.db.models import F
+from django.utils import timezone
+
+from core.db import write_atomic
+from core.models import GradebookEntry, QuizAnswer
+
+
+def add_gradebook_entry(quiz_answer, quiz):
+    GradebookEntry.objects.get_or_create(quiz_answer=quiz_answer, defaults={
+        'user_profile_id': quiz_answer.user_profile_id, 'class_room_id': quiz.class_room_id, 'quiz_id': quiz.id,
+        'score': quiz_answer.total_score, 'credit': quiz.total_credit, 'submitted_at': quiz_answer.create_date})
+
+
+def shift_gradebook_score(quiz_answer_id, score=0):
+    if score:
+        GradebookEntry.objects.filter(quiz_answer_id=quiz_answer_id).update(score=F('score') + score)
+
+
+def mark_gradebook_submitted(*quiz_answer_ids):
+    """
+    set the submission time of session entries to now, their student wrote answers
+    """
+    GradebookEntry.objects.filter(quiz_answer_id__in=quiz_answer_ids).update(submitted_at=timezone.now())
+
+
+def shift_gradebook_credit(quiz_id, credit):
+    if credit:
+        GradebookEntry.objects.filter(quiz_id=quiz_id).update(credit=F('credit') + credit)
+
+
+def gradebook_entries(quiz_answers):
+    for quiz_answer in quiz_answers.select_related('quiz').iterator():
+        yield GradebookEntry(user_profile_id=quiz_answer.user_profile_id, class_room_id=quiz_answer.quiz.class_room_id,
+                             quiz_id=quiz_answer.quiz_id, quiz_answer_id=quiz_answer.id,
+                             score=quiz_answer.total_score, credit=quiz_answer.quiz.total_credit,
+                             submitted_at=quiz_answer.create_date)
+
+
+def rebuild_gradebook(batch_size=1000):
+    """
+    replace every gradebook entry with one built from the stored totals, returns the entry count
+
+    submission times are not kept outside the gradebook, rebuilt entries use the session start
+    """
+    count = 0
+    with write_atomic():
+        GradebookEntry.objects.all().delete()
+
+        batch = []
+        for entry in gradebook_entries(QuizAnswer.objects.order_by('id')):
+            batch.append(entry)
+            if len(batch) == batch_size:
+                GradebookEntry.objects.bulk_create(batch)
+                count, batch = count + len(batch), []
+        GradebookEntry.objects.bulk_create(batch)
+
+    return count + len(batch)
@@ -0,0 +1,208 @@
+"""
+answer scoring: manual batch scores and auto graders
+
+a question with a grading (a key of settings.ANSWER_GRADERS) and an answer key is graded
+by its grader, grade_quiz queues the ungraded answers of a quiz on the task workers.
+scores are written with bulk_update, which skips the answer signals, so the session totals
+and score events are kept up to date here.
+"""
+import re
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext as _
+
+from core.analytics import invalidate_quiz_analytics
+from core.db import write_atomic
+from core.models import Answer
+from core.tasks import enqueue
+from core.totals import add_to_quiz_answer_totals
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # python < 3.11
+    import sre_parse
+
+GRADING_BATCH_SIZE = 500
+
+
+class Grader(ABC):
+    """
+    base class of auto graders
+    """
+
+    def check_key(self, answer_key):
+        """
+        raise ValueError if answer_key can not be used by the grader
+        """
+
+    @abstractmethod
+    def grade(self, question, answer):
+        """
+        score of the answer text to question, between 0 and question.credit
+        """
+
+
+class ExactMatchGrader(Grader):
+    """
+    full credit when the answer is one of the lines of the answer key, ignoring case and surrounding spaces
+    """
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(text.split()).casefold()
+
+    def grade(self, question, answer):
+        accepted = {self.normalize(line) for line in question.answer_key.splitlines() if line.strip()}
+        return question.credit if self.normalize(answer) in accepted else 0
+
+
+def _nested_repeat(pattern, repeated=False):
+    """
+    whether a parsed pattern repeats a sub pattern that can itself match in several ways,
+    a repeat or alternation inside a repeat, which can backtrack exponentially
+    """
+    for op, value in pattern:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, item = value
+            if high > 1 and repeated:
+                return True
+            if _nested_repeat(item, repeated or high > 1):
+                return True
+        elif op is sre_parse.BRANCH:
+            if repeated or any(_nested_repeat(branch, repeated) for branch in value[1]):
+                return True
+        elif op is sre_parse.SUBPATTERN:
+            if _nested_repeat(value[-1], repeated):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if _nested_repeat(value[1], repeated):
+                return True
+    return False
+
+
+class RegexGrader(Grader):
+    """
+    full credit when the whole answer, without surrounding spaces, matches the answer key pattern
+
+    patterns are run on every graded answer, so they are kept short and free of nested repeats
+    (like (a+)+) that backtrack exponentially, and longer answers than max_answer_length fail
+    """
+    max_key_length = 200
+    max_answer_length = 1000
+
+    def check_key(self, answer_key):
+        if len(answer_key) > self.max_key_length:
+            raise ValueError(_("Pattern can be at most %s characters") % self.max_key_length)
+        try:
+            parsed = sre_parse.parse(answer_key)
+        except re.error as error:
+            raise ValueError(str(error))
+        if _nested_repeat(parsed):
+            raise ValueError(_("Pattern can not repeat a repeated or alternative part"))
+
+    def grade(self, question, answer):
+        answer = answer.strip()
+        if len(answer) > self.max_answer_length:
+            return 0
+        return question.credit if re.fullmatch(question.answer_key, answer) else 0
+
+
+@lru_cache(maxsize=None)
+def get_grader(name):
+    return import_string(settings.ANSWER_GRADERS[name])()
+
+
+def _write_scores(answers, scores):
+    """
+    store scores ({answer id: score}) of the given locked answers and shift the session totals
+    """
+    from core.signals import publish_scores
+
+    deltas, changed = defaultdict(int), defaultdict(dict)
+    quiz_ids = {answer.question.quiz_id for answer in answers}
+    for answer in answers:
+        score = scores[answer.id]
+        deltas[answer.quiz_answer_id] += score - answer.score
+        if score != answer.score:
+            changed[answer.quiz_answer_id][answer.id] = score
+        answer.score, answer.is_graded = score, True
+
+    Answer.objects.bulk_update(answers, ['score', 'is_graded'], batch_size=GRADING_BATCH_SIZE)
+    for quiz_answer_id, delta in deltas.items():
+        add_to_quiz_answer_totals(quiz_answer_id, score=delta)
+
+    transaction.on_commit(lambda: invalidate_quiz_analytics(*quiz_ids))
+    for quiz_answer_id, session_scores in changed.items():
+        transaction.on_commit(lambda quiz_answer_id=quiz_answer_id, session_scores=session_scores:
+                              publish_scores(quiz_answer_id, session_scores))
+
+
+def set_scores(quiz_id, scores):
+    """
+    set scores ({answer id: score}) of answers of a quiz in one transaction
+
+    returns {answer id: error} of the scores that were not set, answers of other quizzes
+    and scores above the question credit are left out
+    """
+    with write_atomic():
+        answers = list(Answer.objects.select_for_update(of=('self',))
+                       .filter(pk__in=scores.keys(), question__quiz_id=quiz_id)
+                       .select_related('question')
+                       .only('id', 'score', 'quiz_answer_id', 'question__quiz_id', 'question__credit'))
+
+        errors = {answer_id: _("Answer does not belong to the quiz") for answer_id in scores}
+        valid = []
+        for answer in answers:
+            if scores[answer.id] > answer.question.credit:
+                errors[answer.id] = _("Score can't be grater than question credit")
+            else:
+                del errors[answer.id]
+                valid.append(answer)
+
+        _write_scores(valid, scores)
+
+    return errors
+
+
+def ungraded_answers(quiz_id):
+    """
+    answers of a quiz waiting for an auto grader
+    """
+    return Answer.objects.filter(question__quiz_id=quiz_id, is_graded=False) \
+        .exclude(question__grading='').exclude(question__answer_key='')
+
+
+def grade_answers(answer_ids):
+    """
+    auto grade the given answers that are still ungraded, returns the number of graded answers
+    """
+    with write_atomic():
+        answers = list(Answer.objects.select_for_update(of=('self',))
+                       .filter(pk__in=answer_ids, is_graded=False)
+                       .exclude(question__grading='').exclude(question__answer_key='')
+                       .select_related('question'))
+
+        scores = {answer.id: get_grader(answer.question.grading).grade(answer.question, answer.answer)
+                  for answer in answers}
+        _write_scores(answers, scores)
+
+    return len(answers)
+
+
+def grade_quiz(quiz_id, batch_size=GRADING_BATCH_SIZE):
+    """
+    queue the ungraded answers of a quiz on the task workers in batches,
+    returns the number of queued answers
+    """
+    answer_ids = list(ungraded_answers(quiz_id).order_by('id').values_list('pk', flat=True))
+
+    for start in range(0, len(answer_ids), batch_size):
+        enqueue(grade_answers, answer_ids[start:start + batch_size])
+
+    return len(answer_ids)
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ProfilePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 hasher using the iteration count of the configured PASSWORD_HASHER_PROFILE
+
+    hashes made with another iteration count still verify, and are rehashed with the
+    current count on the next successful login
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHER_PROFILES[settings.PASSWORD_HASHER_PROFILE]
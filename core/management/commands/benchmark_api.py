@@ -0,0 +1,159 @@
+import json
+import platform
+import time
+from statistics import mean
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import ClassRoom, QuizAnswer
+
+
+class Command(BaseCommand):
+    help = """Benchmark the API routes against a generate_data dataset and record a json baseline.
+
+every route is called --requests times in process through the url routes and middleware,
+the latency percentiles, database queries per request and throughput are reported.
+    manage.py generate_data --replace
+    manage.py benchmark_api --output baseline.json
+    ... change the code ...
+    manage.py benchmark_api --compare baseline.json
+exits with an error when a route got slower than --tolerance or runs more queries than the baseline.
+submit writes answers to the dataset, regenerate it to compare runs on the same data."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='synthetic', help="dataset prefix given to generate_data")
+        parser.add_argument('--requests', type=int, default=200, help="requests per route")
+        parser.add_argument('--warmup', type=int, default=10, help="unmeasured requests per route")
+        parser.add_argument('--route', action='append', help="only benchmark these routes, can be repeated")
+        parser.add_argument('--output', help="write the results as json to this file")
+        parser.add_argument('--compare', help="json baseline to compare the results with")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="allowed p95 latency increase, 0.25 = 25%%")
+
+    def handle(self, *args, **options):
+        routes = self.routes(options['prefix'])
+        names = options['route'] or list(routes)
+
+        unknown = set(names) - set(routes)
+        if unknown:
+            raise CommandError("unknown routes %s, choose from %s" % (', '.join(sorted(unknown)), ', '.join(routes)))
+
+        results = {'meta': {'engine': connection.vendor, 'django': django.get_version(),
+                            'python': platform.python_version(), 'requests': options['requests'],
+                            'dataset': options['prefix']},
+                   'routes': {}}
+
+        for name in names:
+            results['routes'][name] = self.run(routes[name], options['requests'], options['warmup'])
+            self.report(name, results['routes'][name])
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                regressions = self.compare(json.load(baseline), results, options['tolerance'])
+            if regressions:
+                raise CommandError("regressions against %s:\n  %s" % (options['compare'], '\n  '.join(regressions)))
+            self.stdout.write(self.style.SUCCESS("no regressions against %s" % options['compare']))
+
+    @staticmethod
+    def routes(prefix):
+        """
+        {name: function(index) -> (method, path, data, token key)} of the benchmarked routes
+        """
+        class_room = ClassRoom.objects.filter(class_name='%s-c0' % prefix).first()
+        if class_room is None:
+            raise CommandError("no dataset %s, run manage.py generate_data --prefix %s first" % (prefix, prefix))
+
+        quiz = class_room.quizzes.order_by('id').first()
+        questions = list(quiz.questions.order_by('id').values_list('pk', flat=True))
+        teacher = Token.objects.get(user__user_profile=class_room.teacher_id).key
+        students = list(Token.objects.filter(user__user_profile__classes=class_room)
+                        .order_by('user__username').values_list('user__user_profile', 'key'))
+        sessions = dict(QuizAnswer.objects.filter(quiz=quiz).values_list('user_profile_id', 'pk'))
+
+        def student(index):
+            return students[index % len(students)]
+
+        return {
+            'questions': lambda index: ('get', '/api/quiz/%s/questions/' % quiz.id, None, student(index)[1]),
+            'start': lambda index: ('post', '/api/quiz/%s/start/' % quiz.id, {}, student(index)[1]),
+            'submit': lambda index: ('post', '/api/submit-answer/', {
+                'question': questions[index % len(questions)], 'quiz_answer': sessions[student(index)[0]],
+                'answer': 'benchmark %s' % index}, student(index)[1]),
+            'takers': lambda index: ('get', '/api/quiz/%s/takers/list/' % quiz.id, None, teacher),
+            'class': lambda index: ('get', '/api/class/%s/' % class_room.id, None, student(index)[1]),
+        }
+
+    @staticmethod
+    def run(route, requests, warmup):
+        client = APIClient()
+        latencies, queries, errors = [], [], 0
+
+        started = time.perf_counter()
+        for index in range(-warmup, requests):
+            method, path, data, token = route(index)
+            client.credentials(HTTP_AUTHORIZATION='Token %s' % token)
+
+            if index == 0:
+                started = time.perf_counter()
+            with CaptureQueriesContext(connection) as context:
+                request_started = time.perf_counter()
+                response = getattr(client, method)(path, data, format='json')
+                latency = time.perf_counter() - request_started
+
+            if index < 0:
+                continue
+            if response.status_code >= 300:
+                errors += 1
+                continue
+            latencies.append(latency)
+            queries.append(len(context.captured_queries))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        result = {'ok': len(latencies), 'errors': errors,
+                  'requests_per_second': requests / elapsed if elapsed else None,
+                  'queries_per_request': mean(queries) if queries else None,
+                  'max_queries': max(queries) if queries else None,
+                  'mean_ms': mean(latencies) * 1000 if latencies else None}
+        for percentile in (50, 95, 99):
+            result['p%s_ms' % percentile] = \
+                latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)] * 1000 if latencies else None
+        return result
+
+    def report(self, name, result):
+        if not result['ok']:
+            self.stdout.write("%-10s %s errors" % (name, result['errors']))
+            return
+
+        self.stdout.write("%-10s ok=%-5s errors=%-4s %7.1f req/s  queries=%-5.1f p50=%.1fms p95=%.1fms p99=%.1fms" % (
+            name, result['ok'], result['errors'], result['requests_per_second'], result['queries_per_request'],
+            result['p50_ms'], result['p95_ms'], result['p99_ms']))
+
+    @staticmethod
+    def compare(baseline, results, tolerance):
+        regressions = []
+        for name, result in results['routes'].items():
+            before = baseline['routes'].get(name)
+            if before is None:
+                continue
+
+            # a route that only fails has no latencies to compare, it is the worst regression
+            if result['errors'] > before['errors'] or not result['ok'] and before['ok']:
+                regressions.append("%s: %s errors, baseline %s" % (name, result['errors'], before['errors']))
+            if not result['ok'] or not before['ok']:
+                continue
+
+            if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append("%s: p95 %.1fms, baseline %.1fms" % (name, result['p95_ms'], before['p95_ms']))
+            if result['max_queries'] > before['max_queries']:
+                regressions.append("%s: %s queries, baseline %s" % (name, result['max_queries'],
+                                                                     before['max_queries']))
+        return regressions
@@ -0,0 +1,74 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import renderers
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import renderers as fast_renderers
+from core.models import ClassRoom, QuizAnswer
+
+
+class Command(BaseCommand):
+    help = """Benchmark json encoding of the api payloads of a generate_data dataset.
+
+the payloads of the quiz answer, class and quiz takers routes are fetched once, then encoded
+--repeat times by the rest_framework JSONRenderer and by core.renderers.JSONRenderer.
+the encodings are checked to decode to the same values before their throughput is reported.
+    manage.py generate_data --replace
+    manage.py benchmark_json"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='synthetic', help="dataset prefix given to generate_data")
+        parser.add_argument('--repeat', type=int, default=50, help="encodings of every payload per renderer")
+
+    def handle(self, *args, **options):
+        if not fast_renderers.use_orjson():
+            self.stdout.write(self.style.WARNING("orjson is not installed or ORJSON_ENABLED is off, "
+                                                 "core.renderers falls back to the standard encoder"))
+
+        standard, fast = renderers.JSONRenderer(), fast_renderers.JSONRenderer()
+        for name, data in self.payloads(options['prefix']).items():
+            expected = standard.render(data)
+            if json.loads(fast.render(data)) != json.loads(expected):
+                raise CommandError("%s: core.renderers output differs from rest_framework" % name)
+
+            self.stdout.write("%-12s %8.1f KB  standard %s  core %s" % (
+                name, len(expected) / 1024, self.run(standard, data, options['repeat']),
+                self.run(fast, data, options['repeat'])))
+
+    @staticmethod
+    def payloads(prefix):
+        """
+        {name: response data} of the benchmarked routes
+        """
+        class_room = ClassRoom.objects.filter(class_name='%s-c0' % prefix).first()
+        if class_room is None:
+            raise CommandError("no dataset %s, run manage.py generate_data --prefix %s first" % (prefix, prefix))
+
+        quiz = class_room.quizzes.order_by('id').first()
+        quiz_answer = QuizAnswer.objects.filter(quiz=quiz).order_by('id').first()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.get(user__user_profile=class_room.teacher_id))
+
+        paths = {
+            'quiz-answer': '/api/quiz-answer/%s/' % quiz_answer.id,
+            'class': '/api/class/%s/' % class_room.id,
+            'takers': '/api/quiz/%s/takers/list/' % quiz.id,
+        }
+        payloads = {}
+        for name, path in paths.items():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError("%s: %s returned %s" % (name, path, response.status_code))
+            payloads[name] = response.data
+        return payloads
+
+    @staticmethod
+    def run(renderer, data, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            size = len(renderer.render(data))
+        elapsed = time.perf_counter() - started
+        return "%8.1f enc/s %7.1f MB/s" % (repeat / elapsed, size * repeat / elapsed / 1024 / 1024)
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from core.synthetic import exam_fixture
+from core.views import AuthenticateView
+
+
+class Command(BaseCommand):
+    help = "Measure logins/sec of one core for every password hasher profile, login throttling is left out"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=3)
+
+    def handle(self, *args, **options):
+        view = AuthenticateView.as_view(throttle_classes=[])
+        factory = APIRequestFactory()
+
+        for profile, iterations in settings.PASSWORD_HASHER_PROFILES.items():
+            with override_settings(PASSWORD_HASHER_PROFILE=profile), \
+                    exam_fixture('bench', password=make_password('password')) as fixture:
+                username = fixture.teacher.user.username
+                logins = 0
+                started = time.perf_counter()
+                while time.perf_counter() - started < options['seconds']:
+                    response = view(factory.post('/api/api-token-auth/',
+                                                 {'username': username, 'password': 'password'}))
+                    assert response.status_code == 200, response.data
+                    logins += 1
+                elapsed = time.perf_counter() - started
+
+            self.stdout.write("%-10s %7s iterations  %8.1f logins/s per core" % (profile, iterations,
+                                                                                 logins / elapsed))
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from core.models import QuizAnswer
+from core.synthetic import exam_fixture
+
+
+class Command(BaseCommand):
+    help = "Measure concurrent answer submit throughput. on sqlite both profiles run, sqlite defaults " \
+           "(SQLITE_TUNING=0) and the tuned pragmas (SQLITE_TUNING=1), and are reported side by side, " \
+           "the configured one last. run it again with DATABASE_ENGINE=postgresql to compare with postgresql"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=50)
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--threads', type=int, default=16)
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, pragmas in self.profiles().items():
+            # new connections pick up the pragmas of the profile
+            connection.close()
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                results[name] = self.measure(options['students'], options['questions'], options['threads'])
+        connection.close()
+
+        self.stdout.write("engine:      %s" % connection.vendor)
+        self.stdout.write("threads:     %s" % options['threads'])
+        if connection.vendor == 'sqlite':
+            for name, pragmas in self.profiles().items():
+                self.stdout.write("%-13s%s" % (name + ':', ', '.join('%s=%s' % item for item in pragmas.items())))
+        self.row("profile", results, lambda result: result['name'])
+        self.row("submits ok", results, lambda result: result['submits'])
+        self.row("failed", results, lambda result: result['errors'])
+        self.row("throughput", results, lambda result: "%.1f/s" % result['throughput'])
+        self.row("latency p50", results, lambda result: "%.1f ms" % result['p50'] if result['submits'] else '-')
+        self.row("latency p95", results, lambda result: "%.1f ms" % result['p95'] if result['submits'] else '-')
+
+    @staticmethod
+    def profiles():
+        """
+        {name: SQLITE_PRAGMAS} of the profiles to run, the configured one last so the
+        database is left in its journal mode
+        """
+        if connection.vendor != 'sqlite':
+            return {'configured': settings.SQLITE_PRAGMAS}
+
+        # the journal mode is kept in the database file, defaults go back to a rollback journal
+        profiles = {'defaults': {'journal_mode': 'DELETE'}, 'tuned': settings.SQLITE_TUNED_PRAGMAS}
+        if not settings.SQLITE_PRAGMAS:
+            profiles = {'tuned': profiles['tuned'], 'defaults': profiles['defaults']}
+        return profiles
+
+    def row(self, label, results, value):
+        self.stdout.write("%-13s" % (label + ':') + ''.join(
+            '%16s' % value(dict(result, name=name)) for name, result in results.items()))
+
+    def measure(self, student_count, question_count, thread_count):
+        with exam_fixture('bench', student_count, question_count) as fixture:
+            QuizAnswer.objects.bulk_create([QuizAnswer(user_profile=student, quiz=fixture.quiz)
+                                            for student in fixture.students])
+            sessions = dict(QuizAnswer.objects.filter(quiz=fixture.quiz).values_list('user_profile_id', 'pk'))
+            latencies, errors, elapsed = self.run(fixture.students, fixture.questions, sessions, thread_count)
+
+        latencies.sort()
+        submits = len(latencies)
+        return {
+            'submits': submits,
+            'errors': errors,
+            'throughput': submits / elapsed if elapsed else 0,
+            'p50': latencies[submits // 2] * 1000 if submits else None,
+            'p95': latencies[int(submits * 0.95) - 1] * 1000 if submits else None,
+        }
+
+    @staticmethod
+    def run(students, questions, sessions, thread_count):
+        latencies, errors = [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(thread_count + 1)
+
+        def worker(chunk):
+            own_latencies, own_errors = [], 0
+            clients = {}
+            for student in chunk:
+                clients[student.id] = APIClient()
+                clients[student.id].force_authenticate(student.user)
+
+            barrier.wait()
+            try:
+                for question in questions:
+                    for student in chunk:
+                        started = time.perf_counter()
+                        try:
+                            response = clients[student.id].post('/api/submit-answer/', {
+                                'question': question.id, 'quiz_answer': sessions[student.id], 'answer': 'answer'})
+                            ok = response.status_code in (201, 202)
+                        except DatabaseError:
+                            ok = False
+                        if ok:
+                            own_latencies.append(time.perf_counter() - started)
+                        else:
+                            own_errors += 1
+            finally:
+                connection.close()
+
+            with lock:
+                latencies.extend(own_latencies)
+                errors.append(own_errors)
+
+        workers = [threading.Thread(target=worker, args=(students[index::thread_count],))
+                   for index in range(thread_count)]
+        for thread in workers:
+            thread.start()
+
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return latencies, sum(errors), elapsed
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.answer_buffer import recover_journals
+
+
+class Command(BaseCommand):
+    help = "Write answers left in the journals of stopped write-behind buffers"
+
+    def handle(self, *args, **options):
+        written = recover_journals(settings.ANSWER_JOURNAL_DIR)
+        self.stdout.write(self.style.SUCCESS("%s buffered answers written" % written))
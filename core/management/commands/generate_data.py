@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.synthetic import generate_dataset, dataset_exists, delete_dataset
+
+
+class Command(BaseCommand):
+    help = """Generate a deterministic synthetic dataset with bulk inserts, e.g. for benchmark_api.
+
+classes of students with quizzes of questions, every student starts every quiz and answers
+about --answer-rate of its questions. the same --seed and sizes always give the same data.
+users are named <prefix>-c<class>-teacher and <prefix>-c<class>-s-<n> and use tokens."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='synthetic')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--classes', type=int, default=2)
+        parser.add_argument('--students', type=int, default=2000, help="students per class")
+        parser.add_argument('--quizzes', type=int, default=3, help="quizzes per class")
+        parser.add_argument('--questions', type=int, default=30, help="questions per quiz")
+        parser.add_argument('--answer-rate', type=float, default=0.8)
+        parser.add_argument('--replace', action='store_true', help="delete an existing dataset of the prefix first")
+        parser.add_argument('--delete', action='store_true', help="only delete the dataset of the prefix")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+
+        if options['delete'] or options['replace']:
+            delete_dataset(prefix)
+            if options['delete']:
+                self.stdout.write(self.style.SUCCESS("dataset %s deleted" % prefix))
+                return
+        elif dataset_exists(prefix):
+            raise CommandError("dataset %s exists, use --replace or another --prefix" % prefix)
+
+        started = time.perf_counter()
+        dataset = generate_dataset(prefix, seed=options['seed'], classes=options['classes'],
+                                   students=options['students'], quizzes=options['quizzes'],
+                                   questions=options['questions'], answer_rate=options['answer_rate'])
+
+        self.stdout.write(self.style.SUCCESS("dataset %s: classes %s, quizzes %s generated in %.1fs" % (
+            prefix, dataset['classes'], dataset['quizzes'], time.perf_counter() - started)))
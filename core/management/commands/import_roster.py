@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.enrollment import read_roster, enroll_usernames, ROSTER_BATCH_SIZE
+from core.models import ClassRoom
+
+
+class Command(BaseCommand):
+    help = "Enroll the students of a csv roster (usernames in the first column) in a class"
+
+    def add_arguments(self, parser):
+        parser.add_argument('class_id', type=int)
+        parser.add_argument('roster', help="csv file, - reads standard input")
+        parser.add_argument('--batch-size', type=int, default=ROSTER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not ClassRoom.objects.filter(pk=options['class_id']).exists():
+            raise CommandError("class %s does not exist" % options['class_id'])
+
+        if options['roster'] == '-':
+            usernames = list(read_roster(sys.stdin))
+        else:
+            with open(options['roster'], newline='', encoding='utf-8') as roster:
+                usernames = list(read_roster(roster))
+
+        report = enroll_usernames(options['class_id'], usernames, batch_size=options['batch_size'])
+
+        for username in report['unknown']:
+            self.stderr.write("unknown username: %s" % username)
+
+        self.stdout.write(self.style.SUCCESS("%s enrolled, %s already enrolled, %s unknown" % (
+            report['enrolled'], report['already_enrolled'], len(report['unknown']))))
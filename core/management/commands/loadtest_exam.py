@@ -0,0 +1,152 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+from core.synthetic import exam_fixture
+
+
+class Command(BaseCommand):
+    help = """Simulate students taking an exam against running servers and compare them.
+
+Start the servers on the same database, e.g.
+    gunicorn teachingPlatfrom.wsgi --workers 4 --threads 8 --bind 127.0.0.1:8000
+    uvicorn teachingPlatfrom.asgi:application --workers 4 --port 8001
+then run
+    manage.py loadtest_exam --url http://127.0.0.1:8000 --url http://127.0.0.1:8001
+
+every simulated student fetches the questions, starts the quiz and submits an answer per question."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True, help="server base url, can be repeated")
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--questions', type=int, default=10)
+        parser.add_argument('--concurrency', type=int, default=1000,
+                            help="students taking the exam at the same time")
+        parser.add_argument('--output', help="write the results as json to this file")
+
+    def handle(self, *args, **options):
+        results = {}
+        with exam_fixture('load', options['students'], options['questions']) as fixture:
+            questions = [question.id for question in fixture.questions]
+            tokens = [fixture.tokens[student.id] for student in fixture.students]
+            for url in options['url']:
+                results[url] = asyncio.run(self.run(url, fixture.quiz, questions, tokens, options['concurrency']))
+                self.report(url, results[url])
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    async def run(self, url, quiz, questions, tokens, concurrency):
+        latencies = {'questions': [], 'start': [], 'submit': []}
+        errors = {'questions': 0, 'start': 0, 'submit': 0}
+        semaphore = asyncio.Semaphore(concurrency)
+        host, port = urlsplit(url).hostname, urlsplit(url).port or 80
+
+        async def call(client, name, method, path, body=None):
+            started = time.perf_counter()
+            try:
+                status, content = await client.request(method, path, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors[name] += 1
+                await client.reconnect()
+                return None
+            if status >= 300:
+                errors[name] += 1
+                return None
+            latencies[name].append(time.perf_counter() - started)
+            return content
+
+        async def student(token):
+            async with semaphore:
+                client = HTTPClient(host, port, token)
+                try:
+                    await client.reconnect()
+                    await call(client, 'questions', 'GET', '/api/quiz/%s/questions/' % quiz.id)
+                    session = await call(client, 'start', 'POST', '/api/quiz/%s/start/' % quiz.id, {})
+                    if session is None:
+                        return
+                    for question in questions:
+                        await call(client, 'submit', 'POST', '/api/submit-answer/',
+                                   {'question': question, 'quiz_answer': session['id'], 'answer': 'answer'})
+                except OSError:
+                    errors['start'] += 1
+                finally:
+                    client.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*[student(token) for token in tokens])
+        elapsed = time.perf_counter() - started
+
+        summary = {'elapsed': elapsed, 'students': len(tokens),
+                   'requests_per_second': sum(len(values) for values in latencies.values()) / elapsed}
+        for name, values in latencies.items():
+            values.sort()
+            summary[name] = {'ok': len(values), 'errors': errors[name]}
+            for percentile in (50, 95, 99):
+                summary[name]['p%s_ms' % percentile] = \
+                    values[min(len(values) - 1, len(values) * percentile // 100)] * 1000 if values else None
+        return summary
+
+    def report(self, url, summary):
+        self.stdout.write("%s: %s students in %.1fs, %.1f requests/s" % (
+            url, summary['students'], summary['elapsed'], summary['requests_per_second']))
+        for name in ('questions', 'start', 'submit'):
+            result = summary[name]
+            percentiles = ['%.1fms' % result[key] if result[key] is not None else '-'
+                           for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+            self.stdout.write("  %-9s ok=%-6s errors=%-5s p50=%s p95=%s p99=%s" % (
+                name, result['ok'], result['errors'], *percentiles))
+
+
+class HTTPClient:
+    """
+    minimal keep-alive HTTP/1.1 json client on asyncio streams
+    """
+
+    def __init__(self, host, port, token):
+        self.host, self.port, self.token = host, port, token
+        self.reader = self.writer = None
+
+    async def reconnect(self):
+        self.close()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def request(self, method, path, body=None):
+        content = json.dumps(body).encode() if body is not None else b''
+        head = "%s %s HTTP/1.1\r\nHost: %s\r\nAuthorization: Token %s\r\nAccept: application/json\r\n" \
+               "Content-Type: application/json\r\nContent-Length: %s\r\n\r\n" % (method, path, self.host,
+                                                                                 self.token, len(content))
+        self.writer.write(head.encode() + content)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("server closed the connection")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            payload = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            payload = await self.reader.read()
+
+        if headers.get('connection', '').lower() == 'close' or 'content-length' not in headers:
+            await self.reconnect()
+
+        return status, json.loads(payload) if payload else None
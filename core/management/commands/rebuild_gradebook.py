@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.gradebook import rebuild_gradebook
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized student gradebook from the stored quiz and quiz answer totals"
+
+    def handle(self, *args, **options):
+        count = rebuild_gradebook()
+
+        self.stdout.write(self.style.SUCCESS("%s gradebook entries rebuilt" % count))
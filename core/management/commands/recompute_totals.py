@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.db import write_atomic
+from core.totals import recompute_quiz_totals, recompute_quiz_answer_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored quiz and quiz answer totals, or only check them with --check"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="only report out of date totals, exit with an error if there are any")
+
+    def handle(self, *args, **options):
+        commit = not options['check']
+
+        # --check only reads, it doesn't take the write lock
+        with write_atomic() if commit else transaction.atomic():
+            stale_quizzes = recompute_quiz_totals(commit=commit)
+            stale_quiz_answers = recompute_quiz_answer_totals(commit=commit)
+
+        for quiz in stale_quizzes:
+            self.stdout.write("quiz %s: credit=%s questions=%s" % (quiz.pk, quiz.total_credit, quiz.total_questions))
+
+        for quiz_answer in stale_quiz_answers:
+            self.stdout.write("quiz answer %s: score=%s answered=%s" % (quiz_answer.pk, quiz_answer.total_score,
+                                                                        quiz_answer.answered_count))
+
+        stale_count = len(stale_quizzes) + len(stale_quiz_answers)
+
+        if not commit and stale_count:
+            raise CommandError("%s stored totals are out of date" % stale_count)
+
+        self.stdout.write(self.style.SUCCESS(
+            "%s stored totals %s" % (stale_count, "are out of date" if not commit else "recomputed")))
@@ -0,0 +1,244 @@
+"""
+per route request metrics in the prometheus text format
+
+MetricsMiddleware records for every request, labelled by its url route pattern:
+request count by method and status, latency histogram, database queries per request
+histogram and query time, serializer time (validation and .data of DRF serializers)
+and response bytes. the async exam endpoints (core.async_exam) record the same metrics.
+
+metrics are kept per process, scrape every worker (or run one worker per metrics port).
+with SLOW_REQUEST_THRESHOLD set, the SQL of requests slower than it is logged to core.slow_requests.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from rest_framework.serializers import BaseSerializer
+
+slow_request_logger = logging.getLogger('core.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = contextvars.ContextVar('core_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    measurements of one request
+    """
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+        self.sql = [] if capture_sql else None
+        self._serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # django database execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.query_time += duration
+            if self.sql is not None:
+                self.sql.append((duration, sql))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.query_time = defaultdict(float)
+        self.serializer_time = defaultdict(float)
+        self.response_bytes = defaultdict(int)
+
+    def record(self, route, method, status, duration, metrics, response_bytes):
+        with self.lock:
+            self.requests[(route, method, str(status))] += 1
+            self.latency[route].observe(duration)
+            self.queries[route].observe(metrics.queries)
+            self.query_time[route] += metrics.query_time
+            self.serializer_time[route] += metrics.serializer_time
+            self.response_bytes[route] += response_bytes
+
+    def render(self):
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        def histogram(name, values):
+            for route, value in sorted(values.items()):
+                for bound, count in zip(value.buckets, value.counts):
+                    lines.append('%s_bucket{route="%s",le="%s"} %s' % (name, label(route), bound, count))
+                lines.append('%s_bucket{route="%s",le="+Inf"} %s' % (name, label(route), value.count))
+                lines.append('%s_sum{route="%s"} %s' % (name, label(route), value.sum))
+                lines.append('%s_count{route="%s"} %s' % (name, label(route), value.count))
+
+        def counter(name, values):
+            for route, value in sorted(values.items()):
+                lines.append('%s{route="%s"} %s' % (name, label(route), value))
+
+        with self.lock:
+            header('http_requests_total', 'counter', 'Requests by route, method and status.')
+            for (route, method, status), value in sorted(self.requests.items()):
+                lines.append('http_requests_total{route="%s",method="%s",status="%s"} %s' % (
+                    label(route), label(method), label(status), value))
+
+            header('http_request_duration_seconds', 'histogram', 'Request latency by route.')
+            histogram('http_request_duration_seconds', self.latency)
+
+            header('db_queries_per_request', 'histogram', 'Database queries per request by route.')
+            histogram('db_queries_per_request', self.queries)
+
+            header('db_query_duration_seconds_total', 'counter', 'Time spent in database queries by route.')
+            counter('db_query_duration_seconds_total', self.query_time)
+
+            header('serializer_duration_seconds_total', 'counter',
+                   'Time spent validating and serializing with DRF serializers by route.')
+            counter('serializer_duration_seconds_total', self.serializer_time)
+
+            header('http_response_bytes_total', 'counter', 'Response body bytes by route.')
+            counter('http_response_bytes_total', self.response_bytes)
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def label(value):
+    """
+    label value escaped for the prometheus text format, routes can hold regex backslashes
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@contextmanager
+def observe_queries(metrics):
+    """
+    count the queries and serializer time of the current thread into metrics
+    """
+    token = _current.set(metrics)
+    try:
+        with _execute_wrappers(metrics, list(connections)):
+            yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def _execute_wrappers(metrics, aliases):
+    if not aliases:
+        yield
+        return
+    with connections[aliases[0]].execute_wrapper(metrics):
+        with _execute_wrappers(metrics, aliases[1:]):
+            yield
+
+
+def record_request(route, method, status, duration, metrics, response_bytes):
+    registry.record(route, method, status, duration, metrics, response_bytes)
+
+    threshold = settings.SLOW_REQUEST_THRESHOLD
+    if threshold and duration >= threshold:
+        slow_request_logger.warning(
+            "slow request %s %s: %.0fms, %s queries in %.0fms, serializers %.0fms\n%s",
+            method, route, duration * 1000, metrics.queries, metrics.query_time * 1000,
+            metrics.serializer_time * 1000,
+            '\n'.join('  %.1fms %s' % (query_duration * 1000, sql) for query_duration, sql in metrics.sql or ()))
+
+
+def _timed(function):
+    def wrapper(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None or metrics._serializing:
+            return function(self, *args, **kwargs)
+
+        # nested serializers are counted in the outermost call
+        metrics._serializing = True
+        started = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics._serializing = False
+
+    wrapper.__wrapped__ = function
+    return wrapper
+
+
+def install_serializer_timing():
+    """
+    time BaseSerializer.is_valid and .data, the entry points views use
+    """
+    if getattr(BaseSerializer.is_valid, '__wrapped__', None):
+        return
+    BaseSerializer.is_valid = _timed(BaseSerializer.is_valid)
+    BaseSerializer.data = property(_timed(BaseSerializer.data.fget))
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+
+        with observe_queries(RequestMetrics(capture_sql=bool(settings.SLOW_REQUEST_THRESHOLD))) as metrics:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        response_bytes = 0 if response.streaming else len(response.content)
+
+        record_request(route, request.method, response.status_code, time.perf_counter() - started, metrics,
+                       response_bytes)
+        return response
+
+
+def metrics_view(request):
+    """
+    prometheus scrape endpoint, for scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+    or connecting from METRICS_ALLOWED_IPS, nobody by default
+    """
+    authorization = request.META.get('HTTP_AUTHORIZATION', '').split()
+    has_token = bool(settings.METRICS_TOKEN) and len(authorization) == 2 and \
+        authorization[0].lower() == 'bearer' and constant_time_compare(authorization[1], settings.METRICS_TOKEN)
+
+    if not has_token and request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
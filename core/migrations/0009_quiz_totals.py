@@ -0,0 +1,59 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:06
+
+from django.db import migrations, models
+from django.db.models import Sum, Count, IntegerField, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    Quiz = apps.get_model('core', 'Quiz')
+    QuizAnswer = apps.get_model('core', 'QuizAnswer')
+
+    quizzes = Quiz.objects.annotate(
+        computed_credit=Coalesce(Sum('questions__credit'), Value(0), output_field=IntegerField()),
+        computed_questions=Count('questions'),
+    )
+    for quiz in quizzes:
+        quiz.total_credit = quiz.computed_credit
+        quiz.total_questions = quiz.computed_questions
+    Quiz.objects.bulk_update(quizzes, ['total_credit', 'total_questions'], batch_size=500)
+
+    quiz_answers = QuizAnswer.objects.annotate(
+        computed_score=Coalesce(Sum('answers__score'), Value(0), output_field=IntegerField()),
+        computed_answered=Count('answers'),
+    )
+    for quiz_answer in quiz_answers:
+        quiz_answer.total_score = quiz_answer.computed_score
+        quiz_answer.answered_count = quiz_answer.computed_answered
+    QuizAnswer.objects.bulk_update(quiz_answers, ['total_score', 'answered_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_quiz_is_published'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='total_credit',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='total_questions',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quizanswer',
+            name='answered_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quizanswer',
+            name='total_score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_quiz_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='questions_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
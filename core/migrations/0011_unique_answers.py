@@ -0,0 +1,54 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Max, Sum, IntegerField, Value
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicates(apps, schema_editor):
+    QuizAnswer = apps.get_model('core', 'QuizAnswer')
+    Answer = apps.get_model('core', 'Answer')
+
+    # merge duplicate sessions into the oldest one of each (user_profile, quiz)
+    duplicated_sessions = QuizAnswer.objects.values('user_profile', 'quiz') \
+        .annotate(kept=Min('id'), sessions=Count('id')).filter(sessions__gt=1)
+    for duplicate in duplicated_sessions:
+        others = QuizAnswer.objects.filter(user_profile=duplicate['user_profile'], quiz=duplicate['quiz']) \
+            .exclude(pk=duplicate['kept'])
+        Answer.objects.filter(quiz_answer__in=others).update(quiz_answer=duplicate['kept'])
+        others.delete()
+
+    # keep the latest answer of each (question, quiz_answer)
+    duplicated_answers = Answer.objects.values('question', 'quiz_answer') \
+        .annotate(kept=Max('id'), answers=Count('id')).filter(answers__gt=1)
+    for duplicate in duplicated_answers:
+        Answer.objects.filter(question=duplicate['question'], quiz_answer=duplicate['quiz_answer']) \
+            .exclude(pk=duplicate['kept']).delete()
+
+    quiz_answers = QuizAnswer.objects.annotate(
+        computed_score=Coalesce(Sum('answers__score'), Value(0), output_field=IntegerField()),
+        computed_answered=Count('answers'),
+    )
+    for quiz_answer in quiz_answers:
+        quiz_answer.total_score = quiz_answer.computed_score
+        quiz_answer.answered_count = quiz_answer.computed_answered
+    QuizAnswer.objects.bulk_update(quiz_answers, ['total_score', 'answered_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_quiz_questions_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(fields=('question', 'quiz_answer'), name='unique_answer_per_question'),
+        ),
+        migrations.AddConstraint(
+            model_name='quizanswer',
+            constraint=models.UniqueConstraint(fields=('user_profile', 'quiz'), name='unique_quiz_answer_per_user'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_unique_answers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['class_room', '-id'], name='quiz_class_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['is_published', 'start_datetime', 'end_datetime'], name='quiz_active_idx'),
+        ),
+    ]
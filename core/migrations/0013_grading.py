@@ -0,0 +1,35 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+def mark_scored_answers_graded(apps, schema_editor):
+    # answers scored before grading was tracked were graded by their teacher
+    Answer = apps.get_model('core', 'Answer')
+    Answer.objects.exclude(score=0).update(is_graded=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_quiz_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='is_graded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_key',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='grading',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(mark_scored_answers_graded, migrations.RunPython.noop),
+    ]
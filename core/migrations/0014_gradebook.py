@@ -0,0 +1,44 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_gradebook(apps, schema_editor):
+    QuizAnswer = apps.get_model('core', 'QuizAnswer')
+    GradebookEntry = apps.get_model('core', 'GradebookEntry')
+
+    GradebookEntry.objects.bulk_create([
+        GradebookEntry(user_profile_id=quiz_answer.user_profile_id, class_room_id=quiz_answer.quiz.class_room_id,
+                       quiz_id=quiz_answer.quiz_id, quiz_answer_id=quiz_answer.id, score=quiz_answer.total_score,
+                       credit=quiz_answer.quiz.total_credit, submitted_at=quiz_answer.create_date)
+        for quiz_answer in QuizAnswer.objects.select_related('quiz')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_grading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradebookEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(default=0)),
+                ('credit', models.IntegerField(default=0)),
+                ('submitted_at', models.DateTimeField()),
+                ('class_room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.ClassRoom')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Quiz')),
+                ('quiz_answer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='gradebook_entry', to='core.QuizAnswer')),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gradebook', to='core.UserProfile')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='gradebookentry',
+            index=models.Index(fields=['user_profile', 'class_room', 'quiz'], name='gradebook_student_idx'),
+        ),
+        migrations.RunPython(fill_gradebook, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from core.db import write_atomic
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, related_name='user_profile', on_delete=models.CASCADE)
@@ -17,7 +19,10 @@ class ClassRoom(models.Model):
 
     @property
     def students_count(self):
-        return len(self.students.all())
+        # list querysets annotate num_students, avoiding a count query per class
+        if hasattr(self, 'num_students'):
+            return self.num_students
+        return self.students.count()
 
     def __str__(self):
         return self.class_name
@@ -30,18 +35,32 @@ class Quiz(models.Model):
     end_datetime = models.DateTimeField()
     is_published = models.BooleanField(default=False)
 
+    # denormalized aggregates of the quiz questions, maintained by core.signals
+    total_credit = models.IntegerField(default=0)
+    total_questions = models.IntegerField(default=0)
+    # bumped on any question change, used to key cached question payloads
+    questions_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # quizzes of a class, newest first
+            models.Index(fields=['class_room', '-id'], name='quiz_class_recent_idx'),
+            # published quizzes running at a given time
+            models.Index(fields=['is_published', 'start_datetime', 'end_datetime'], name='quiz_active_idx'),
+        ]
+
     @property
     def is_active(self):
         return self.start_datetime <= timezone.now() <= self.end_datetime
 
     @property
     def credit(self):
-        return sum([question.credit for question in self.questions.all()])
+        return self.total_credit
 
     @property
     def questions_count(self):
-        return len(self.questions.all())
-        
+        return self.total_questions
+
     def __str__(self):
         return self.quiz_name
 
@@ -52,6 +71,15 @@ class Question(models.Model):
 
     credit = models.IntegerField(default=0)
 
+    # auto grading, a key of settings.ANSWER_GRADERS or blank for manual grading
+    grading = models.CharField(max_length=32, blank=True, default='')
+    answer_key = models.TextField(blank=True, default='')
+
+    def save(self, *args, **kwargs):
+        # quiz totals are updated by signals, keep them in the same transaction
+        with write_atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return str(self.quiz) + " | " + str(self.text)
 
@@ -62,6 +90,18 @@ class Answer(models.Model):
     answer = models.TextField()
 
     score = models.IntegerField(default=0)
+    # set when the score is given, cleared when the answer changes
+    is_graded = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'quiz_answer'], name='unique_answer_per_question'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # quiz answer totals are updated by signals, keep them in the same transaction
+        with write_atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return str(self.question) + " | " + str(self.answer)
@@ -72,13 +112,45 @@ class QuizAnswer(models.Model):
     quiz = models.ForeignKey(Quiz, related_name="answers", on_delete=models.CASCADE)
     create_date = models.DateTimeField(auto_now_add=True)
 
+    # denormalized aggregates of the session answers, maintained by core.signals
+    total_score = models.IntegerField(default=0)
+    answered_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_profile', 'quiz'], name='unique_quiz_answer_per_user'),
+        ]
+
     @property
     def is_active(self):
         return self.quiz.is_active
 
     @property
     def score(self):
-        return sum([answer.score for answer in self.answers.all()])
+        return self.total_score
 
     def __str__(self):
         return str(self.user_profile) + " | " + " quiz"
+
+
+class GradebookEntry(models.Model):
+    """
+    materialized grade of a quiz answer session, one row per student and quiz,
+    maintained by core.gradebook and rebuilt by `manage.py rebuild_gradebook`
+    """
+    user_profile = models.ForeignKey(UserProfile, related_name="gradebook", on_delete=models.CASCADE)
+    class_room = models.ForeignKey(ClassRoom, related_name="+", on_delete=models.CASCADE)
+    quiz = models.ForeignKey(Quiz, related_name="+", on_delete=models.CASCADE)
+    quiz_answer = models.OneToOneField(QuizAnswer, related_name="gradebook_entry", on_delete=models.CASCADE)
+
+    score = models.IntegerField(default=0)
+    credit = models.IntegerField(default=0)
+    submitted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_profile', 'class_room', 'quiz'], name='gradebook_student_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.user_profile) + " | " + str(self.quiz_id)
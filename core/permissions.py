@@ -3,8 +3,8 @@ from rest_framework.exceptions import APIException
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 from django.utils.translation import gettext as _
 
-from core.models import ClassRoom, Quiz, Question, QuizAnswer
-from core.utils import get_object
+from core.context import request_objects
+from core.enrollment import is_enrolled
 
 
 class IsTeacherOrSuperuser(BasePermission):
@@ -12,48 +12,54 @@ class IsTeacherOrSuperuser(BasePermission):
 
     @staticmethod
     def is_teacher_or_superuser(class_id, request):
-        the_class = get_object(ClassRoom, pk=class_id)
+        the_class = request_objects(request).class_room(class_id)
 
         if request.user.is_superuser:
             return True
 
-        return the_class.teacher == request.user.user_profile
+        return the_class.teacher_id == request.user.user_profile.id
 
     def has_permission(self, request, view):
 
         if request.method in SAFE_METHODS:
             return True
 
-        from core.views import AddQuizQuestion, QuizUpdateView
+        from core.views import AddQuizQuestion, QuizUpdateView, SetScores, GradeQuiz
         from core.views import RUDQuestion
 
-        if type(view) in [AddQuizQuestion, QuizUpdateView]:
-            quiz = get_object(Quiz, pk=view.kwargs.get('quiz_id'))
-            class_id = quiz.class_room.id
+        if type(view) in [AddQuizQuestion, QuizUpdateView, SetScores, GradeQuiz]:
+            quiz = request_objects(request).quiz(view.kwargs.get('quiz_id'))
+            class_id = quiz.class_room_id
 
         elif type(view) == RUDQuestion:
-            question = get_object(Question, pk=view.kwargs.get('question_id'))
-            quiz = question.quiz
-            class_id = quiz.class_room.id
+            question = request_objects(request).question(view.kwargs.get('question_id'))
+            class_id = question.quiz.class_room_id
         else:
             class_id = view.kwargs.get('class_id')
 
         return self.is_teacher_or_superuser(class_id, request)
 
 
+class IsSuperuser(BasePermission):
+    message = _("You must be a superuser")
+
+    def has_permission(self, request, view):
+        return request.user.is_superuser
+
+
 class IsSelfOrCanSee(BasePermission):
     message = _("You can not see details")
 
     def has_permission(self, request, view):
-        quiz_answer = get_object(QuizAnswer, pk=view.kwargs.get('quiz_answer_id'))
+        quiz_answer = request_objects(request).quiz_answer(view.kwargs.get('quiz_answer_id'))
         user_profile = request.user.user_profile
 
-        class_id = quiz_answer.quiz.class_room.id
+        class_id = quiz_answer.quiz.class_room_id
 
         if IsTeacherOrSuperuser.is_teacher_or_superuser(class_id, request):
             return True
 
-        return quiz_answer.user_profile == user_profile
+        return quiz_answer.user_profile_id == user_profile.id
 
 
 class IsEnrolledInClass(BasePermission):
@@ -61,18 +67,18 @@ class IsEnrolledInClass(BasePermission):
 
     @staticmethod
     def is_enrolled_in_class(class_id, request):
-        the_class = get_object(ClassRoom, pk=class_id)
+        the_class = request_objects(request).class_room(class_id)
 
-        return request.user.user_profile in the_class.students.all()
+        return is_enrolled(the_class.id, request.user.user_profile.id)
 
     def has_permission(self, request, view):
 
-        from core.views import QuizQuestionsList, StartQuiz, ClassRoomRetrieveView
+        from core.views import QuizQuestionsList, StartQuiz, ClassRoomRetrieveView, ClassStudentsList
 
         if type(view) in [QuizQuestionsList, StartQuiz]:
-            quiz = get_object(Quiz, pk=view.kwargs.get('quiz_id'))
-            class_id = quiz.class_room.id
-        elif type(view) in [ClassRoomRetrieveView, ]:
+            quiz = request_objects(request).quiz(view.kwargs.get('quiz_id'))
+            class_id = quiz.class_room_id
+        elif type(view) in [ClassRoomRetrieveView, ClassStudentsList]:
             class_id = view.kwargs.get('class_id')
         else:
             raise APIException("Invalid Permission Usage")
@@ -84,7 +90,7 @@ class IsQuizActive(BasePermission):
     message = _('Quiz is not active for answering')
 
     def has_permission(self, request, view):
-        quiz = get_object(Quiz, pk=view.kwargs.get('quiz_id'))
+        quiz = request_objects(request).quiz(view.kwargs.get('quiz_id'))
         return quiz.is_active
 
 
@@ -92,12 +98,12 @@ class CanSeeQuizQuestions(BasePermission):
     message = _("You don't have permission to see the quiz questions")
 
     def has_permission(self, request, view):
-        quiz = get_object(Quiz, pk=view.kwargs.get('quiz_id'))
+        quiz = request_objects(request).quiz(view.kwargs.get('quiz_id'))
 
-        if IsTeacherOrSuperuser.is_teacher_or_superuser(quiz.class_room.id, request):
+        if IsTeacherOrSuperuser.is_teacher_or_superuser(quiz.class_room_id, request):
             return True
 
-        if not IsEnrolledInClass.is_enrolled_in_class(quiz.class_room.id, request):
+        if not IsEnrolledInClass.is_enrolled_in_class(quiz.class_room_id, request):
             return False
 
         return timezone.now() > quiz.start_datetime
@@ -0,0 +1,189 @@
+"""
+opt-in sampling profiler for requests
+
+a profiled request (X-Profile header equal to PROFILER_SECRET, or picked at PROFILER_SAMPLE_RATE)
+registers its thread with the sampler. while profiled requests run, one sampler thread reads
+their stacks every PROFILER_INTERVAL seconds; other requests pay nothing. at the end of a
+request its samples are merged into PROFILER_DIR/<route>.collapsed, one "frame;frame;... count"
+line per stack, the input format of flamegraph.pl and speedscope.
+"""
+import fcntl
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+class Profile:
+    def __init__(self, route=None):
+        self.thread_id = threading.get_ident()
+        self.route = route
+        self.samples = Counter()
+
+
+@lru_cache(maxsize=4096)
+def _short_path(path):
+    for root in sorted(filter(None, (settings.BASE_DIR, *sys.path)), key=len, reverse=True):
+        if path.startswith(root + os.sep):
+            return path[len(root) + 1:]
+    return path
+
+
+def _frame_name(frame):
+    return '%s:%s' % (_short_path(frame.f_code.co_filename), frame.f_code.co_name)
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """
+    reads the stacks of the registered threads, running only while some are registered
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.thread = None
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles[profile.thread_id] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+                self.thread.start()
+
+    def remove(self, profile):
+        """
+        stop sampling the profile, returns a copy of its samples
+        """
+        with self.lock:
+            self.profiles.pop(profile.thread_id, None)
+            return Counter(profile.samples)
+
+    def run(self):
+        while True:
+            # samples are counted under the lock, remove() never sees a counter being updated
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+
+                frames = sys._current_frames()
+                for profile in self.profiles.values():
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.samples[collapse(frame)] += 1
+                del frames
+
+            time.sleep(settings.PROFILER_INTERVAL)
+
+
+sampler = Sampler()
+
+
+def should_profile(header):
+    if header is not None:
+        return bool(settings.PROFILER_SECRET) and constant_time_compare(header, settings.PROFILER_SECRET)
+    return random.random() < settings.PROFILER_SAMPLE_RATE
+
+
+def profile_name(route):
+    return re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+
+
+def profile_path(name):
+    return os.path.join(settings.PROFILER_DIR, name + '.collapsed')
+
+
+def read_profile(lines):
+    samples = Counter()
+    for line in lines:
+        stack, _, count = line.rstrip('\n').rpartition(' ')
+        if stack and count.isdigit():
+            samples[stack] += int(count)
+    return samples
+
+
+def save_samples(route, samples):
+    """
+    merge samples into the collapsed stack file of the route, locked against other processes
+    """
+    os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+
+    with open(profile_path(profile_name(route)), 'a+') as profile:
+        fcntl.flock(profile.fileno(), fcntl.LOCK_EX)
+        profile.seek(0)
+        merged = read_profile(profile) + samples
+
+        profile.seek(0)
+        profile.truncate()
+        profile.writelines('%s %s\n' % (stack, count) for stack, count in merged.most_common())
+
+
+@contextmanager
+def profiled(route=None):
+    """
+    sample the current thread, the samples are saved under profile.route (set it before leaving)
+    """
+    profile = Profile(route)
+    sampler.add(profile)
+    try:
+        yield profile
+    finally:
+        samples = sampler.remove(profile)
+        if samples and profile.route:
+            try:
+                save_samples(profile.route, samples)
+            except OSError:
+                logger.exception("could not save the profile of %s", profile.route)
+
+
+class ProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request.META.get(PROFILE_HEADER)):
+            return self.get_response(request)
+
+        with profiled() as profile:
+            response = self.get_response(request)
+
+            match = getattr(request, 'resolver_match', None)
+            profile.route = match.route if match is not None else None
+
+        return response
+
+
+def list_profiles():
+    """
+    {name: sample count} of the saved profiles
+    """
+    if not os.path.isdir(settings.PROFILER_DIR):
+        return {}
+
+    profiles = {}
+    for file_name in sorted(os.listdir(settings.PROFILER_DIR)):
+        if file_name.endswith('.collapsed'):
+            with open(os.path.join(settings.PROFILER_DIR, file_name)) as profile:
+                profiles[file_name[:-len('.collapsed')]] = sum(read_profile(profile).values())
+    return profiles
@@ -0,0 +1,141 @@
+"""
+json renderer and parser backed by orjson, falling back to the standard library ones
+
+orjson encodes the str, int, float, list and dict payloads of the serializers natively.
+datetimes, dates, times, decimals and every other type are handed to the encoder of
+rest_framework, so they are written as with its JSONRenderer. orjson writes NaN and
+infinities as null where rest_framework rejects them with STRICT_JSON, so when the content
+has nulls the data is checked for them (has_non_finite_floats) and rendered again by
+rest_framework if it holds any. floats with an exponent are written in another notation
+(1e16 instead of 1e+16), the same number. without orjson installed, or for pretty printed
+and non utf-8 content, the rest_framework implementations are used.
+"""
+import io
+import math
+from decimal import Decimal
+
+from django.conf import settings
+from rest_framework import parsers, renderers, serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def use_orjson():
+    return orjson is not None and settings.ORJSON_ENABLED
+
+
+# datetimes go through the rest_framework encoder, which writes utc as Z instead of +00:00
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+# fields whose representation is never a float
+FLOAT_FREE_FIELDS = (
+    serializers.CharField, serializers.IntegerField, serializers.BooleanField, serializers.NullBooleanField,
+    serializers.DateTimeField, serializers.DateField, serializers.TimeField, serializers.DurationField,
+    serializers.UUIDField, serializers.FileField, serializers.PrimaryKeyRelatedField,
+    serializers.StringRelatedField, serializers.HyperlinkedRelatedField,
+)
+
+
+def _float_plan(field):
+    """
+    fields of a representation that can hold floats: None for none, True when any value can,
+    or {field name: plan} of the fields of a serializer that can
+    """
+    if isinstance(field, serializers.ListSerializer):
+        return _float_plan(field.child)
+    if isinstance(field, serializers.ManyRelatedField):
+        return _float_plan(field.child_relation)
+    if isinstance(field, serializers.Serializer):
+        plans = {name: _float_plan(child) for name, child in field.fields.items()}
+        return {name: plan for name, plan in plans.items() if plan is not None} or None
+    return None if isinstance(field, FLOAT_FREE_FIELDS) else True
+
+
+def has_non_finite_floats(values, plan=True):
+    """
+    whether any of values holds NaN or infinities. serializer output (ReturnDict, ReturnList)
+    is checked field by field, only the fields of its serializer that can hold floats
+    """
+    if plan is None:
+        return False
+
+    if plan is not True:
+        rows = []
+        for value in values:
+            if isinstance(value, dict):
+                rows.append(value)
+            elif isinstance(value, list):
+                rows.extend(value)
+        return any(has_non_finite_floats([row.get(name) for row in rows], field_plan)
+                   for name, field_plan in plan.items())
+
+    for value in values:
+        if isinstance(value, (float, Decimal)):
+            # decimals are written as floats by the rest_framework encoder
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, (dict, list, tuple)):
+            serializer = getattr(value, 'serializer', None)
+            if serializer is not None:
+                found = has_non_finite_floats([value], _float_plan(serializer))
+            else:
+                found = has_non_finite_floats(value.values() if isinstance(value, dict) else value)
+            if found:
+                return True
+    return False
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    encoder_class = JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if not use_orjson() or indent or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # integers beyond 64 bits, recursion limits, let the standard encoder decide
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # orjson writes NaN and infinities as null, content without nulls has none
+        if b'null' in content and has_non_finite_floats([data]):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # same escaping of the javascript line terminators as rest_framework
+        if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
+
+
+class JSONParser(parsers.JSONParser):
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if not use_orjson() or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as error:
+            raise ParseError('JSON parse error - %s' % error)
+
+
+def loads(content):
+    """
+    decoded json of a utf-8 request body, raising the ParseError of JSONParser
+    """
+    return JSONParser().parse(io.BytesIO(content))
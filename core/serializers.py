@@ -1,10 +1,17 @@
 from abc import ABC
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 
-from core.models import UserProfile, ClassRoom, Quiz, Question, QuizAnswer, Answer
+from core.answers import upsert_answers
+from core.context import request_objects
+from core.db import write_atomic
+from core.enrollment import read_roster, enroll_usernames
+from core.gradebook import mark_gradebook_submitted
+from core.grading import get_grader, set_scores
+from core.models import UserProfile, ClassRoom, Quiz, Question, QuizAnswer, Answer, GradebookEntry
 from django.utils.translation import gettext as _
 
 from core.permissions import IsTeacherOrSuperuser
@@ -50,9 +57,12 @@ class PrivateUserProfileSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_token(instance):
-        token, created = Token.objects.get_or_create(user=instance.user)
-
-        return token.key
+        # a token loaded with the user saves the lookup on repeat logins
+        try:
+            return instance.user.auth_token.key
+        except Token.DoesNotExist:
+            token, created = Token.objects.get_or_create(user=instance.user)
+            return token.key
 
     def create(self, validated_data):
         user = User.objects.create_user(**validated_data.pop('user'), is_staff=True)
@@ -111,13 +121,40 @@ class ClassRoomSerializer(serializers.ModelSerializer):
 
 
 class QuestionSerializer(serializers.ModelSerializer):
+    """
+    questions as written and read by the class teacher, with the grading and answer key
+    """
     class Meta:
         model = Question
-        fields = ['id', 'quiz', 'text', 'credit']
+        fields = ['id', 'quiz', 'text', 'credit', 'grading', 'answer_key']
         extra_kwargs = {
-            'quiz': {'read_only': True}
+            'quiz': {'read_only': True},
         }
 
+    def validate(self, attrs):
+        grading = attrs.get('grading', getattr(self.instance, 'grading', ''))
+        answer_key = attrs.get('answer_key', getattr(self.instance, 'answer_key', ''))
+
+        if grading:
+            if grading not in settings.ANSWER_GRADERS:
+                raise serializers.ValidationError({'grading': [_("Unknown grading")]})
+            try:
+                get_grader(grading).check_key(answer_key)
+            except ValueError as error:
+                raise serializers.ValidationError({'answer_key': [str(error)]})
+
+        return attrs
+
+
+class PublicQuestionSerializer(serializers.ModelSerializer):
+    """
+    questions as listed to the students, without the grading and answer key
+    """
+    class Meta:
+        model = Question
+        fields = ['id', 'quiz', 'text', 'credit']
+        read_only_fields = fields
+
 
 class AnswerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -130,36 +167,81 @@ class AnswerSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         question = attrs.get('question')
         quiz_answer = attrs.get('quiz_answer')
+        request = self.context['request']
 
-        if not quiz_answer.is_active:
+        if not request_objects(request).quiz(quiz_answer.quiz_id).is_active:
             raise serializers.ValidationError(_("Quiz is not active for answering"))
 
-        if question.quiz != quiz_answer.quiz:
+        if question.quiz_id != quiz_answer.quiz_id:
             raise serializers.ValidationError(_("Question does not belong to the give session id"))
 
-        if quiz_answer.user_profile != self.context['request'].user.user_profile:
+        if quiz_answer.user_profile_id != request.user.user_profile.id:
             raise serializers.ValidationError(_("Current user is not the same as session user"))
 
         return attrs
 
     def create(self, validated_data):
+        # unique (question, quiz_answer) makes concurrent submits update the same row,
+        # update_or_create reads before it writes
+        with write_atomic():
+            answer, created = Answer.objects.update_or_create(question=validated_data.get('question'),
+                                                              quiz_answer=validated_data.get('quiz_answer'),
+                                                              defaults={'answer': validated_data.get('answer'),
+                                                                        'is_graded': False})
+            mark_gradebook_submitted(answer.quiz_answer_id)
+        return answer
 
-        try:
-            old = Answer.objects.get(question=validated_data.get('question'),
-                                     quiz_answer=validated_data.get('quiz_answer'))
 
-            old.answer = validated_data.get('answer')
-            old.save()
+class AnswerItemSerializer(serializers.Serializer):
+    question = serializers.IntegerField()
+    answer = serializers.CharField()
+
+
+class BulkAnswerSerializer(serializers.Serializer):
+    """
+    submit many answers of a quiz answer session (given in context) at once,
+    the session is validated once and the answers are written in one transaction
+    """
+    answers = AnswerItemSerializer(many=True)
+
+    def validate(self, attrs):
+        quiz_answer = self.context['quiz_answer']
+
+        if not quiz_answer.quiz.is_active:
+            raise serializers.ValidationError(_("Quiz is not active for answering"))
+
+        if quiz_answer.user_profile_id != self.context['request'].user.user_profile.id:
+            raise serializers.ValidationError(_("Current user is not the same as session user"))
+
+        return attrs
+
+    def create(self, validated_data):
+        quiz_answer = self.context['quiz_answer']
+
+        # last answer wins when a question is sent more than once
+        texts = {item['question']: item['answer'] for item in validated_data['answers']}
+        question_ids = set(Question.objects.filter(quiz_id=quiz_answer.quiz_id, pk__in=texts.keys())
+                           .values_list('pk', flat=True))
+
+        existing = upsert_answers(quiz_answer.id, {question_id: texts[question_id] for question_id in question_ids})
+
+        answer_ids = dict(Answer.objects.filter(quiz_answer=quiz_answer, question_id__in=question_ids)
+                          .values_list('question_id', 'pk'))
+
+        results = []
+        for question_id in texts:
+            if question_id not in question_ids:
+                results.append({'question': question_id, 'status': 'error',
+                                'detail': _("Question does not belong to the give session id")})
+            else:
+                results.append({'question': question_id, 'id': answer_ids.get(question_id),
+                                'status': 'updated' if question_id in existing else 'created'})
 
-            return old
-        except Answer.DoesNotExist:
-            new = Answer(**validated_data)
-            new.save()
-            return new
+        return results
 
 
 class AnswerWithQuestionSerializer(serializers.ModelSerializer):
-    question = QuestionSerializer(read_only=True)
+    question = PublicQuestionSerializer(read_only=True)
 
     class Meta:
         model = Answer
@@ -190,14 +272,95 @@ class ScoreAnswerSerializer(serializers.ModelSerializer):
         return score
 
     def validate(self, attrs):
-        if not IsTeacherOrSuperuser.is_teacher_or_superuser(self.instance.question.quiz.class_room.id,
+        if not IsTeacherOrSuperuser.is_teacher_or_superuser(self.instance.question.quiz.class_room_id,
                                                             self.context['request']):
             raise serializers.ValidationError(_("You don't have permission to set score"))
 
+        attrs['is_graded'] = True
         return attrs
 
 
-class QuizAnswerSerializer(serializers.ModelSerializer):
+class ScoreItemSerializer(serializers.Serializer):
+    answer = serializers.IntegerField()
+    score = serializers.IntegerField()
+
+
+class BulkScoreSerializer(serializers.Serializer):
+    """
+    set scores of many answers of a quiz (given in context) at once, in one transaction
+    """
+    scores = ScoreItemSerializer(many=True)
+
+    def create(self, validated_data):
+        # last score wins when an answer is sent more than once
+        scores = {item['answer']: item['score'] for item in validated_data['scores']}
+        errors = set_scores(self.context['quiz'].id, scores)
+
+        return [{'answer': answer_id, 'status': 'error', 'detail': errors[answer_id]} if answer_id in errors
+                else {'answer': answer_id, 'score': score, 'status': 'updated'}
+                for answer_id, score in scores.items()]
+
+
+def query_names(request, parameter):
+    """
+    set of the comma separated names of a query parameter, None when it is not given
+    """
+    query_params = getattr(request, 'query_params', None)
+    if query_params is None or parameter not in query_params:
+        return None
+    return {name.strip() for value in query_params.getlist(parameter) for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    ?fields= and ?expand= select the fields of the serializer of a response
+
+    without them every field is returned. fields=a,b keeps only those fields, and with either
+    parameter the nested relations of Meta.expandable_fields are returned as ids unless listed
+    in expand=. fields left out are dropped before serialization, so their nested serializers
+    and model properties are never read. views use included() and expanded() to load only
+    the relations that are serialized.
+    """
+
+    @classmethod
+    def included(cls, request, name):
+        fields = query_names(request, 'fields')
+        return fields is None or name in fields
+
+    @classmethod
+    def expanded(cls, request, name):
+        if not cls.included(request, name):
+            return False
+        expand = query_names(request, 'expand')
+        if expand is None and query_names(request, 'fields') is None:
+            return True
+        return expand is not None and name in expand
+
+    def collapse_field(self, name, field):
+        """
+        the field returning only the ids of a nested relation that is not expanded
+        """
+        return serializers.PrimaryKeyRelatedField(source=field.source, read_only=True,
+                                                  many=isinstance(field, serializers.ListSerializer))
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        # only the serializer of the response, or the items of a response list, follow the query
+        parent = self.parent
+        if not (parent is None or isinstance(parent, serializers.ListSerializer) and parent.parent is None):
+            return fields
+
+        request = self.context.get('request')
+        for name in list(fields):
+            if not self.included(request, name):
+                del fields[name]
+            elif name in self.Meta.expandable_fields and not self.expanded(request, name):
+                fields[name] = self.collapse_field(name, fields[name])
+        return fields
+
+
+class QuizAnswerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user_profile = UserProfileSerializer(read_only=True)
     quiz = QuizSerializer(read_only=True)
     answers = AnswerSerializer(many=True, read_only=True)
@@ -205,20 +368,17 @@ class QuizAnswerSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuizAnswer
         fields = ['id', 'user_profile', 'quiz', 'score', 'answers']
+        expandable_fields = ['user_profile', 'quiz', 'answers']
         extra_kwargs = {
             'user_profile': {'read_only': True},
         }
 
     def create(self, validated_data):
         user_profile = self.context['request'].user.user_profile
-        try:
-            return QuizAnswer.objects.get(user_profile=user_profile,
-                                          quiz=validated_data.get('quiz'))
-        except QuizAnswer.DoesNotExist:
-            question_answer = QuizAnswer(**validated_data, user_profile=user_profile)
-            question_answer.save()
-
-            return question_answer
+        # unique (user_profile, quiz) makes concurrent starts return the same session
+        quiz_answer, created = QuizAnswer.objects.get_or_create(user_profile=user_profile,
+                                                                quiz=validated_data.get('quiz'))
+        return quiz_answer
 
 
 class QuizRetrieveSerializer(serializers.ModelSerializer):
@@ -229,16 +389,61 @@ class QuizRetrieveSerializer(serializers.ModelSerializer):
         fields = ['id', 'questions', 'answers__quiz_answer', 'is_published']
 
 
-class ClassRoomRetrieveSerializer(serializers.ModelSerializer):
-    students = UserProfileSerializer(many=True)
+class ClassRoomRetrieveSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    students are listed separately by the paginated class students endpoint
+    """
     quizzes = serializers.SerializerMethodField()
     teacher = UserProfileSerializer(read_only=True)
 
     class Meta:
         model = ClassRoom
-        fields = ['id', 'class_name', 'teacher', 'students', 'quizzes', 'students_count']
+        fields = ['id', 'class_name', 'teacher', 'quizzes', 'students_count']
+        expandable_fields = ['teacher', 'quizzes']
 
     @staticmethod
     def get_quizzes(instance):
         return QuizSerializer(instance=instance.quizzes.all().order_by('-id'),
                               many=True).data
+
+    @staticmethod
+    def get_quiz_ids(instance):
+        return list(instance.quizzes.order_by('-id').values_list('pk', flat=True))
+
+    def collapse_field(self, name, field):
+        if name == 'quizzes':
+            return serializers.SerializerMethodField(method_name='get_quiz_ids')
+        return super().collapse_field(name, field)
+
+
+class GradebookEntrySerializer(serializers.ModelSerializer):
+    class_name = serializers.CharField(source='class_room.class_name', read_only=True)
+    quiz_name = serializers.CharField(source='quiz.quiz_name', read_only=True)
+
+    class Meta:
+        model = GradebookEntry
+        fields = ['class_room', 'class_name', 'quiz', 'quiz_name', 'quiz_answer', 'score', 'credit', 'submitted_at']
+
+
+class RosterSerializer(serializers.Serializer):
+    """
+    usernames to enroll, as a list or as a csv file with the usernames in the first column
+    """
+    usernames = serializers.ListField(child=serializers.CharField(), required=False)
+    file = serializers.FileField(required=False, write_only=True)
+
+    def validate(self, attrs):
+        if 'file' in attrs:
+            try:
+                lines = (line.decode('utf-8') for line in attrs.pop('file'))
+                attrs['usernames'] = attrs.get('usernames', []) + list(read_roster(lines))
+            except UnicodeDecodeError:
+                raise serializers.ValidationError({'file': [_("Roster must be an utf-8 csv file")]})
+
+        if not attrs.get('usernames'):
+            raise serializers.ValidationError(_("Give the usernames or a roster file"))
+
+        return attrs
+
+    def create(self, validated_data):
+        return enroll_usernames(self.context['class_room'].id, validated_data['usernames'])
@@ -0,0 +1,194 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core.analytics import invalidate_quiz_analytics
+from core.authentication import token_cache
+from core.enrollment import Enrollment, invalidate_enrollment
+from core.gradebook import add_gradebook_entry
+from core.events import publish, quiz_channel, quiz_user_channel, class_channel
+from core.models import Quiz, Question, Answer, QuizAnswer, UserProfile
+from core.serializers import QuizSerializer
+from core.totals import add_to_quiz_totals, add_to_quiz_answer_totals
+
+
+@receiver(pre_save, sender=Question)
+def remember_question_credit(sender, instance, **kwargs):
+    instance._previous_totals = None
+    if instance.pk and not instance._state.adding:
+        instance._previous_totals = Question.objects.filter(pk=instance.pk).values('quiz_id', 'credit').first()
+
+
+@receiver(post_save, sender=Question)
+def update_quiz_totals_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_totals', None)
+
+    if created or previous is None:
+        add_to_quiz_totals(instance.quiz_id, credit=instance.credit, questions=1)
+    elif previous['quiz_id'] != instance.quiz_id:
+        add_to_quiz_totals(previous['quiz_id'], credit=-previous['credit'], questions=-1)
+        add_to_quiz_totals(instance.quiz_id, credit=instance.credit, questions=1)
+    else:
+        add_to_quiz_totals(instance.quiz_id, credit=instance.credit - previous['credit'])
+
+
+@receiver(post_delete, sender=Question)
+def update_quiz_totals_on_delete(sender, instance, **kwargs):
+    add_to_quiz_totals(instance.quiz_id, credit=-instance.credit, questions=-1)
+
+
+@receiver(pre_save, sender=Answer)
+def remember_answer_score(sender, instance, **kwargs):
+    instance._previous_totals = None
+    if instance.pk and not instance._state.adding:
+        instance._previous_totals = Answer.objects.filter(pk=instance.pk).values('quiz_answer_id', 'score').first()
+
+
+@receiver(post_save, sender=Answer)
+def update_quiz_answer_totals_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_totals', None)
+
+    if created or previous is None:
+        add_to_quiz_answer_totals(instance.quiz_answer_id, score=instance.score, answered=1)
+    elif previous['quiz_answer_id'] != instance.quiz_answer_id:
+        add_to_quiz_answer_totals(previous['quiz_answer_id'], score=-previous['score'], answered=-1)
+        add_to_quiz_answer_totals(instance.quiz_answer_id, score=instance.score, answered=1)
+    else:
+        add_to_quiz_answer_totals(instance.quiz_answer_id, score=instance.score - previous['score'])
+
+
+@receiver(post_delete, sender=Answer)
+def update_quiz_answer_totals_on_delete(sender, instance, **kwargs):
+    add_to_quiz_answer_totals(instance.quiz_answer_id, score=-instance.score, answered=-1)
+
+
+@receiver(post_save, sender=QuizAnswer)
+def create_gradebook_entry(sender, instance, created, **kwargs):
+    if created:
+        add_gradebook_entry(instance, instance.quiz)
+
+
+@receiver(m2m_changed, sender=Enrollment)
+def invalidate_enrollment_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # changed from the user profile side, e.g. user_profile.classes.add(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_enrollment(instance.pk)
+        return
+
+    if action == 'pre_clear':
+        # pk_set is not given for clear, remember the students before they are removed
+        instance._cleared_student_ids = list(instance.students.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate_enrollment(*getattr(instance, '_cleared_student_ids', []))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        invalidate_enrollment(*pk_set)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    token_cache.delete_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_cached_user_profile(sender, instance, **kwargs):
+    token_cache.delete_user(instance.user_id)
+
+
+@receiver(pre_save, sender=Quiz)
+def remember_quiz_published(sender, instance, **kwargs):
+    instance._was_published = None
+    if instance.pk and not instance._state.adding:
+        instance._was_published = Quiz.objects.filter(pk=instance.pk).values_list('is_published', flat=True).first()
+
+
+@receiver(post_save, sender=Quiz)
+def publish_quiz_saved(sender, instance, created, **kwargs):
+    quiz = QuizSerializer(instance=instance).data
+    published = instance.is_published and getattr(instance, '_was_published', None) is False
+
+    def send():
+        publish(class_channel(instance.class_room_id), 'quiz.created' if created else 'quiz.updated', quiz=quiz)
+        if not created:
+            publish(quiz_channel(instance.id), 'quiz.updated', quiz=quiz)
+        if published:
+            publish(quiz_channel(instance.id), 'quiz.published', quiz=quiz)
+
+    transaction.on_commit(send)
+
+
+@receiver(post_delete, sender=Quiz)
+def publish_quiz_deleted(sender, instance, **kwargs):
+    def send():
+        publish(class_channel(instance.class_room_id), 'quiz.deleted', quiz={'id': instance.id})
+        publish(quiz_channel(instance.id), 'quiz.deleted', quiz={'id': instance.id})
+
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def publish_questions_changed(sender, instance, **kwargs):
+    quiz_id = instance.quiz_id
+
+    def send():
+        totals = Quiz.objects.filter(pk=quiz_id).values('questions_version', 'total_credit', 'total_questions').first()
+        if totals is not None:
+            publish(quiz_channel(quiz_id), 'quiz.questions_changed', quiz_id=quiz_id,
+                    questions_version=totals['questions_version'], credit=totals['total_credit'],
+                    questions_count=totals['total_questions'])
+
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Answer)
+def publish_answer_scored(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_totals', None)
+    if created or previous is None or previous['score'] == instance.score:
+        return
+
+    transaction.on_commit(lambda: publish_scores(instance.quiz_answer_id, {instance.id: instance.score}))
+
+
+def publish_scores(quiz_answer_id, scores):
+    """
+    tell the student of the session about new answer scores, {answer id: score}
+    """
+    session = QuizAnswer.objects.filter(pk=quiz_answer_id).values('quiz_id', 'user_profile_id', 'total_score').first()
+    if session is None:
+        return
+
+    channel = quiz_user_channel(session['quiz_id'], session['user_profile_id'])
+    for answer_id, score in scores.items():
+        publish(channel, 'answer.scored', quiz_answer_id=quiz_answer_id, answer_id=answer_id, score=score,
+                total_score=session['total_score'])
+
+
+@receiver(post_save, sender=Answer)
+def invalidate_analytics_on_score(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_totals', None)
+    if created or previous is None or previous['score'] != instance.score:
+        quiz_id = instance.question.quiz_id
+        transaction.on_commit(lambda: invalidate_quiz_analytics(quiz_id))
+
+
+@receiver(post_delete, sender=Answer)
+def invalidate_analytics_on_answer_delete(sender, instance, **kwargs):
+    quiz_id = instance.question.quiz_id
+    transaction.on_commit(lambda: invalidate_quiz_analytics(quiz_id))
+
+
+@receiver(post_save, sender=QuizAnswer)
+@receiver(post_delete, sender=QuizAnswer)
+def invalidate_analytics_on_session(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        transaction.on_commit(lambda: invalidate_quiz_analytics(instance.quiz_id))
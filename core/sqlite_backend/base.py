@@ -0,0 +1,17 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    sqlite backend taking the write lock when a write transaction starts
+
+    with a plain BEGIN, a transaction that reads and then writes has to upgrade its lock,
+    and concurrent upgrades fail at once with "database is locked" instead of waiting for
+    busy_timeout. blocks opened with core.db.write_atomic start with BEGIN IMMEDIATE, so
+    writers queue on the busy timeout instead, other transactions start with a plain BEGIN
+    and don't hold up writers.
+    """
+    write_transaction = False
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE" if self.write_transaction else "BEGIN")
@@ -0,0 +1,178 @@
+"""
+deterministic synthetic datasets for benchmarks and load tests
+
+every row is inserted with bulk_create, stored totals and the gradebook are computed afterwards.
+the same seed and sizes always give the same classes, students, questions, answers and scores.
+exam_fixture gives the benchmark commands a throwaway class with a running quiz instead.
+"""
+import random
+import re
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.db import write_atomic
+from core.enrollment import Enrollment
+from core.gradebook import gradebook_entries
+from core.models import UserProfile, ClassRoom, Quiz, Question, QuizAnswer, Answer, GradebookEntry
+from core.totals import recompute_quiz_totals, recompute_quiz_answer_totals
+
+BATCH_SIZE = 2000
+
+
+def _bulk_create(model, objects):
+    # django 3.0 lets an explicit batch_size exceed the sqlite limits, leave it to the backend
+    model.objects.bulk_create(objects)
+
+
+def _profiles(prefix, usernames, password='!'):
+    """
+    user profiles (with tokens) of new users with the given usernames, all starting with prefix.
+    password is the stored hash, by default no usable password and clients use their tokens
+    """
+    _bulk_create(User, [User(username=username, password=password) for username in usernames])
+    user_ids = dict(User.objects.filter(username__startswith=prefix).values_list('username', 'pk'))
+
+    _bulk_create(UserProfile, [UserProfile(user_id=user_ids[username]) for username in usernames])
+    tokens = [Token(user_id=user_ids[username]) for username in usernames]
+    for token in tokens:
+        token.key = token.generate_key()
+    _bulk_create(Token, tokens)
+
+    profile_ids = dict(UserProfile.objects.filter(user__username__startswith=prefix)
+                       .values_list('user__username', 'pk'))
+    return [profile_ids[username] for username in usernames]
+
+
+def generate_dataset(prefix, seed=0, classes=2, students=2000, quizzes=3, questions=30, answer_rate=0.8):
+    """
+    create classes of students and quizzes, every student starts every quiz and answers
+    about answer_rate of the questions. the first quiz of every class is running, the others ended.
+    returns {'classes': [class ids], 'quizzes': [quiz ids]}
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    class_ids, quiz_ids = [], []
+
+    with write_atomic():
+        for class_index in range(classes):
+            class_prefix = '%s-c%s' % (prefix, class_index)
+            teacher_id, *student_ids = _profiles(class_prefix + '-', ['%s-teacher' % class_prefix] +
+                                                 ['%s-s-%05d' % (class_prefix, index) for index in range(students)])
+
+            class_room = ClassRoom.objects.create(class_name=class_prefix, teacher_id=teacher_id)
+            _bulk_create(Enrollment, [Enrollment(classroom_id=class_room.id, userprofile_id=student_id)
+                                      for student_id in student_ids])
+            class_ids.append(class_room.id)
+
+            for quiz_index in range(quizzes):
+                start = now - timedelta(hours=1) if quiz_index == 0 else now - timedelta(days=7 * quiz_index)
+                quiz = Quiz.objects.create(quiz_name='%s-q%s' % (class_prefix, quiz_index), class_room=class_room,
+                                           start_datetime=start, end_datetime=start + timedelta(days=1),
+                                           is_published=True)
+                quiz_ids.append(quiz.id)
+
+                _bulk_create(Question, [Question(quiz=quiz, text='question %s' % index, credit=rng.randint(1, 5))
+                                        for index in range(questions)])
+                credits = list(quiz.questions.order_by('id').values_list('pk', 'credit'))
+
+                _bulk_create(QuizAnswer, [QuizAnswer(user_profile_id=student_id, quiz=quiz)
+                                          for student_id in student_ids])
+                sessions = list(quiz.answers.order_by('user_profile_id').values_list('pk', flat=True))
+
+                answers = []
+                for session_id in sessions:
+                    for question_id, credit in credits:
+                        if rng.random() < answer_rate:
+                            answers.append(Answer(question_id=question_id, quiz_answer_id=session_id,
+                                                  answer='answer %s' % rng.randint(0, 9),
+                                                  score=rng.randint(0, credit), is_graded=quiz_index > 0))
+                        if len(answers) >= BATCH_SIZE:
+                            _bulk_create(Answer, answers)
+                            answers = []
+                _bulk_create(Answer, answers)
+
+        quizzes_queryset = Quiz.objects.filter(pk__in=quiz_ids)
+        recompute_quiz_totals(quizzes_queryset)
+        recompute_quiz_answer_totals(QuizAnswer.objects.filter(quiz__in=quizzes_queryset))
+        _bulk_create(GradebookEntry, list(gradebook_entries(QuizAnswer.objects.filter(quiz__in=quizzes_queryset))))
+
+    return {'classes': class_ids, 'quizzes': quiz_ids}
+
+
+def _classes(prefix):
+    return ClassRoom.objects.filter(class_name__regex=r'^%s-c[0-9]+$' % re.escape(prefix))
+
+
+def _users(prefix):
+    # only the usernames generate_dataset gives, never other accounts sharing the prefix
+    return User.objects.filter(username__regex=r'^%s-c[0-9]+-(teacher|s-[0-9]{5,})$' % re.escape(prefix))
+
+
+@contextmanager
+def exam_fixture(kind, students=0, questions=0, password='!'):
+    """
+    a class of new students with a running quiz of questions, deleted on exit
+
+    users are named <kind>-<random hex>-<n>, n 0 is the teacher. password is the stored hash
+    of every user (see _profiles). yields a namespace of teacher and students (user profiles
+    with their users), quiz, questions and tokens ({user profile id: token key})
+    """
+    prefix = '%s-%s-' % (kind, uuid.uuid4().hex[:8])
+    usernames = ['%s%s' % (prefix, index) for index in range(students + 1)]
+    profile_ids = _profiles(prefix, usernames, password)
+    profiles = UserProfile.objects.select_related('user').in_bulk(profile_ids)
+    teacher, *student_profiles = [profiles[profile_id] for profile_id in profile_ids]
+    tokens = dict(Token.objects.filter(user__user_profile__in=profile_ids).values_list('user__user_profile', 'key'))
+
+    class_room = ClassRoom.objects.create(class_name=prefix.rstrip('-'), teacher=teacher)
+    _bulk_create(Enrollment, [Enrollment(classroom_id=class_room.id, userprofile_id=student.id)
+                              for student in student_profiles])
+
+    now = timezone.now()
+    quiz = Quiz.objects.create(quiz_name=prefix.rstrip('-'), class_room=class_room,
+                               start_datetime=now - timedelta(hours=1), end_datetime=now + timedelta(hours=2))
+    _bulk_create(Question, [Question(quiz=quiz, text=str(index), credit=1) for index in range(questions)])
+    recompute_quiz_totals(Quiz.objects.filter(pk=quiz.pk))
+
+    try:
+        yield SimpleNamespace(teacher=teacher, students=student_profiles, quiz=quiz,
+                              questions=list(quiz.questions.order_by('id')), tokens=tokens)
+    finally:
+        class_room.delete()
+        User.objects.filter(username__regex=r'^%s[0-9]+$' % re.escape(prefix)).delete()
+
+
+def dataset_exists(prefix):
+    return _classes(prefix).exists()
+
+
+def delete_dataset(prefix):
+    """
+    delete a generated dataset
+
+    answers, sessions, gradebook entries, questions and enrollments are deleted table by table
+    without loading them, their signals only keep totals of rows deleted along with them.
+    quizzes, classes and users go through delete(), whose signals drop the cached tokens
+    and users and publish the deleted quizzes
+    """
+    classes = _classes(prefix)
+    quizzes = Quiz.objects.filter(class_room__in=classes)
+
+    # subqueries rather than joins, a delete runs on a single table
+    with write_atomic():
+        for queryset in (GradebookEntry.objects.filter(quiz__in=quizzes),
+                         Answer.objects.filter(question__in=Question.objects.filter(quiz__in=quizzes)),
+                         QuizAnswer.objects.filter(quiz__in=quizzes),
+                         Question.objects.filter(quiz__in=quizzes),
+                         Enrollment.objects.filter(classroom__in=classes)):
+            queryset._raw_delete(queryset.db)
+
+        quizzes.delete()
+        classes.delete()
+        _users(prefix).delete()
@@ -0,0 +1,50 @@
+"""
+local background task queue, tasks run on a pool of worker threads of the process
+
+tasks are lost if the process stops before they run, queue only work that can be started again
+(e.g. grading the answers that are still ungraded).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def task_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.TASK_WORKERS, thread_name_prefix='task')
+    return _executor
+
+
+def _run(function, *args):
+    close_old_connections()
+    try:
+        return function(*args)
+    except Exception:
+        logger.exception("background task %s failed", function.__name__)
+        raise
+    finally:
+        close_old_connections()
+
+
+def enqueue(function, *args):
+    """
+    run function(*args) on the task workers, returns its future
+
+    with TASKS_EAGER the task runs right away in the calling thread
+    """
+    if not settings.TASKS_EAGER:
+        return task_executor().submit(_run, function, *args)
+
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as error:
+        future.set_exception(error)
+    return future
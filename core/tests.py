@@ -1,3 +1,1313 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import renderers
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+from core.answer_buffer import get_answer_buffer, recover_journals
+from core.answers import upsert_answers
+from core.async_exam import ASGIHandler, ExamEndpointsRouter, ROUTES, run_db
+from core.authentication import token_cache
+from core.db import write_atomic
+from core.management.commands.benchmark_api import Command as BenchmarkCommand
+from core.enrollment import is_enrolled, enroll_usernames
+from core.grading import get_grader, set_scores
+from core.metrics import registry
+from core.profiling import read_profile
+from core.renderers import JSONRenderer, JSONParser, orjson
+from core.serializers import QuizSerializer
+from core.synthetic import generate_dataset, delete_dataset, exam_fixture
+from core.totals import recompute_quiz_answer_totals
+from core.models import UserProfile, ClassRoom, Quiz, Question, QuizAnswer, Answer, GradebookEntry
+
+
+def create_user_profile(username, **kwargs):
+    user = User.objects.create_user(username=username, password='password', **kwargs)
+    return UserProfile.objects.create(user=user)
+
+
+def create_quiz(class_room, **kwargs):
+    now = timezone.now()
+    kwargs.setdefault('quiz_name', 'quiz')
+    kwargs.setdefault('start_datetime', now - timedelta(hours=1))
+    kwargs.setdefault('end_datetime', now + timedelta(hours=1))
+    return Quiz.objects.create(class_room=class_room, **kwargs)
+
+
+class QuizTotalsTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room)
+        self.quiz_answer = QuizAnswer.objects.create(user_profile=self.student, quiz=self.quiz)
+
+    def test_question_changes_update_quiz_totals(self):
+        first = Question.objects.create(quiz=self.quiz, text='first', credit=3)
+        second = Question.objects.create(quiz=self.quiz, text='second', credit=5)
+
+        second.credit = 7
+        second.save()
+        first.delete()
+
+        self.quiz.refresh_from_db()
+        self.assertEqual(self.quiz.credit, 7)
+        self.assertEqual(self.quiz.questions_count, 1)
+
+    def test_answer_changes_update_quiz_answer_totals(self):
+        question = Question.objects.create(quiz=self.quiz, text='question', credit=10)
+        other = Question.objects.create(quiz=self.quiz, text='other', credit=10)
+        answer = Answer.objects.create(question=question, quiz_answer=self.quiz_answer, answer='a')
+        Answer.objects.create(question=other, quiz_answer=self.quiz_answer, answer='b', score=2)
+
+        answer.score = 4
+        answer.save()
+
+        self.quiz_answer.refresh_from_db()
+        self.assertEqual(self.quiz_answer.score, 6)
+        self.assertEqual(self.quiz_answer.answered_count, 2)
+
+        # cascading question delete removes its answers from the session totals
+        other.delete()
+
+        self.quiz_answer.refresh_from_db()
+        self.assertEqual(self.quiz_answer.score, 4)
+        self.assertEqual(self.quiz_answer.answered_count, 1)
+
+    def test_recompute_totals_command(self):
+        question = Question.objects.create(quiz=self.quiz, text='question', credit=10)
+        Answer.objects.create(question=question, quiz_answer=self.quiz_answer, answer='a', score=8)
+        Quiz.objects.update(total_credit=0)
+        QuizAnswer.objects.update(total_score=0)
+
+        with self.assertRaises(CommandError):
+            call_command('recompute_totals', '--check', stdout=StringIO())
+
+        call_command('recompute_totals', stdout=StringIO())
+        call_command('recompute_totals', '--check', stdout=StringIO())
+
+        self.quiz.refresh_from_db()
+        self.quiz_answer.refresh_from_db()
+        self.assertEqual(self.quiz.credit, 10)
+        self.assertEqual(self.quiz_answer.score, 8)
+
+
+class QuizTakersListTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room)
+        self.questions = [Question.objects.create(quiz=self.quiz, text=str(i), credit=2) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher.user)
+
+    def add_takers(self, count):
+        for i in range(QuizAnswer.objects.count(), QuizAnswer.objects.count() + count):
+            quiz_answer = QuizAnswer.objects.create(user_profile=create_user_profile('student%s' % i), quiz=self.quiz)
+            for question in self.questions:
+                Answer.objects.create(question=question, quiz_answer=quiz_answer, answer='a', score=1)
+
+    def test_query_count_does_not_depend_on_takers(self):
+        url = '/api/quiz/%s/takers/list/' % self.quiz.id
+
+        self.add_takers(2)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.data['count'], 2)
+
+        self.add_takers(10)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(response.data['results'][0]['score'], 3)
+        self.assertEqual(response.data['results'][0]['quiz']['credit'], 6)
+
+    def test_fields_and_expand(self):
+        url = '/api/quiz/%s/takers/list/' % self.quiz.id
+        self.add_takers(2)
+
+        # answers are not prefetched when left out
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'fields': 'id,score'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'score'})
+
+        response = self.client.get(url, {'expand': 'user_profile'})
+        taker = response.data['results'][0]
+        self.assertEqual(taker['user_profile']['user']['username'], 'student0')
+        self.assertEqual(taker['quiz'], self.quiz.id)
+        self.assertEqual(taker['answers'], list(Answer.objects.filter(quiz_answer=taker['id'])
+                                                .order_by('id').values_list('pk', flat=True)))
+
+
+class RequestObjectsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.class_room.students.add(self.student)
+        self.quiz = create_quiz(self.class_room)
+        Question.objects.create(quiz=self.quiz, text='question', credit=2)
+        self.client = APIClient()
+
+    def test_quiz_chain_is_fetched_once_per_request(self):
+        self.client.force_authenticate(self.student.user)
+
+        # quiz with class and teacher, enrollment, questions
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/quiz/%s/questions/' % self.quiz.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+    def test_start_quiz_uses_resolved_quiz(self):
+        self.client.force_authenticate(self.student.user)
+
+        response = self.client.post('/api/quiz/%s/start/' % self.quiz.id)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quiz']['id'], self.quiz.id)
+
+
+@override_settings(ENROLLMENT_CACHE_TIMEOUT=60)
+class EnrollmentCacheTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.client = APIClient()
+
+    def test_membership_changes_invalidate_cache(self):
+        self.assertFalse(is_enrolled(self.class_room.id, self.student.id))
+
+        self.client.force_authenticate(self.student.user)
+        self.client.post('/api/class/%s/register/' % self.class_room.id)
+        self.assertTrue(is_enrolled(self.class_room.id, self.student.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_enrolled(self.class_room.id, self.student.id))
+
+        self.client.force_authenticate(self.teacher.user)
+        self.client.delete('/api/class/%s/register/student/' % self.class_room.id)
+        self.assertFalse(is_enrolled(self.class_room.id, self.student.id))
+
+        self.class_room.students.add(self.student)
+        self.assertTrue(is_enrolled(self.class_room.id, self.student.id))
+
+        self.class_room.students.clear()
+        self.assertFalse(is_enrolled(self.class_room.id, self.student.id))
+
+
+class QuizQuestionsCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.class_room.students.add(self.student)
+        self.quiz = create_quiz(self.class_room)
+        self.question = Question.objects.create(quiz=self.quiz, text='question', credit=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student.user)
+        self.url = '/api/quiz/%s/questions/' % self.quiz.id
+
+    def test_payload_is_cached_and_revalidated_with_etag(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        # quiz with class and teacher, enrollment, no questions query
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data[0]['text'], 'question')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_question_change_bumps_version(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.question.text = 'changed'
+        self.question.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data[0]['text'], 'changed')
+
+
+class SubmitAnswersTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room)
+        self.questions = [Question.objects.create(quiz=self.quiz, text=str(i), credit=2) for i in range(3)]
+        self.quiz_answer = QuizAnswer.objects.create(user_profile=self.student, quiz=self.quiz)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student.user)
+        self.url = '/api/quiz-answer/%s/submit-answers/' % self.quiz_answer.id
+
+    def test_submit_creates_and_updates_answers(self):
+        Answer.objects.create(question=self.questions[0], quiz_answer=self.quiz_answer, answer='old', score=1)
+        other_quiz = create_quiz(self.class_room)
+        foreign = Question.objects.create(quiz=other_quiz, text='foreign')
+
+        response = self.client.post(self.url, {'answers': [
+            {'question': self.questions[0].id, 'answer': 'new'},
+            {'question': self.questions[1].id, 'answer': 'first'},
+            {'question': foreign.id, 'answer': 'nope'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], ['updated', 'created', 'error'])
+        self.assertEqual(Answer.objects.get(question=self.questions[0]).answer, 'new')
+        self.assertFalse(Answer.objects.filter(question=foreign).exists())
+
+        self.quiz_answer.refresh_from_db()
+        self.assertEqual(self.quiz_answer.answered_count, 2)
+        self.assertEqual(self.quiz_answer.score, 1)
+
+    def test_other_users_session_is_rejected(self):
+        self.client.force_authenticate(self.teacher.user)
+
+        response = self.client.post(self.url, {'answers': [{'question': self.questions[0].id, 'answer': 'a'}]},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Answer.objects.exists())
+
+
+@override_settings(TASKS_EAGER=True)
+class GradingTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room)
+        self.exact = Question.objects.create(quiz=self.quiz, text='capital', credit=2, grading='exact',
+                                             answer_key='Paris\nparis, france')
+        self.regex = Question.objects.create(quiz=self.quiz, text='year', credit=3, grading='regex',
+                                             answer_key=r'19\d\d')
+        self.manual = Question.objects.create(quiz=self.quiz, text='essay', credit=5)
+        self.quiz_answer = QuizAnswer.objects.create(user_profile=self.student, quiz=self.quiz)
+        self.answers = [Answer.objects.create(question=question, quiz_answer=self.quiz_answer, answer=text)
+                        for question, text in ((self.exact, ' PARIS '), (self.regex, '2001'), (self.manual, '...'))]
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher.user)
+
+    def test_auto_grading_scores_ungraded_answers(self):
+        response = self.client.post('/api/quiz/%s/grade/' % self.quiz.id)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['queued'], 2)
+        self.assertEqual([(a.score, a.is_graded) for a in Answer.objects.order_by('id')],
+                         [(2, True), (0, True), (0, False)])
+        self.quiz_answer.refresh_from_db()
+        self.assertEqual(self.quiz_answer.score, 2)
+
+        # a changed answer is graded again
+        upsert_answers(self.quiz_answer.id, {self.regex.id: '1999'})
+        self.assertEqual(self.client.post('/api/quiz/%s/grade/' % self.quiz.id).data['queued'], 1)
+        self.quiz_answer.refresh_from_db()
+        self.assertEqual(self.quiz_answer.score, 5)
+
+    def test_batch_scores(self):
+        other = Answer.objects.create(question=Question.objects.create(quiz=create_quiz(self.class_room), credit=1),
+                                      quiz_answer=self.quiz_answer, answer='other')
+
+        response = self.client.post('/api/quiz/%s/set-scores/' % self.quiz.id, {'scores': [
+            {'answer': self.answers[2].id, 'score': 4},
+            {'answer': self.answers[0].id, 'score': 3},
+            {'answer': other.id, 'score': 1},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], ['updated', 'error', 'error'])
+        self.assertTrue(Answer.objects.get(pk=self.answers[2].id).is_graded)
+        self.quiz_answer.refresh_from_db()
+        self.assertEqual(self.quiz_answer.score, 4)
+
+        self.client.force_authenticate(self.student.user)
+        response = self.client.post('/api/quiz/%s/set-scores/' % self.quiz.id, {'scores': []}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_answer_keys_are_validated_and_hidden_from_students(self):
+        for pattern in ('(', '(a+)+$', 'a' * 201):
+            response = self.client.post('/api/quiz/%s/question/create/' % self.quiz.id,
+                                        {'text': 'q', 'credit': 1, 'grading': 'regex', 'answer_key': pattern})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('answer_key', response.data)
+
+        response = self.client.get('/api/question/%s/' % self.regex.id)
+        self.assertEqual((response.data['grading'], response.data['answer_key']), ('regex', r'19\d\d'))
+
+        response = self.client.get('/api/quiz/%s/questions/' % self.quiz.id)
+        self.assertNotIn('answer_key', response.data[0])
+
+        self.client.force_authenticate(self.student.user)
+        response = self.client.get('/api/quiz-answer/%s/' % self.quiz_answer.id)
+        self.assertNotIn('answer_key', response.data['answers'][0]['question'])
+
+        response = self.client.get('/api/question/%s/' % self.regex.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('answer_key', response.data)
+        self.assertNotIn('grading', response.data)
+
+        # the schema generator has no question to pick the serializer by
+        schema = json.loads(self.client.get('/api/swagger.json').content)
+        self.assertEqual(schema['paths']['/question/{question_id}/']['get']['responses']['200']['schema'],
+                         {'$ref': '#/definitions/Question'})
+
+    def test_long_answers_fail_regex_grading(self):
+        digits = Question(quiz=self.quiz, credit=1, grading='regex', answer_key=r'\d+')
+        self.assertEqual(get_grader('regex').grade(digits, '1' * 1000), 1)
+        self.assertEqual(get_grader('regex').grade(digits, '1' * 1001), 0)
+
+
+class ExportResultsTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room)
+        questions = [Question.objects.create(quiz=self.quiz, text='q%s' % i, credit=2) for i in range(2)]
+        for index in range(3):
+            quiz_answer = QuizAnswer.objects.create(user_profile=create_user_profile('s%s' % index), quiz=self.quiz)
+            for question in questions:
+                Answer.objects.create(question=question, quiz_answer=quiz_answer, answer='a, "b"', score=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher.user)
+
+    def test_csv_export_streams_rows_from_one_query(self):
+        response = self.client.get('/api/quiz/%s/export/' % self.quiz.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        with self.assertNumQueries(1):
+            content = b''.join(response.streaming_content).decode()
+
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual((rows[0]['username'], rows[0]['answer'], rows[0]['total_score']), ('s0', 'a, "b"', '2'))
+
+    def test_csv_export_escapes_formulas(self):
+        Answer.objects.filter(question__text='q0').update(answer='=HYPERLINK("http://x")')
+        Answer.objects.filter(question__text='q1').update(answer='-1', score=-1)
+
+        response = self.client.get('/api/quiz/%s/export/' % self.quiz.id)
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0]['answer'], '\'=HYPERLINK("http://x")')
+        self.assertEqual((rows[1]['answer'], rows[1]['score']), ("'-1", '-1'))
+
+        response = self.client.get('/api/quiz/%s/export/?format=ndjson' % self.quiz.id)
+        self.assertEqual(json.loads(next(iter(response.streaming_content)))['answer'], '=HYPERLINK("http://x")')
+
+    def test_ndjson_export_of_a_class(self):
+        response = self.client.get('/api/class/%s/export/?format=ndjson' % self.class_room.id)
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[-1]['username'], 's2')
+
+    def test_only_teachers_export(self):
+        self.client.force_authenticate(create_user_profile('other').user)
+
+        response = self.client.get('/api/quiz/%s/export/' % self.quiz.id)
+        self.assertEqual(response.status_code, 403)
+
+
+class AnalyticsTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = create_user_profile('teacher')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room)
+        self.questions = [Question.objects.create(quiz=self.quiz, text='q%s' % i, credit=5) for i in range(2)]
+        self.answers = []
+        for index, scores in enumerate([(5, 5), (5, 0), (2, 0), (5, 3)]):
+            quiz_answer = QuizAnswer.objects.create(user_profile=create_user_profile('s%s' % index), quiz=self.quiz)
+            self.answers += [Answer.objects.create(question=question, quiz_answer=quiz_answer, answer='a', score=score)
+                             for question, score in zip(self.questions, scores)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher.user)
+        self.url = '/api/quiz/%s/analytics/' % self.quiz.id
+
+    def test_quiz_statistics(self):
+        data = self.client.get(self.url, {'bins': 2}).data
+
+        self.assertEqual((data['takers'], data['mean'], data['min'], data['max']), (4, 6.25, 2, 10))
+        self.assertEqual(data['median'], 6.5)
+        self.assertEqual(data['percentiles']['p25'], 4.25)
+        self.assertEqual([(row['score'], row['count']) for row in data['distribution']],
+                         [(2, 1), (5, 1), (8, 1), (10, 1)])
+        self.assertEqual([row['count'] for row in data['histogram']], [1, 3])
+        self.assertEqual([(row['full_credit'], row['difficulty']) for row in data['questions']],
+                         [(3, 0.85), (1, 0.4)])
+
+    def test_statistics_are_cached_until_a_score_changes(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            # the quiz, with its class for the permission check
+            self.client.get(self.url)
+
+        response = self.client.put('/api/answer/%s/set-score/' % self.answers[5].id, {'score': 5})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get(self.url).data['mean'], 7.5)
+
+    def test_bulk_answer_writes_invalidate_statistics(self):
+        session = self.answers[7].quiz_answer_id
+        self.answers[7].delete()
+        self.assertEqual(self.client.get(self.url).data['questions'][1]['answered'], 3)
+
+        upsert_answers(session, {self.questions[1].id: 'late'})
+
+        self.assertEqual(self.client.get(self.url).data['questions'][1]['answered'], 4)
+
+
+class GradebookTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.client = APIClient()
+        self.client.force_authenticate(self.student.user)
+
+        self.quizzes = []
+        for name in ('a', 'b'):
+            class_room = ClassRoom.objects.create(class_name=name, teacher=self.teacher)
+            class_room.students.add(self.student)
+            self.quizzes.append(create_quiz(class_room, quiz_name=name))
+
+    def test_grades_follow_answers_scores_and_questions(self):
+        question = Question.objects.create(quiz=self.quizzes[0], text='q', credit=4)
+        session = self.client.post('/api/quiz/%s/start/' % self.quizzes[0].id).data
+        self.client.post('/api/quiz/%s/start/' % self.quizzes[1].id)
+        answer = self.client.post('/api/submit-answer/', {'question': question.id, 'quiz_answer': session['id'],
+                                                          'answer': 'answer'}).data
+
+        set_scores(self.quizzes[0].id, {answer['id']: 3})
+        Question.objects.create(quiz=self.quizzes[0], text='q2', credit=2)
+
+        with self.assertNumQueries(1):
+            grades = self.client.get('/api/my/grades/').data
+
+        self.assertEqual([(g['class_name'], g['quiz_name'], g['score'], g['credit']) for g in grades],
+                         [('a', 'a', 3, 6), ('b', 'b', 0, 0)])
+
+    def test_only_answers_move_the_submission_time(self):
+        question = Question.objects.create(quiz=self.quizzes[0], text='q', credit=4)
+        session = self.client.post('/api/quiz/%s/start/' % self.quizzes[0].id).data
+        entry = GradebookEntry.objects.filter(quiz_answer_id=session['id'])
+        answer = {'question': question.id, 'quiz_answer': session['id'], 'answer': 'answer'}
+
+        submitted = []
+        for write in (lambda: self.client.post('/api/submit-answer/', answer),
+                      lambda: self.client.post('/api/submit-answer/', answer),
+                      lambda: set_scores(self.quizzes[0].id, {Answer.objects.get().id: 3}),
+                      lambda: upsert_answers(session['id'], {question.id: 'changed'})):
+            write()
+            submitted.append(entry.get().submitted_at)
+
+        self.assertTrue(submitted[0] < submitted[1] == submitted[2] < submitted[3])
+
+    def test_rebuild_command(self):
+        quiz_answer = QuizAnswer.objects.create(user_profile=self.student, quiz=self.quizzes[0])
+        Answer.objects.create(question=Question.objects.create(quiz=self.quizzes[0], credit=2),
+                              quiz_answer=quiz_answer, answer='a', score=2)
+        expected = list(GradebookEntry.objects.values_list('quiz_answer', 'score', 'credit'))
+        GradebookEntry.objects.all().delete()
+
+        call_command('rebuild_gradebook', stdout=StringIO())
+
+        self.assertEqual(list(GradebookEntry.objects.values_list('quiz_answer', 'score', 'credit')), expected)
+        self.assertEqual(expected, [(quiz_answer.id, 2, 2)])
+
+
+class RosterTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.students = [create_user_profile('s%s' % index) for index in range(5)]
+        self.class_room.students.add(self.students[0])
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher.user)
+        self.url = '/api/class/%s/roster/' % self.class_room.id
+
+    def test_bulk_enrollment_reports_unknown_usernames(self):
+        with self.assertNumQueries(5):
+            # IN lookup, existing enrollments, insert, inside a savepoint
+            report = enroll_usernames(self.class_room.id, ['s0', 's1', 'nobody', 's2', 's1'])
+
+        self.assertEqual(report, {'enrolled': 2, 'already_enrolled': 1, 'unknown': ['nobody']})
+        self.assertEqual(self.class_room.students.count(), 3)
+
+    def test_csv_roster_upload_and_command(self):
+        roster = SimpleUploadedFile('roster.csv', b'username,name\ns1,One\ns2,Two\nghost,Ghost\n')
+
+        response = self.client.post(self.url, {'file': roster}, format='multipart')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unknown'], ['ghost'])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as roster:
+            roster.write('s3\ns4\n')
+            roster.flush()
+            call_command('import_roster', self.class_room.id, roster.name, batch_size=1, stdout=StringIO())
+
+        self.assertEqual(self.class_room.students.count(), 5)
+
+    def test_rosters_saved_by_excel(self):
+        for content in ('\ufeffusername\r\ns1\r\n', '\ufeff"s2"\r\ns3\r\n'):
+            roster = SimpleUploadedFile('roster.csv', content.encode('utf-8'))
+            response = self.client.post(self.url, {'file': roster}, format='multipart')
+            self.assertEqual(response.data['unknown'], [])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8') as roster:
+            roster.write('\ufeffs4\n')
+            roster.flush()
+            call_command('import_roster', self.class_room.id, roster.name, stdout=StringIO())
+
+        self.assertEqual(self.class_room.students.count(), 5)
+
+    def test_only_teachers_enroll(self):
+        self.client.force_authenticate(self.students[1].user)
+
+        response = self.client.post(self.url, {'usernames': ['s1']}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class SyntheticDataTest(TestCase):
+
+    def generate(self, prefix):
+        generate_dataset(prefix, seed=7, classes=1, students=6, quizzes=2, questions=4, answer_rate=0.5)
+        return list(Answer.objects.filter(quiz_answer__user_profile__user__username__startswith=prefix)
+                    .order_by('id').values_list('quiz_answer__user_profile__user__username', 'question__text',
+                                                'answer', 'score'))
+
+    def test_datasets_are_deterministic(self):
+        first = self.generate('one')
+        second = self.generate('two')
+
+        self.assertTrue(first)
+        self.assertEqual([row[1:] for row in first], [row[1:] for row in second])
+        self.assertEqual(recompute_quiz_answer_totals(commit=False), [])
+
+        delete_dataset('one')
+        self.assertFalse(User.objects.filter(username__startswith='one-').exists())
+        self.assertEqual(len(self.generate('two-again')), len(second))
+
+    def test_delete_dataset_leaves_other_accounts_and_cached_tokens(self):
+        token_cache.clear()
+        generate_dataset('one', classes=1, students=2, quizzes=1, questions=2)
+        admin = create_user_profile('one-c0-admin')
+        ClassRoom.objects.create(class_name='one-c0-extra', teacher=admin)
+        token = Token.objects.get(user__username='one-c0-s-00000')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token %s' % token.key)
+        self.assertEqual(client.get('/api/my/grades/').status_code, 200)
+        self.assertIsNotNone(token_cache.get(token.key))
+
+        delete_dataset('one')
+
+        self.assertIsNone(token_cache.get(token.key))
+        self.assertEqual(list(User.objects.filter(username__startswith='one-').values_list('username', flat=True)),
+                         ['one-c0-admin'])
+        self.assertTrue(ClassRoom.objects.filter(class_name='one-c0-extra').exists())
+
+    def test_exam_fixture_is_removed_on_exit(self):
+        cache.clear()
+        other = create_user_profile('bench-other')
+
+        with exam_fixture('bench', students=2, questions=3) as fixture:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token %s' % fixture.tokens[fixture.students[0].id])
+            response = client.get('/api/quiz/%s/questions/' % fixture.quiz.id)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), 3)
+
+        self.assertFalse(Quiz.objects.filter(pk=fixture.quiz.pk).exists())
+        self.assertEqual(list(User.objects.filter(username__startswith='bench-').values_list('pk', flat=True)),
+                         [other.user_id])
+
+    def test_benchmark_writes_baseline(self):
+        generate_dataset('synthetic', classes=1, students=3, quizzes=1, questions=2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            call_command('benchmark_api', requests=3, warmup=1, output=baseline, stdout=StringIO())
+            with open(baseline) as output:
+                routes = json.load(output)['routes']
+            call_command('benchmark_api', requests=3, warmup=1, route=['class'], compare=baseline,
+                         tolerance=100, stdout=StringIO())
+
+        self.assertEqual(set(routes), {'questions', 'start', 'submit', 'takers', 'class'})
+        self.assertTrue(all(result['ok'] == 3 and result['queries_per_request'] for result in routes.values()))
+
+    def test_failing_routes_are_regressions(self):
+        passing = {'ok': 3, 'errors': 0, 'p95_ms': 1.0, 'max_queries': 2}
+        failing = {'ok': 0, 'errors': 3, 'p95_ms': None, 'max_queries': None}
+
+        regressions = BenchmarkCommand.compare({'routes': {'class': passing}}, {'routes': {'class': failing}}, 0.25)
+        self.assertEqual(regressions, ['class: 3 errors, baseline 0'])
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.teacher = create_user_profile('teacher')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher.user)
+
+    def test_regex_routes_are_escaped(self):
+        self.client.get('/api/swagger.json')
+
+        lines = [line for line in registry.render().splitlines() if 'swagger' in line]
+        self.assertTrue(lines)
+        self.assertTrue(all('route="api/swagger(?P<format>\\\\.json|\\\\.yaml)$"' in line for line in lines))
+
+    def test_requests_are_recorded_per_route(self):
+        for _ in range(2):
+            self.client.get('/api/class/%s/' % self.class_room.id)
+        self.client.get('/api/class/0/')
+
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('http_requests_total{route="api/class/<int:class_id>/",method="GET",status="200"} 2', metrics)
+        self.assertIn('http_requests_total{route="api/class/<int:class_id>/",method="GET",status="404"} 1', metrics)
+        self.assertIn('db_queries_per_request_count{route="api/class/<int:class_id>/"} 3', metrics)
+        serializer_time = [line for line in metrics.splitlines()
+                           if line.startswith('serializer_duration_seconds_total{route="api/class/<int:class_id>/"}')]
+        self.assertGreater(float(serializer_time[0].split()[-1]), 0)
+
+        # nobody by default, not even local requests coming through a reverse proxy
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0.000001)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('core.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/class/%s/' % self.class_room.id)
+
+        self.assertIn('GET api/class/<int:class_id>/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class ProfilerTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.teacher = create_user_profile('teacher')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.admin = create_user_profile('admin', is_superuser=True)
+        self.client = APIClient()
+
+    def test_profiled_requests_are_saved_per_route(self):
+        with self.settings(PROFILER_DIR=self.directory.name, PROFILER_SECRET='secret', PROFILER_INTERVAL=0.0001):
+            self.client.force_authenticate(self.teacher.user)
+            for _ in range(5):
+                self.client.get('/api/class/%s/' % self.class_room.id, HTTP_X_PROFILE='secret')
+            self.client.get('/api/class/list/', HTTP_X_PROFILE='wrong')
+
+            self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+
+            self.client.force_authenticate(self.admin.user)
+            profiles = self.client.get('/api/profiles/').data['profiles']
+            self.assertEqual([profile['name'] for profile in profiles], ['api_class_int_class_id'])
+
+            response = self.client.get('/api/profiles/api_class_int_class_id/')
+            stacks = read_profile(b''.join(response.streaming_content).decode().splitlines())
+            self.assertEqual(sum(stacks.values()), profiles[0]['samples'])
+            self.assertTrue(all('core/profiling.py:__call__' in stack for stack in stacks))
+
+            self.assertEqual(self.client.delete('/api/profiles/api_class_int_class_id/').status_code, 204)
+            self.assertEqual(self.client.get('/api/profiles/..%2Fsecret/').status_code, 404)
+
+
+@skipUnless(orjson, "orjson is not installed")
+class RenderersTest(TestCase):
+    data = {
+        'at': datetime(2020, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        'day': date(2020, 5, 1),
+        'score': Decimal('7.25'),
+        'label': gettext_lazy('quiz'),
+        'text': 'caf\u00e9 \u2028',
+        'counts': {1: [1, 2.5, 1e15, True]},
+    }
+
+    def test_orjson_renders_like_rest_framework(self):
+        expected = renderers.JSONRenderer().render(self.data)
+        with mock.patch.object(renderers.JSONRenderer, 'render') as standard_render:
+            self.assertEqual(JSONRenderer().render(self.data), expected)
+        standard_render.assert_not_called()
+        self.assertIn(b'"2020-05-01T12:30:15.123456Z"', expected)
+
+        with self.settings(ORJSON_ENABLED=False):
+            self.assertEqual(JSONRenderer().render(self.data), expected)
+
+    def test_floats_orjson_writes_differently(self):
+        for value in (1e-05, 1e16, -2.5e-07, Decimal('0.00001'), None, [None]):
+            data = {'id': 1, 'value': value}
+            self.assertEqual(json.loads(JSONRenderer().render(data)), json.loads(renderers.JSONRenderer().render(data)))
+
+        for value in (float('nan'), float('inf'), [{'mean': float('-inf')}], Decimal('NaN')):
+            with self.assertRaises(ValueError):
+                JSONRenderer().render({'mean': value})
+
+    def test_only_float_fields_of_serializers_are_checked(self):
+        teacher = create_user_profile('teacher')
+        class_room = ClassRoom.objects.create(class_name='class', teacher=teacher)
+        quizzes = QuizSerializer(instance=[create_quiz(class_room)], many=True).data
+        with mock.patch('core.renderers.math.isfinite') as isfinite:
+            self.assertEqual(JSONRenderer().render({'previous': None, 'results': quizzes, 'mean': 1.5}),
+                             renderers.JSONRenderer().render({'previous': None, 'results': quizzes, 'mean': 1.5}))
+        isfinite.assert_called_once_with(1.5)
+
+    def test_parse(self):
+        content = b'{"answer": "caf\xc3\xa9", "question": 1}'
+        self.assertEqual(JSONParser().parse(BytesIO(content)), {'answer': 'caf\u00e9', 'question': 1})
+        with self.assertRaises(ParseError):
+            JSONParser().parse(BytesIO(b'{"answer": NaN}'))
+
+        response = APIClient().post('/api/api-token-auth/', b'{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.data['detail'])
+
+
+class ConcurrentSubmitTest(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.class_room.students.add(self.student)
+        self.quiz = create_quiz(self.class_room)
+        self.question = Question.objects.create(quiz=self.quiz, text='question', credit=2)
+
+    def run_concurrently(self, request):
+        barrier = threading.Barrier(self.threads)
+        responses = []
+
+        def worker(index):
+            client = APIClient()
+            client.force_authenticate(self.student.user)
+            barrier.wait()
+            try:
+                for attempt in range(50):
+                    try:
+                        responses.append(request(client, index))
+                        break
+                    except OperationalError:
+                        # the sqlite test database locks tables for concurrent writers, try again
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        return responses
+
+    def test_concurrent_starts_create_one_session(self):
+        url = '/api/quiz/%s/start/' % self.quiz.id
+        responses = self.run_concurrently(lambda client, index: client.post(url))
+
+        self.assertEqual(sorted(response.status_code for response in responses), [201] * self.threads)
+        self.assertEqual(QuizAnswer.objects.filter(user_profile=self.student, quiz=self.quiz).count(), 1)
+
+    def test_concurrent_answers_create_one_answer(self):
+        quiz_answer = QuizAnswer.objects.create(user_profile=self.student, quiz=self.quiz)
+        responses = self.run_concurrently(lambda client, index: client.post('/api/submit-answer/', {
+            'question': self.question.id, 'quiz_answer': quiz_answer.id, 'answer': str(index)}))
+
+        self.assertEqual(sorted(response.status_code for response in responses), [201] * self.threads)
+        self.assertEqual(Answer.objects.filter(question=self.question, quiz_answer=quiz_answer).count(), 1)
+
+        quiz_answer.refresh_from_db()
+        self.assertEqual(quiz_answer.answered_count, 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', "sqlite backend")
+class SqliteTransactionsTest(TransactionTestCase):
+
+    def test_only_write_transactions_take_the_write_lock(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                UserProfile.objects.count()
+            with write_atomic():
+                with transaction.atomic():
+                    create_user_profile('student')
+            with transaction.atomic():
+                UserProfile.objects.count()
+
+        begins = [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+        self.assertEqual(begins, ['BEGIN', 'BEGIN IMMEDIATE', 'BEGIN'])
+
+
+class AnswerBufferTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room)
+        self.question = Question.objects.create(quiz=self.quiz, text='question', credit=2)
+        self.quiz_answer = QuizAnswer.objects.create(user_profile=self.student, quiz=self.quiz)
+        self.journal_dir = tempfile.mkdtemp()
+
+    def test_write_behind_submit_is_flushed_in_batch(self):
+        client = APIClient()
+        client.force_authenticate(self.student.user)
+
+        with self.settings(ANSWER_WRITE_BEHIND=True, ANSWER_JOURNAL_DIR=self.journal_dir, ANSWER_FLUSH_INTERVAL=3600):
+            buffer = get_answer_buffer()
+            for text in ['a', 'ab', 'abc']:
+                response = client.post('/api/submit-answer/', {'question': self.question.id,
+                                                               'quiz_answer': self.quiz_answer.id, 'answer': text})
+                self.assertEqual(response.status_code, 202)
+
+            self.assertFalse(Answer.objects.exists())
+            self.assertEqual(buffer.flush(), 1)
+            buffer.close()
+
+        self.assertEqual(Answer.objects.get(question=self.question).answer, 'abc')
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_recover_journal_of_stopped_process(self):
+        with open(os.path.join(self.journal_dir, 'answers-1-1.jsonl'), 'w') as journal:
+            journal.write(json.dumps([self.quiz_answer.id, self.question.id, 'first']) + '\n')
+            journal.write(json.dumps([self.quiz_answer.id, self.question.id, 'last']) + '\n')
+            journal.write('[%s, %s, "cut' % (self.quiz_answer.id, self.question.id))
+
+        self.assertEqual(recover_journals(self.journal_dir), 1)
+        self.assertEqual(Answer.objects.get(question=self.question).answer, 'last')
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_recovery_skips_journals_removed_by_another_process(self):
+        path = os.path.join(self.journal_dir, 'answers-1-1.jsonl')
+        with open(path, 'w') as journal:
+            journal.write(json.dumps([self.quiz_answer.id, self.question.id, 'answer']) + '\n')
+
+        removed = os.path.join(self.journal_dir, 'answers-2-1.jsonl')
+        with mock.patch('core.answer_buffer.glob.glob', return_value=[removed, path]):
+            self.assertEqual(recover_journals(self.journal_dir), 1)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', "plans are checked with sqlite EXPLAIN QUERY PLAN")
+class HotQueryIndexTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.quiz = create_quiz(self.class_room, is_published=True)
+        self.question = Question.objects.create(quiz=self.quiz, text='question')
+        self.quiz_answer = QuizAnswer.objects.create(user_profile=self.student, quiz=self.quiz)
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertRegex(plan, r'SEARCH .*USING (COVERING )?INDEX')
+        self.assertNotRegex(plan, r'SCAN (TABLE )?\w+\s*$')
+
+    def test_hot_queries_use_indexes(self):
+        now = timezone.now()
+
+        self.assertUsesIndex(Answer.objects.filter(quiz_answer=self.quiz_answer, question=self.question))
+        self.assertUsesIndex(QuizAnswer.objects.filter(user_profile=self.student, quiz=self.quiz))
+        self.assertUsesIndex(self.class_room.quizzes.all().order_by('-id'))
+        self.assertUsesIndex(Quiz.objects.filter(is_published=True, start_datetime__lte=now, end_datetime__gte=now))
+        self.assertUsesIndex(User.objects.filter(username='student'))
+
+
+class ClassListingTest(TestCase):
+
+    def setUp(self):
+        self.teacher = create_user_profile('teacher')
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher.user)
+
+    def test_class_list_is_cursor_paginated_with_constant_queries(self):
+        students = [create_user_profile('student%s' % index) for index in range(5)]
+        for index in range(3):
+            ClassRoom.objects.create(class_name='class%s' % index, teacher=self.teacher).students.add(*students)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/class/list/', {'page_size': 2})
+
+        self.assertEqual([item['class_name'] for item in response.data['results']], ['class2', 'class1'])
+        self.assertEqual(response.data['results'][0]['students_count'], 5)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['class_name'] for item in response.data['results']], ['class0'])
+        self.assertIsNone(response.data['next'])
+
+    def test_students_are_a_paginated_sub_resource(self):
+        class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        class_room.students.add(*[create_user_profile('student%s' % index) for index in range(3)])
+
+        response = self.client.get('/api/class/%s/' % class_room.id)
+        self.assertNotIn('students', response.data)
+        self.assertEqual(response.data['students_count'], 3)
+
+        response = self.client.get('/api/class/%s/students/' % class_room.id, {'page_size': 2})
+        self.assertEqual([item['user']['username'] for item in response.data['results']], ['student0', 'student1'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_class_fields_and_expand(self):
+        class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        quizzes = [create_quiz(class_room, quiz_name='quiz%s' % index) for index in range(2)]
+
+        response = self.client.get('/api/class/%s/' % class_room.id, {'fields': 'class_name,teacher,quizzes'})
+        self.assertEqual(response.data, {'class_name': 'class', 'teacher': self.teacher.id,
+                                         'quizzes': [quizzes[1].id, quizzes[0].id]})
+
+        response = self.client.get('/api/class/%s/' % class_room.id, {'fields': 'quizzes', 'expand': 'quizzes'})
+        self.assertEqual([quiz['quiz_name'] for quiz in response.data['quizzes']], ['quiz1', 'quiz0'])
+
+
+class CachedTokenAuthenticationTest(TestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.student = create_user_profile('student')
+        self.token = Token.objects.create(user=self.student.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_token_user_and_profile_are_resolved_once(self):
+        class_room = ClassRoom.objects.create(class_name='class', teacher=create_user_profile('teacher'))
+        url = '/api/class/%s/register/' % class_room.id
+
+        # token with user and profile, class room, enrollment lookup and insert
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.post(url).status_code, 200)
+
+        # class room, enrollment lookup
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.post(url).status_code, 200)
+
+    def test_token_delete_and_user_change_invalidate_cache(self):
+        self.assertEqual(self.client.get('/api/class/list/').status_code, 200)
+
+        self.student.user.is_active = False
+        self.student.user.save()
+        self.assertEqual(self.client.get('/api/class/list/').status_code, 401)
+
+        self.student.user.is_active = True
+        self.student.user.save()
+        self.assertEqual(self.client.get('/api/class/list/').status_code, 200)
+
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/class/list/').status_code, 401)
+
+
+class AuthenticateViewTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.student = create_user_profile('student')
+        self.client = APIClient()
+
+    def login(self, username='student', password='password'):
+        return self.client.post('/api/api-token-auth/', {'username': username, 'password': password})
+
+    def test_repeat_login_reads_token_with_user(self):
+        token = self.login().data['token']
+
+        # user with profile and token
+        with self.assertNumQueries(1):
+            response = self.login()
+        self.assertEqual(response.data['token'], token)
+
+    def test_password_is_rehashed_for_the_active_profile(self):
+        with self.settings(PASSWORD_HASHER_PROFILE='fast'):
+            self.assertEqual(self.login().status_code, 200)
+            self.student.user.refresh_from_db()
+            self.assertTrue(self.student.user.password.startswith('pbkdf2_sha256$30000$'))
+
+        self.assertEqual(self.login().status_code, 200)
+        self.student.user.refresh_from_db()
+        self.assertTrue(self.student.user.password.startswith('pbkdf2_sha256$180000$'))
+
+    def test_failed_login_attempts_are_throttled_per_username(self):
+        for attempt in range(12):
+            self.assertEqual(self.login().status_code, 200)
+
+        for attempt in range(10):
+            self.assertEqual(self.login(password='wrong').status_code, 400)
+
+        self.assertEqual(self.login().status_code, 429)
+        self.assertEqual(self.login(username='other').status_code, 400)
+
+    def test_credentials_must_be_strings(self):
+        for data in ({'username': ['student'], 'password': 'password'}, {'username': 'student', 'password': 1}, []):
+            response = self.client.post('/api/api-token-auth/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ASYNC_EXAM_ENDPOINTS=True)
+class AsyncExamEndpointsTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.token = Token.objects.create(user=self.student.user)
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.class_room.students.add(self.student)
+        self.quiz = create_quiz(self.class_room)
+        self.question = Question.objects.create(quiz=self.quiz, text='question', credit=2)
+        self.application = ExamEndpointsRouter(ASGIHandler())
+
+    def request(self, method, path, data=None, token=None, **headers):
+        body = json.dumps(data).encode() if data is not None else b''
+        headers['authorization'] = 'Token %s' % (token or self.token.key)
+        headers['content-type'] = 'application/json'
+        path, _, query_string = path.partition('?')
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode(), 'root_path': '',
+                 'headers': [(name.encode(), value.encode()) for name, value in headers.items()]}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(self.application)(scope, receive, send)
+
+        response_headers = {name.lower(): value for name, value in messages[0]['headers']}
+        content = b''.join(message.get('body', b'') for message in messages[1:])
+        if not response_headers.get(b'content-type', b'').startswith(b'application/json'):
+            return messages[0]['status'], content, response_headers
+        return messages[0]['status'], json.loads(content) if content else None, response_headers
+
+    def test_exam_flow(self):
+        status, questions, headers = self.request('GET', '/api/quiz/%s/questions/' % self.quiz.id)
+        self.assertEqual(status, 200)
+        self.assertEqual(questions[0]['text'], 'question')
+
+        status, body, headers = self.request('GET', '/api/quiz/%s/questions/' % self.quiz.id,
+                                             **{'if-none-match': headers[b'etag'].decode()})
+        self.assertEqual(status, 304)
+
+        status, session, headers = self.request('POST', '/api/quiz/%s/start/' % self.quiz.id, {})
+        self.assertEqual(status, 201)
+
+        status, answer, headers = self.request('POST', '/api/submit-answer/', {
+            'question': self.question.id, 'quiz_answer': session['id'], 'answer': 'answer'})
+        self.assertEqual(status, 201)
+        self.assertEqual(Answer.objects.get(pk=answer['id']).answer, 'answer')
+        self.assertIn('http_requests_total{route="api/submit-answer/",method="POST",status="201"}',
+                      registry.render())
+
+    def test_sparse_fields(self):
+        status, session, headers = self.request('POST', '/api/quiz/%s/start/?fields=id' % self.quiz.id, {})
+        self.assertEqual(status, 201)
+        self.assertEqual(list(session), ['id'])
+
+    def test_requests_failing_to_send_are_recorded(self):
+        registry.clear()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/quiz/%s/questions/' % self.quiz.id,
+                 'query_string': b'', 'root_path': '',
+                 'headers': [(b'authorization', ('Token %s' % self.token.key).encode())]}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            raise OSError('client disconnected')
+
+        with self.assertRaises(OSError):
+            async_to_sync(self.application)(scope, receive, send)
+        self.assertIn('http_requests_total{route="api/quiz/<int:quiz_id>/questions/",method="GET",status="200"} 1',
+                      registry.render())
+
+    def test_streaming_responses_are_read_off_the_event_loop(self):
+        teacher_token = Token.objects.create(user=self.teacher.user)
+        QuizAnswer.objects.create(user_profile=self.student, quiz=self.quiz)
+        Answer.objects.create(question=self.question, quiz_answer=self.quiz.answers.get(), answer='answer')
+
+        status, content, headers = self.request('GET', '/api/quiz/%s/export/' % self.quiz.id, token=teacher_token.key)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(content.decode().splitlines()), 2)
+
+    def test_errors_match_the_sync_endpoints(self):
+        status, body, headers = self.request('GET', '/api/quiz/%s/questions/' % self.quiz.id, token='invalid')
+        self.assertEqual(status, 401)
+        self.assertEqual(headers[b'www-authenticate'], b'Token')
+
+        other = create_user_profile('other')
+        status, body, headers = self.request('POST', '/api/quiz/%s/start/' % self.quiz.id, {},
+                                             token=Token.objects.create(user=other.user).key)
+        self.assertEqual(status, 403)
+
+        status, body, headers = self.request('POST', '/api/submit-answer/', {'question': self.question.id})
+        self.assertEqual(status, 400)
+        self.assertIn('quiz_answer', body)
+
+        def fail(request, quiz_id):
+            raise ValueError('unexpected')
+
+        with mock.patch.dict(ROUTES, {'quiz-questions': ('GET', fail)}), self.assertLogs('django.request', 'ERROR'):
+            status, body, headers = self.request('GET', '/api/quiz/%s/questions/' % self.quiz.id)
+        self.assertEqual(status, 500)
+        self.assertEqual(body, {'detail': 'A server error occurred.'})
+
+    def test_responses_have_the_middleware_headers(self):
+        status, questions, headers = self.request('GET', '/api/quiz/%s/questions/' % self.quiz.id,
+                                                  origin='https://exam.example.com')
+        self.assertEqual(headers[b'access-control-allow-origin'], b'*')
+        self.assertEqual(headers[b'x-frame-options'], b'DENY')
+        self.assertEqual(headers[b'x-content-type-options'], b'nosniff')
+
+        # preflights are answered by django
+        status, body, headers = self.request('OPTIONS', '/api/submit-answer/', origin='https://exam.example.com',
+                                             **{'access-control-request-method': 'POST'})
+        self.assertEqual(status, 200)
+        self.assertIn(b'POST', headers[b'access-control-allow-methods'])
+
+
+class QuizEventsTest(TransactionTestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.teacher = create_user_profile('teacher')
+        self.student = create_user_profile('student')
+        self.token = Token.objects.create(user=self.student.user)
+        self.class_room = ClassRoom.objects.create(class_name='class', teacher=self.teacher)
+        self.class_room.students.add(self.student)
+        self.quiz = create_quiz(self.class_room, is_published=False)
+        self.application = ExamEndpointsRouter(ASGIHandler())
+
+    @staticmethod
+    def ticket(user_profile):
+        client = APIClient()
+        client.force_authenticate(user_profile.user)
+        return b'ticket=' + client.post('/api/events/ticket/').data['ticket'].encode()
+
+    def stream(self, path, query_string=b'', change=None, events=1):
+        """
+        open an event stream, run change once it is open and return the response after events more events
+        """
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string, 'root_path': '',
+                 'headers': []}
+        messages = []
+
+        async def run():
+            received = asyncio.Queue()
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                await received.put(message)
+
+            streaming = asyncio.ensure_future(self.application(scope, receive, send))
+            start = await received.get()
+            if start['status'] == 200:
+                await received.get()
+                if change is not None:
+                    await run_db(change)
+                for _ in range(events):
+                    await asyncio.wait_for(received.get(), 5)
+                disconnect.set()
+            await asyncio.wait_for(streaming, 5)
+
+        async_to_sync(run)()
+        return messages[0]['status'], [message['body'] for message in messages[1:] if message.get('body')]
+
+    def test_quiz_changes_are_pushed_to_the_stream(self):
+        def publish_quiz():
+            self.quiz.is_published = True
+            self.quiz.save()
+
+        status, bodies = self.stream('/api/quiz/%s/events/' % self.quiz.id, self.ticket(self.student),
+                                     change=publish_quiz, events=2)
+
+        self.assertEqual(status, 200)
+        self.assertTrue(bodies[0].startswith(b'event: quiz.state\n'))
+        self.assertTrue(bodies[1].startswith(b'event: quiz.updated\n'))
+        self.assertTrue(bodies[2].startswith(b'event: quiz.published\n'))
+        self.assertEqual(json.loads(bodies[2].split(b'data: ')[1])['quiz']['is_published'], True)
+
+    def test_class_streams_follow_every_quiz(self):
+        other = create_quiz(self.class_room, quiz_name='other')
+
+        def start_soon():
+            for quiz, delay in ((self.quiz, 0.3), (other, 0.5)):
+                quiz.start_datetime = timezone.now() + timedelta(seconds=delay)
+                quiz.save()
+
+        status, bodies = self.stream('/api/class/%s/events/' % self.class_room.id, self.ticket(self.student),
+                                     change=start_soon, events=4)
+
+        self.assertEqual(status, 200)
+        started = [json.loads(body.split(b'data: ')[1]) for body in bodies if body.startswith(b'event: quiz.started')]
+        self.assertEqual([event['quiz_id'] for event in started], [self.quiz.id, other.id])
+
+    def test_stream_needs_class_membership(self):
+        status, bodies = self.stream('/api/class/%s/events/' % self.class_room.id)
+        self.assertEqual(status, 401)
+
+        other = create_user_profile('other')
+        status, bodies = self.stream('/api/class/%s/events/' % self.class_room.id, self.ticket(other))
+        self.assertEqual(status, 403)
+
+    def test_tickets_are_used_once(self):
+        path = '/api/class/%s/events/' % self.class_room.id
+        ticket = self.ticket(self.student)
+        self.assertEqual(self.stream(path, ticket, events=0)[0], 200)
+        self.assertEqual(self.stream(path, ticket)[0], 401)
+
+        # api tokens are not accepted in the url
+        self.assertEqual(self.stream(path, b'token=' + self.token.key.encode())[0], 401)
+        with self.settings(EVENT_TICKET_MAX_AGE=-1):
+            self.assertEqual(self.stream(path, self.ticket(self.student))[0], 401)
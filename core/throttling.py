@@ -0,0 +1,45 @@
+import hashlib
+from collections.abc import Mapping
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class LoginUsernameRateThrottle(SimpleRateThrottle):
+    """
+    limits failed login attempts per username
+
+    only failures recorded by the login view count, so knowing a username is not enough
+    to lock its user out
+    """
+    scope = 'login_username'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username') if isinstance(request.data, Mapping) else None
+        if not isinstance(username, str) or not username:
+            return None
+
+        ident = hashlib.sha1(username.lower().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def throttle_success(self):
+        return True
+
+    def record_failure(self, request, view):
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return
+
+        now = self.timer()
+        history = [at for at in self.cache.get(key, []) if at > now - self.duration]
+        history.insert(0, now)
+        self.cache.set(key, history, self.duration)
+
+
+class LoginIPRateThrottle(SimpleRateThrottle):
+    """
+    limits login attempts per client ip, keep it high enough for a class behind one NAT
+    """
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
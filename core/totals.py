@@ -0,0 +1,87 @@
+from django.db.models import F, Sum, Count, IntegerField, Value
+from django.db.models.functions import Coalesce
+
+from core.gradebook import shift_gradebook_score, shift_gradebook_credit
+from core.models import Quiz, QuizAnswer, GradebookEntry
+
+
+def add_to_quiz_totals(quiz_id, credit=0, questions=0):
+    """
+    shift stored quiz totals by the given deltas in a single UPDATE,
+    the questions version is bumped on every call since a question changed
+    """
+    Quiz.objects.filter(pk=quiz_id).update(total_credit=F('total_credit') + credit,
+                                           total_questions=F('total_questions') + questions,
+                                           questions_version=F('questions_version') + 1)
+    shift_gradebook_credit(quiz_id, credit)
+
+
+def add_to_quiz_answer_totals(quiz_answer_id, score=0, answered=0):
+    """
+    shift stored quiz answer totals by the given deltas in a single UPDATE
+    """
+    if not score and not answered:
+        return
+
+    QuizAnswer.objects.filter(pk=quiz_answer_id).update(total_score=F('total_score') + score,
+                                                        answered_count=F('answered_count') + answered)
+    shift_gradebook_score(quiz_answer_id, score)
+
+
+def annotate_quiz_totals(queryset):
+    return queryset.annotate(
+        computed_credit=Coalesce(Sum('questions__credit'), Value(0), output_field=IntegerField()),
+        computed_questions=Count('questions'),
+    )
+
+
+def annotate_quiz_answer_totals(queryset):
+    return queryset.annotate(
+        computed_score=Coalesce(Sum('answers__score'), Value(0), output_field=IntegerField()),
+        computed_answered=Count('answers'),
+    )
+
+
+def recompute_quiz_totals(queryset=None, commit=True):
+    """
+    recompute stored quiz totals from the questions table,
+    returns the list of quizzes whose stored totals were out of date
+    """
+    queryset = Quiz.objects.all() if queryset is None else queryset
+    stale = []
+
+    for quiz in annotate_quiz_totals(queryset).iterator():
+        if quiz.total_credit != quiz.computed_credit or quiz.total_questions != quiz.computed_questions:
+            quiz.total_credit = quiz.computed_credit
+            quiz.total_questions = quiz.computed_questions
+            stale.append(quiz)
+
+    if commit and stale:
+        Quiz.objects.bulk_update(stale, ['total_credit', 'total_questions'], batch_size=500)
+        for quiz in stale:
+            GradebookEntry.objects.filter(quiz_id=quiz.pk).update(credit=quiz.total_credit)
+
+    return stale
+
+
+def recompute_quiz_answer_totals(queryset=None, commit=True):
+    """
+    recompute stored quiz answer totals from the answers table,
+    returns the list of quiz answers whose stored totals were out of date
+    """
+    queryset = QuizAnswer.objects.all() if queryset is None else queryset
+    stale = []
+
+    for quiz_answer in annotate_quiz_answer_totals(queryset).iterator():
+        if quiz_answer.total_score != quiz_answer.computed_score or \
+                quiz_answer.answered_count != quiz_answer.computed_answered:
+            quiz_answer.total_score = quiz_answer.computed_score
+            quiz_answer.answered_count = quiz_answer.computed_answered
+            stale.append(quiz_answer)
+
+    if commit and stale:
+        QuizAnswer.objects.bulk_update(stale, ['total_score', 'answered_count'], batch_size=500)
+        for quiz_answer in stale:
+            GradebookEntry.objects.filter(quiz_answer_id=quiz_answer.pk).update(score=quiz_answer.total_score)
+
+    return stale
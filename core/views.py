@@ -1,16 +1,36 @@
+import os
+from collections.abc import Mapping
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Prefetch, Count
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils.http import parse_etags
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import PermissionDenied, ValidationError, NotFound
 from rest_framework.generics import CreateAPIView, RetrieveAPIView, UpdateAPIView, \
     RetrieveUpdateAPIView, ListAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from core.models import ClassRoom, UserProfile, Quiz, Question, QuizAnswer, Answer
-from core.permissions import IsTeacherOrSuperuser, CanSeeQuizQuestions, IsEnrolledInClass, IsQuizActive, IsSelfOrCanSee
+from core.analytics import quiz_analytics, class_analytics, histogram
+from core.answer_buffer import get_answer_buffer
+from core.caching import quiz_questions_etag, quiz_questions_payload
+from core.context import request_objects
+from core.events import issue_ticket
+from core.export import CSVExportRenderer, NDJSONExportRenderer, export_rows, quiz_answers, class_answers
+from core.grading import grade_quiz
+from core.models import ClassRoom, UserProfile, Quiz, Question, QuizAnswer, Answer, GradebookEntry
+from core.pagination import StandardPagination, NewestFirstCursorPagination, OldestFirstCursorPagination
+from core.permissions import IsTeacherOrSuperuser, CanSeeQuizQuestions, IsEnrolledInClass, IsQuizActive, \
+    IsSelfOrCanSee, IsSuperuser
+from core.profiling import list_profiles, profile_name, profile_path
 from core.serializers import UserProfileSerializer, ClassRoomSerializer, ClassRoomRetrieveSerializer, \
     QuizSerializer, QuestionSerializer, QuizAnswerSerializer, AnswerSerializer, QuizAnswerDetailedSerializer, \
-    ScoreAnswerSerializer, PrivateUserProfileSerializer, Authenticate, QuizPublishSerializer
-from core.utils import get_object
+    ScoreAnswerSerializer, PrivateUserProfileSerializer, Authenticate, QuizPublishSerializer, BulkAnswerSerializer, \
+    BulkScoreSerializer, GradebookEntrySerializer, RosterSerializer, PublicQuestionSerializer
+from core.throttling import LoginUsernameRateThrottle, LoginIPRateThrottle
 
 
 class UserProfileCreateView(CreateAPIView):
@@ -23,21 +43,30 @@ class UserProfileCreateView(CreateAPIView):
 class AuthenticateView(CreateAPIView):
     """
     Authenticate user
+
+    attempts are rate limited per client ip and failed attempts per username,
+    the user, profile and token are loaded in one query
     """
     serializer_class = Authenticate
+    throttle_classes = [LoginUsernameRateThrottle, LoginIPRateThrottle]
 
     def create(self, request, *args, **kwargs):
+        data = request.data if isinstance(request.data, Mapping) else {}
+        username, password = data.get('username'), data.get('password')
+        if not isinstance(username, str) or not isinstance(password, str):
+            return Response({'detail': _("Username and password must be strings")}, status=400)
+
         try:
-            username = request.data.get('username')
-            user = User.objects.get(username=username)
+            user = User.objects.select_related('user_profile', 'auth_token').get(username=username)
 
-            if user.check_password(request.data.get('password')):
+            if user.check_password(password):
                 up_serializer = PrivateUserProfileSerializer(instance=user.user_profile)
                 return Response(up_serializer.data)
 
             raise User.DoesNotExist
 
         except User.DoesNotExist:
+            LoginUsernameRateThrottle().record_failure(request, self)
             return Response({'detail': 'Invalid Credentials'}, status=400)
 
 
@@ -57,7 +86,7 @@ class QuizCreateView(CreateAPIView):
     serializer_class = QuizSerializer
 
     def perform_create(self, serializer):
-        _class = get_object(ClassRoom, pk=self.kwargs.get('class_id'))
+        _class = request_objects(self.request).class_room(self.kwargs.get('class_id'))
         serializer.save(class_room=_class)
 
 
@@ -90,13 +119,28 @@ class QuizPublishView(RetrieveUpdateDestroyAPIView):
 class QuizTakersList(ListAPIView):
     """
     List of quiz takers of the given quiz
+
+    scores and quiz totals are read from stored columns, so a page costs
+    a fixed number of queries regardless of the number of takers
+
+    ?fields=id,score&expand=user_profile selects the fields, see SparseFieldsMixin
     """
     permission_classes = [IsAuthenticated, IsTeacherOrSuperuser]
     serializer_class = QuizAnswerSerializer
+    pagination_class = StandardPagination
 
     def get_queryset(self):
-        the_quiz = get_object(Quiz, pk=self.kwargs.get('quiz_id'))
-        return the_quiz.answers.all()
+        the_quiz = request_objects(self.request).quiz(self.kwargs.get('quiz_id'))
+        queryset = the_quiz.answers.all().order_by('id')
+
+        # only the relations kept by ?fields= and ?expand= are loaded
+        if QuizAnswerSerializer.expanded(self.request, 'user_profile'):
+            queryset = queryset.select_related('user_profile__user')
+        if QuizAnswerSerializer.expanded(self.request, 'quiz'):
+            queryset = queryset.select_related('quiz')
+        if QuizAnswerSerializer.included(self.request, 'answers'):
+            queryset = queryset.prefetch_related(Prefetch('answers', queryset=Answer.objects.order_by('id')))
+        return queryset
 
 
 class QuizAnswerDetailedView(RetrieveAPIView):
@@ -119,12 +163,133 @@ class SetScoreView(RetrieveUpdateAPIView):
     """
     permission_classes = [IsAuthenticated, ]
     serializer_class = ScoreAnswerSerializer
-    queryset = Answer.objects.all()
+    queryset = Answer.objects.select_related('question__quiz')
 
     lookup_field = 'pk'
     lookup_url_kwarg = 'answer_id'
 
 
+class MyGrades(ListAPIView):
+    """
+    scores of the current user in every quiz of every class, by class and quiz
+
+    served from the materialized gradebook in one indexed query
+    """
+    permission_classes = [IsAuthenticated, ]
+    serializer_class = GradebookEntrySerializer
+
+    def get_queryset(self):
+        return GradebookEntry.objects.filter(user_profile=self.request.user.user_profile) \
+            .select_related('class_room', 'quiz').order_by('class_room_id', 'quiz_id')
+
+
+class QuizAnalytics(APIView):
+    """
+    score statistics of a quiz, only class teacher and superusers
+
+    takers, mean, standard deviation, min, max, median and percentiles of the session scores,
+    the score distribution and the difficulty of every question,
+    ?bins=<n> adds a histogram of n equal width score bins
+    """
+    permission_classes = [IsAuthenticated, ]
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        quiz = request_objects(request).quiz(kwargs.get('quiz_id'))
+
+        if not IsTeacherOrSuperuser.is_teacher_or_superuser(quiz.class_room_id, request):
+            raise PermissionDenied(IsTeacherOrSuperuser.message)
+
+        analytics = quiz_analytics(quiz)
+
+        bins = request.query_params.get('bins')
+        if bins:
+            if not bins.isdigit() or not 0 < int(bins) <= 100:
+                raise ValidationError({'bins': [_("Ensure this value is between 1 and 100.")]})
+            analytics = dict(analytics, histogram=histogram(analytics['distribution'], int(bins), quiz.credit))
+
+        return Response(analytics)
+
+
+class ClassAnalytics(APIView):
+    """
+    per quiz takers and score summary of a class, only class teacher and superusers
+    """
+    permission_classes = [IsAuthenticated, ]
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        class_id = request_objects(request).class_room(kwargs.get('class_id')).id
+
+        if not IsTeacherOrSuperuser.is_teacher_or_superuser(class_id, request):
+            raise PermissionDenied(IsTeacherOrSuperuser.message)
+
+        return Response({'class_room': class_id, 'quizzes': class_analytics(class_id)})
+
+
+class ExportResults(APIView):
+    """
+    stream every answer and score of a quiz or class, only class teacher and superusers
+
+    one row per answer as CSV (default, ?format=csv) or NDJSON (?format=ndjson)
+    """
+    permission_classes = [IsAuthenticated, ]
+    renderer_classes = [CSVExportRenderer, NDJSONExportRenderer]
+
+    def get(self, request, *args, **kwargs):
+        if 'quiz_id' in kwargs:
+            quiz = request_objects(request).quiz(kwargs.get('quiz_id'))
+            class_id, answers, name = quiz.class_room_id, quiz_answers(quiz.id), 'quiz-%s' % quiz.id
+        else:
+            class_id = request_objects(request).class_room(kwargs.get('class_id')).id
+            answers, name = class_answers(class_id), 'class-%s' % class_id
+
+        if not IsTeacherOrSuperuser.is_teacher_or_superuser(class_id, request):
+            raise PermissionDenied(IsTeacherOrSuperuser.message)
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(renderer.lines(export_rows(answers)),
+                                         content_type='%s; charset=utf-8' % renderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="%s-results.%s"' % (name, renderer.format)
+        return response
+
+
+class SetScores(APIView):
+    """
+    set scores of many answers of a quiz at once, only class teacher and superusers
+
+    body: {"scores": [{"answer": <id>, "score": <score>}, ...]}
+    returns the result of each score, answers of other quizzes and scores above
+    the question credit are reported as errors
+    """
+    permission_classes = [IsAuthenticated, IsTeacherOrSuperuser]
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        quiz = request_objects(request).quiz(kwargs.get('quiz_id'))
+
+        serializer = BulkScoreSerializer(data=request.data, context={'request': request, 'quiz': quiz})
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        return Response({'results': results}, status=200)
+
+
+class GradeQuiz(APIView):
+    """
+    auto grade the ungraded answers of questions with a grading, only class teacher and superusers
+
+    grading runs in the background, the number of queued answers is returned
+    """
+    permission_classes = [IsAuthenticated, IsTeacherOrSuperuser]
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        quiz = request_objects(request).quiz(kwargs.get('quiz_id'))
+
+        return Response({'quiz': quiz.id, 'queued': grade_quiz(quiz.id)}, status=202)
+
+
 class AddQuizQuestion(CreateAPIView):
     """
     Add question to quiz, only class teacher and superusers
@@ -134,13 +299,14 @@ class AddQuizQuestion(CreateAPIView):
     serializer_class = QuestionSerializer
 
     def perform_create(self, serializer):
-        quiz = get_object(Quiz, pk=self.kwargs.get('quiz_id'))
+        quiz = request_objects(self.request).quiz(self.kwargs.get('quiz_id'))
         serializer.save(quiz=quiz)
 
 
 class RUDQuestion(RetrieveUpdateDestroyAPIView):
     """
-    Retrieve update delete quiz question
+    Retrieve update delete quiz question, only the class teacher and superusers see the
+    grading and answer key
     """
 
     permission_classes = [IsAuthenticated, IsTeacherOrSuperuser]
@@ -150,20 +316,42 @@ class RUDQuestion(RetrieveUpdateDestroyAPIView):
     lookup_field = 'pk'
     lookup_url_kwarg = 'question_id'
 
+    def get_serializer_class(self):
+        # the schema generator of the swagger views has no question
+        if getattr(self, 'swagger_fake_view', False):
+            return QuestionSerializer
+
+        question = request_objects(self.request).question(self.kwargs.get('question_id'))
+        if not IsTeacherOrSuperuser.is_teacher_or_superuser(question.quiz.class_room_id, self.request):
+            return PublicQuestionSerializer
+        return QuestionSerializer
+
 
 class QuizQuestionsList(ListAPIView):
     """
     get quiz questions
     teachers and super users can always see questions
     otherwise only enrolled students after quiz started
+
+    the serialized list is cached per quiz questions version and served with an ETag,
+    clients sending a matching If-None-Match get 304
     """
     permission_classes = [IsAuthenticated, CanSeeQuizQuestions]
-    serializer_class = QuestionSerializer
+    serializer_class = PublicQuestionSerializer
 
     def get_queryset(self):
-        quiz = get_object(Quiz, pk=self.kwargs.get('quiz_id'))
+        quiz = request_objects(self.request).quiz(self.kwargs.get('quiz_id'))
         return quiz.questions.all()
 
+    def list(self, request, *args, **kwargs):
+        quiz = request_objects(request).quiz(self.kwargs.get('quiz_id'))
+        etag = quiz_questions_etag(quiz)
+
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return Response(status=304, headers={'ETag': etag})
+
+        return Response(quiz_questions_payload(quiz), headers={'ETag': etag})
+
 
 class StartQuiz(CreateAPIView):
     """
@@ -173,7 +361,7 @@ class StartQuiz(CreateAPIView):
     serializer_class = QuizAnswerSerializer
 
     def perform_create(self, serializer):
-        quiz = get_object(Quiz, pk=self.kwargs.get('quiz_id'))
+        quiz = request_objects(self.request).quiz(self.kwargs.get('quiz_id'))
         serializer.save(quiz=quiz)
 
 
@@ -183,12 +371,55 @@ class CreateAnswer(CreateAPIView):
 
     submitting answer to the same question will automatically override the old answer
 
+    with ANSWER_WRITE_BEHIND the validated answer is journaled and buffered,
+    written to the database in the next batch, and 202 is returned
+
     **validations will happen in the serializer**
     """
 
     permission_classes = [IsAuthenticated, ]
     serializer_class = AnswerSerializer
 
+    def create(self, request, *args, **kwargs):
+        if not settings.ANSWER_WRITE_BEHIND:
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        quiz_answer = serializer.validated_data.get('quiz_answer')
+        question = serializer.validated_data.get('question')
+        answer = serializer.validated_data.get('answer')
+        quiz = request_objects(request).quiz(quiz_answer.quiz_id)
+
+        get_answer_buffer().add(quiz_answer.id, question.id, answer, deadline=quiz.end_datetime.timestamp())
+
+        return Response({'question': question.id, 'quiz_answer': quiz_answer.id, 'answer': answer}, status=202)
+
+
+class SubmitAnswers(APIView):
+    """
+    submit many answers of a quiz answer session at once,
+    answers to the same question override the old ones
+
+    body: {"answers": [{"question": <id>, "answer": <text>}, ...]}
+    returns the result of each answer, answers to questions outside the quiz are reported as errors
+
+    **validations will happen in the serializer**
+    """
+    permission_classes = [IsAuthenticated, ]
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        quiz_answer = request_objects(request).quiz_answer(kwargs.get('quiz_answer_id'))
+
+        serializer = BulkAnswerSerializer(data=request.data, context={'request': request,
+                                                                      'quiz_answer': quiz_answer})
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        return Response({'results': results}, status=200)
+
 
 class RegisterQuitClass(APIView):
     """
@@ -200,7 +431,7 @@ class RegisterQuitClass(APIView):
     @staticmethod
     def post(request, *args, **kwargs):
         user_profile = request.user.user_profile
-        _class = get_object(ClassRoom, pk=kwargs.get('class_id'))
+        _class = request_objects(request).class_room(kwargs.get('class_id'))
         _class.students.add(user_profile)
 
         return Response({}, status=200)
@@ -208,7 +439,7 @@ class RegisterQuitClass(APIView):
     @staticmethod
     def delete(request, *args, **kwargs):
         user_profile = request.user.user_profile
-        _class = get_object(ClassRoom, pk=kwargs.get('class_id'))
+        _class = request_objects(request).class_room(kwargs.get('class_id'))
         _class.students.remove(user_profile)
 
         return Response({}, status=204)
@@ -228,7 +459,7 @@ class AddRemoveStudentClass(APIView):
         except UserProfile.DoesNotExist:
             return Response({'username': ["User name does not exist", ]}, status=404)
 
-        class_room = get_object(ClassRoom, pk=kwargs.get('class_id'))
+        class_room = request_objects(request).class_room(kwargs.get('class_id'))
 
         class_room.students.add(user_profile)
         return Response(UserProfileSerializer(instance=user_profile).data, status=200)
@@ -239,31 +470,74 @@ class AddRemoveStudentClass(APIView):
             user_profile = UserProfile.objects.get(user__username=kwargs.get('user_username'))
         except UserProfile.DoesNotExist:
             return Response({'username': ["User name does not exist", ]}, status=404)
-        class_room = get_object(ClassRoom, pk=kwargs.get('class_id'))
+        class_room = request_objects(request).class_room(kwargs.get('class_id'))
         class_room.students.remove(user_profile)
 
         return Response({}, status=204)
 
 
+class EnrollRoster(APIView):
+    """
+    enroll many students in the given class at once, only class teacher and superuser
+
+    body: {"usernames": [...]} or a multipart "file" csv with the usernames in the first column,
+    returns the number of new and existing enrollments and the unknown usernames
+    """
+    permission_classes = [IsAuthenticated, IsTeacherOrSuperuser]
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        class_room = request_objects(request).class_room(kwargs.get('class_id'))
+
+        serializer = RosterSerializer(data=request.data, context={'request': request, 'class_room': class_room})
+        serializer.is_valid(raise_exception=True)
+
+        return Response(serializer.save(), status=200)
+
+
 class ClassRoomRetrieveView(RetrieveAPIView):
     """
-    retrieve class room, list of students and quizzes will be returned
+    retrieve class room, quizzes and the number of students will be returned,
+    students are listed by ClassStudentsList
+
+    ?fields=id,class_name,quizzes&expand=quizzes selects the fields, see SparseFieldsMixin
     """
     permission_classes = [IsAuthenticated, IsEnrolledInClass | IsTeacherOrSuperuser]
     serializer_class = ClassRoomRetrieveSerializer
-    queryset = ClassRoom.objects.all()
 
     lookup_field = 'pk'
     lookup_url_kwarg = 'class_id'
 
+    def get_queryset(self):
+        queryset = ClassRoom.objects.all()
+        if ClassRoomRetrieveSerializer.expanded(self.request, 'teacher'):
+            queryset = queryset.select_related('teacher__user')
+        if ClassRoomRetrieveSerializer.included(self.request, 'students_count'):
+            queryset = queryset.annotate(num_students=Count('students'))
+        return queryset
+
+
+class ClassStudentsList(ListAPIView):
+    """
+    students of the class, cursor paginated
+    """
+    permission_classes = [IsAuthenticated, IsEnrolledInClass | IsTeacherOrSuperuser]
+    serializer_class = UserProfileSerializer
+    pagination_class = OldestFirstCursorPagination
+
+    def get_queryset(self):
+        the_class = request_objects(self.request).class_room(self.kwargs.get('class_id'))
+        return the_class.students.all().select_related('user')
+
 
 class ClassList(ListAPIView):
     """
-        List of all classes with basic info
+        List of all classes with basic info, cursor paginated newest first
     """
     permission_classes = [IsAuthenticated, ]
     serializer_class = ClassRoomSerializer
-    queryset = ClassRoom.objects.all().order_by('-id')
+    pagination_class = NewestFirstCursorPagination
+    queryset = ClassRoom.objects.select_related('teacher__user').annotate(num_students=Count('students'))
 
 
 class ClassRoomUpdateView(RetrieveUpdateDestroyAPIView):
@@ -276,3 +550,57 @@ class ClassRoomUpdateView(RetrieveUpdateDestroyAPIView):
 
     lookup_field = 'pk'
     lookup_url_kwarg = 'class_id'
+
+
+class EventStream(APIView):
+    """
+    server-sent events of a quiz or class, served by core.async_exam under ASGI only
+    """
+
+    def get(self, request, *args, **kwargs):
+        raise NotFound(_("Event streams are only served by the ASGI application"))
+
+
+class EventTicket(APIView):
+    """
+    a short lived, single use ticket to open an event stream with ?ticket=
+    """
+    permission_classes = [IsAuthenticated, ]
+
+    def post(self, request, *args, **kwargs):
+        return Response({'ticket': issue_ticket(request.user), 'expires_in': settings.EVENT_TICKET_MAX_AGE})
+
+
+class ProfileList(APIView):
+    """
+    sampled request profiles with their sample counts, superusers only
+    """
+    permission_classes = [IsAuthenticated, IsSuperuser]
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        return Response({'profiles': [{'name': name, 'samples': samples}
+                                      for name, samples in list_profiles().items()]})
+
+
+class ProfileDetail(APIView):
+    """
+    collapsed stacks of a profile, for flamegraph.pl or speedscope, superusers only
+
+    delete removes the profile
+    """
+    permission_classes = [IsAuthenticated, IsSuperuser]
+
+    @staticmethod
+    def path(name):
+        path = profile_path(name)
+        if name != profile_name(name) or not os.path.isfile(path):
+            raise NotFound()
+        return path
+
+    def get(self, request, *args, **kwargs):
+        return FileResponse(open(self.path(kwargs.get('name')), 'rb'), content_type='text/plain; charset=utf-8')
+
+    def delete(self, request, *args, **kwargs):
+        os.remove(self.path(kwargs.get('name')))
+        return Response({}, status=204)
@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'teachingPlatfrom.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+from core.async_exam import ASGIHandler, ExamEndpointsRouter  # noqa: E402
+
+# event streams, and the exam endpoints with ASYNC_EXAM_ENDPOINTS on, are served by the router
+application = ExamEndpointsRouter(ASGIHandler())
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.profiling.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -56,6 +60,27 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per route request, query and serializer metrics served at /metrics in the prometheus format
+# to scrapers sending "Authorization: Bearer <METRICS_TOKEN>" or connecting from METRICS_ALLOWED_IPS
+# (comma separated). Both are empty by default, don't allow the ip of a reverse proxy.
+# Requests slower than SLOW_REQUEST_THRESHOLD seconds are logged with their SQL to the
+# core.slow_requests logger, 0 turns the log off.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip]
+SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0))
+
+# Sampling profiler: requests with an "X-Profile: <PROFILER_SECRET>" header, and PROFILER_SAMPLE_RATE
+# of all requests, have their stacks sampled every PROFILER_INTERVAL seconds. Samples are merged
+# per route into collapsed stack files in PROFILER_DIR, served to superusers at api/profiles/.
+PROFILER_SECRET = os.environ.get('PROFILER_SECRET', '')
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+PROFILER_DIR = os.environ.get('PROFILER_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+if not METRICS_ENABLED:
+    MIDDLEWARE.remove('core.metrics.MetricsMiddleware')
+
 ROOT_URLCONF = 'teachingPlatfrom.urls'
 
 TEMPLATES = [
@@ -80,12 +105,72 @@ WSGI_APPLICATION = 'teachingPlatfrom.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# DATABASE_ENGINE selects the profile: 'sqlite' (default) or 'postgresql'.
+# Connections are kept open for DATABASE_CONN_MAX_AGE seconds and checked before reuse
+# when DATABASE_HEALTH_CHECKS is on. For pooling many workers on postgresql, put pgbouncer
+# in front and point DATABASE_HOST/DATABASE_PORT at it.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'teaching_platform'),
+            'USER': os.environ.get('DATABASE_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        }
+    }
+elif DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            # django's sqlite backend, write transactions start with BEGIN IMMEDIATE
+            'ENGINE': 'core.sqlite_backend',
+            'NAME': os.environ.get('DATABASE_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                # seconds a writer waits for the lock before "database is locked"
+                'timeout': 20,
+            },
+        }
     }
+else:
+    raise ImproperlyConfigured("Unknown DATABASE_ENGINE %r" % DATABASE_ENGINE)
+
+DATABASE_HEALTH_CHECKS = os.environ.get('DATABASE_HEALTH_CHECKS', '1') == '1'
+
+# Applied to every new sqlite connection, set SQLITE_TUNING=0 to keep sqlite defaults.
+# WAL lets readers run during a write, NORMAL sync is safe with WAL.
+SQLITE_TUNED_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRAGMAS = SQLITE_TUNED_PRAGMAS if os.environ.get('SQLITE_TUNING', '1') == '1' else {}
+
+
+# Password hashing
+# PASSWORD_HASHER_PROFILE selects the PBKDF2 iteration count. Passwords hashed with another
+# count keep working and are rehashed on the next login, so profiles can be switched freely.
+# 'fast' trades brute force resistance for login throughput, e.g. for exam start login spikes.
+
+PASSWORD_HASHER_PROFILES = {
+    'default': 180000,
+    'fast': 30000,
 }
+PASSWORD_HASHER_PROFILE = os.environ.get('PASSWORD_HASHER_PROFILE', 'default')
+
+PASSWORD_HASHERS = [
+    'core.hashers.ProfilePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
 
 
 # Password validation
@@ -130,10 +215,83 @@ STATIC_URL = '/static/'
 CORS_ORIGIN_ALLOW_ALL = True
 
 
+# Seconds to cache the class ids each student is enrolled in, 0 disables the cache.
+# Use a cache shared between workers (memcached, redis) when enabling it,
+# invalidation only reaches the configured cache backend.
+ENROLLMENT_CACHE_TIMEOUT = int(os.environ.get('ENROLLMENT_CACHE_TIMEOUT', 0))
+
+# Seconds to keep a serialized quiz question list, keys include the quiz questions version
+QUESTIONS_CACHE_TIMEOUT = int(os.environ.get('QUESTIONS_CACHE_TIMEOUT', 60 * 60))
+
+# Write-behind mode of submit-answer: answers are journaled to ANSWER_JOURNAL_DIR, acknowledged
+# and written in batches every ANSWER_FLUSH_INTERVAL seconds (or at the quiz end).
+# Run `manage.py flush_answer_buffer` after a crash to replay journals left behind.
+ANSWER_WRITE_BEHIND = os.environ.get('ANSWER_WRITE_BEHIND', '') == '1'
+ANSWER_FLUSH_INTERVAL = float(os.environ.get('ANSWER_FLUSH_INTERVAL', 2))
+ANSWER_JOURNAL_DIR = os.environ.get('ANSWER_JOURNAL_DIR', os.path.join(BASE_DIR, 'answer_journal'))
+ANSWER_JOURNAL_FSYNC = os.environ.get('ANSWER_JOURNAL_FSYNC', '1') == '1'
+
+
+# Serve question list, quiz start and answer submit natively async under ASGI (see core.async_exam),
+# their database work runs on ASYNC_DB_THREADS threads. Event streams are always served natively.
+ASYNC_EXAM_ENDPOINTS = os.environ.get('ASYNC_EXAM_ENDPOINTS', '0') == '1'
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 8))
+
+# Seconds to keep quiz statistics, score changes invalidate them right away.
+# Percentiles and histograms use numpy when it is installed and ANALYTICS_NUMPY is on.
+ANALYTICS_CACHE_TIMEOUT = int(os.environ.get('ANALYTICS_CACHE_TIMEOUT', 5 * 60))
+ANALYTICS_NUMPY = os.environ.get('ANALYTICS_NUMPY', '1') == '1'
+
+# Encode and decode api json with orjson when it is installed, see core.renderers
+ORJSON_ENABLED = os.environ.get('ORJSON_ENABLED', '1') == '1'
+
+# Auto graders selectable per question (Question.grading), see core.grading
+ANSWER_GRADERS = {
+    'exact': 'core.grading.ExactMatchGrader',
+    'regex': 'core.grading.RegexGrader',
+}
+
+# Background tasks (e.g. auto grading) run on TASK_WORKERS threads of the process,
+# TASKS_EAGER=1 runs them right away in the requesting thread
+TASK_WORKERS = int(os.environ.get('TASK_WORKERS', 4))
+TASKS_EAGER = os.environ.get('TASKS_EAGER', '') == '1'
+
+# Quiz and class events are streamed from the ASGI application at quiz/<id>/events/ and
+# class/<id>/events/ (see core.events). The in-memory broker reaches clients of the same process,
+# use a redis backed broker with the same interface when running several workers.
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'core.events.InMemoryBroker')
+EVENT_HEARTBEAT_INTERVAL = 15
+# Seconds a stream ticket from api/events/ticket/ stays valid, each ticket opens one stream.
+# Tickets are remembered in the default cache, share it between workers.
+EVENT_TICKET_MAX_AGE = int(os.environ.get('EVENT_TICKET_MAX_AGE', 30))
+
+# Tokens resolved by CachedTokenAuthentication are kept per process for TOKEN_CACHE_TIMEOUT seconds
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TIMEOUT = int(os.environ.get('TOKEN_CACHE_TIMEOUT', 60))
+
+# API_AUTHENTICATION=token leaves only token authentication on the API path
+API_AUTHENTICATION = os.environ.get('API_AUTHENTICATION', 'all')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
+    ] if API_AUTHENTICATION == 'token' else [
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication'
-    ]
+    ],
+    # core.renderers encode and decode with orjson when it is installed and ORJSON_ENABLED is on
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.renderers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'login_username': os.environ.get('LOGIN_USERNAME_RATE', '10/min'),
+        'login_ip': os.environ.get('LOGIN_IP_RATE', '600/min'),
+    },
 }
\ No newline at end of file